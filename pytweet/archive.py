@@ -0,0 +1,651 @@
+"""
+Append-only binary archive for statuses and search results.
+
+An archive is two files: `name.dat` with compact binary records and
+`name.idx`, a side index of fixed size (id, created_at, offset) entries
+in append order. Readers mmap both, so opening an archive doesn't load
+it: records are looked up in the index and decoded lazily, field by
+field, straight from the mapped file.
+
+Pagination walks append newest first, and a second walk or a sync appends
+newer ids after older ones, so the index is not sorted. Lookups go
+through sorted runs instead: `name.runN` files with the (id, offset) and
+(created_at, offset) entries of a batch of appends, sorted, and a
+`name.runs` manifest listing them. Writers add a run on every flush and
+merge it with the newest runs while they are less than twice its size,
+so there are only a few runs, the oldest the largest. Runs and the
+manifest are never changed in place, readers that mapped them are safe.
+
+Record layout (little endian):
+
+    length (uint32), kind (uint8), flags (uint8),
+    integer fields (int64 each), string lengths (uint16 each),
+    strings (UTF-8)
+
+Usage:
+
+    writer = ArchiveWriter('tweets')
+    writer.extend(api.user_timeline('reflejo'))  # any PaginationSet
+    writer.close()
+
+    archive = Archive('tweets')
+    archive.get(4000000000).text
+    for record in archive.between(datetime(2009, 9, 1), datetime(2009, 10, 1)):
+        print record.id, record.text
+
+"""
+
+import calendar
+import datetime
+import heapq
+import mmap
+import os
+import struct
+from array import array
+from objects import TwitterStatus, TwitterSearchResult
+
+DATA_MAGIC = 'PTWA\x01\x00\x00\x00'
+INDEX_MAGIC = 'PTWI\x01'
+
+# Index header: magic (5 bytes), order (1 byte), padding (2 bytes)
+INDEX_HEADER = 8
+INDEX_ENTRY = struct.Struct('<qqQ')
+
+# Index order flags.
+ORDER_EMPTY, ORDER_ASCENDING, ORDER_DESCENDING, ORDER_NONE = range(4)
+
+# Sorted runs: magic, then count (key, offset) entries sorted by id and
+# the same entries sorted by created_at.
+RUN_MAGIC = 'PTWR\x01\x00\x00\x00'
+RUN_ENTRY = struct.Struct('<qQ')
+BY_ID, BY_TIME = 0, 1
+# Manifest: magic and index entries covered by runs, then (sequence
+# number, entries) of every run, oldest first.
+MANIFEST_HEADER = struct.Struct('<8sQ')
+MANIFEST_MAGIC = 'PTWM\x01\x00\x00\x00'
+MANIFEST_RUN = struct.Struct('<QQ')
+# Runs are merged anyway when there are this many.
+MAX_RUNS = 32
+# Ids are stored as C longs, 64 bits in every platform we run on.
+INT_TYPECODE = 'l'
+# Index entries sorted in memory at once when building a run.
+SORT_CHUNK = 1 << 20
+# Entries read or written at once.
+IO_ENTRIES = 4096
+
+RECORD_HEADER = struct.Struct('<IBB')
+
+KIND_STATUS = 1
+KIND_SEARCH_RESULT = 2
+
+# Fields by record kind: (result class, integer fields, boolean flags,
+# string fields). created_at is stored as seconds since epoch.
+KINDS = {
+    KIND_STATUS: (TwitterStatus,
+                  ('id', 'created_at', 'user_id', 'in_reply_to_status_id',
+                   'in_reply_to_user_id'),
+                  ('truncated', 'favorited'),
+                  ('text', 'source', 'screen_name',
+                   'in_reply_to_screen_name')),
+    KIND_SEARCH_RESULT: (TwitterSearchResult,
+                         ('id', 'created_at', 'from_user_id', 'to_user_id'),
+                         (),
+                         ('text', 'from_user', 'to_user', 'iso_language_code',
+                          'source', 'profile_image_url')),
+}
+
+
+def _timestamp(date):
+    return calendar.timegm(date.utctimetuple()) if date else 0
+
+
+def _fromtimestamp(timestamp):
+    return datetime.datetime.utcfromtimestamp(timestamp) if timestamp \
+           else None
+
+
+def _run_path(path, seq):
+    return '%s.run%d' % (path, seq)
+
+
+def _read_manifest(path):
+    # (index entries covered, [(seq, count)]) of an archive. Archives
+    # written before sorted runs have no manifest, nothing is covered.
+    if not os.path.exists(path + '.runs'):
+        return 0, []
+
+    fp = open(path + '.runs', 'rb')
+    try:
+        data = fp.read()
+    finally:
+        fp.close()
+
+    magic, covered = MANIFEST_HEADER.unpack_from(data)
+    if magic != MANIFEST_MAGIC:
+        raise ValueError("%s is not a pytweet archive" % path)
+
+    return covered, [MANIFEST_RUN.unpack_from(data, pos) for pos in
+                     xrange(MANIFEST_HEADER.size, len(data),
+                            MANIFEST_RUN.size)]
+
+
+def _write_manifest(path, covered, runs):
+    # Write and rename, so readers see either the old runs or the new.
+    tmp = path + '.runs.tmp'
+    fp = open(tmp, 'wb')
+    try:
+        fp.write(MANIFEST_HEADER.pack(MANIFEST_MAGIC, covered))
+        fp.write(''.join([MANIFEST_RUN.pack(*run) for run in runs]))
+        fp.flush()
+        os.fsync(fp.fileno())
+    finally:
+        fp.close()
+
+    os.rename(tmp, path + '.runs')
+
+
+def _write_entries(fp, entries):
+    # Write sorted (key, offset) entries in blocks. Returns the count.
+    count = 0
+    block = []
+    for entry in entries:
+        block.append(RUN_ENTRY.pack(*entry))
+        if len(block) >= IO_ENTRIES:
+            fp.write(''.join(block))
+            count += len(block)
+            block = []
+
+    fp.write(''.join(block))
+    return count + len(block)
+
+
+class _Run(object):
+    # A mapped run file.
+
+    def __init__(self, path, seq, count):
+        self.path = _run_path(path, seq)
+        self.seq = seq
+        self.count = count
+        self._file = open(self.path, 'rb')
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._map[:len(RUN_MAGIC)] != RUN_MAGIC:
+            self.close()
+            raise ValueError("%s is not a pytweet archive run" % self.path)
+
+    def close(self):
+        self._map.close()
+        self._file.close()
+
+    def _entry(self, part, i):
+        return RUN_ENTRY.unpack_from(self._map, len(RUN_MAGIC) + \
+                                     (part * self.count + i) * RUN_ENTRY.size)
+
+    def _bisect(self, part, key):
+        # First position with a key >= key.
+        lo, hi = 0, self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._entry(part, mid)[0] < key:
+                lo = mid + 1
+            else:
+                hi = mid
+
+        return lo
+
+    def find(self, id):
+        # Offset of the record with the given id, or None.
+        i = self._bisect(BY_ID, id)
+        if i < self.count:
+            key, offset = self._entry(BY_ID, i)
+            if key == id:
+                return offset
+
+        return None
+
+    def entries(self, part, start=None, stop=None):
+        # (key, offset) with start <= key < stop, sorted.
+        i = 0 if start is None else self._bisect(part, start)
+        while i < self.count:
+            entry = self._entry(part, i)
+            if stop is not None and entry[0] >= stop:
+                return
+            yield entry
+            i += 1
+
+
+def _layout(kind):
+    # Precompute structs and field positions of a record kind.
+    resultclass, ints, flags, strings = KINDS[kind]
+    ints_struct = struct.Struct('<%dq' % len(ints))
+    lengths_struct = struct.Struct('<%dH' % len(strings))
+    return {
+        'class': resultclass,
+        'ints': ints_struct,
+        'lengths': lengths_struct,
+        'int_fields': dict([(name, i) for i, name in enumerate(ints)]),
+        'flag_fields': dict([(name, i) for i, name in enumerate(flags)]),
+        'string_fields': dict([(name, i) for i, name in enumerate(strings)]),
+    }
+
+LAYOUTS = dict([(kind, _layout(kind)) for kind in KINDS])
+
+
+def encode(obj):
+    """
+    Encode a TwitterStatus or TwitterSearchResult as a binary record.
+    """
+    if isinstance(obj, TwitterStatus):
+        kind = KIND_STATUS
+        user = obj.user
+        values = {
+            'user_id': user and user.id,
+            'screen_name': user and user.screen_name,
+        }
+    elif isinstance(obj, TwitterSearchResult):
+        kind = KIND_SEARCH_RESULT
+        values = {}
+    else:
+        raise TypeError("Only statuses and search results can be archived")
+
+    _, ints, flags, strings = KINDS[kind]
+    layout = LAYOUTS[kind]
+    get = lambda name: values[name] if name in values \
+                       else getattr(obj, name, None)
+
+    int_values = [_timestamp(obj.created_at) if name == 'created_at' \
+                  else (get(name) or 0) for name in ints]
+    flag_bits = sum([1 << i for i, name in enumerate(flags) if get(name)])
+    encoded = [(get(name) or u'').encode('utf8') for name in strings]
+
+    body = layout['ints'].pack(*int_values) + \
+           layout['lengths'].pack(*[len(s) for s in encoded]) + \
+           ''.join(encoded)
+    return RECORD_HEADER.pack(RECORD_HEADER.size + len(body), kind,
+                              flag_bits) + body
+
+
+class Record(object):
+    """
+    Lazy view of a record in a mapped archive. Fields are decoded when
+    accessed; raw_text returns the text bytes as a buffer, with no copy.
+    """
+
+    __slots__ = ('_buf', '_offset', '_kind', '_flags', '_layout')
+
+    def __init__(self, buf, offset):
+        self._buf = buf
+        self._offset = offset
+        _, self._kind, self._flags = RECORD_HEADER.unpack_from(buf, offset)
+        self._layout = LAYOUTS[self._kind]
+
+    @property
+    def kind(self):
+        return self._kind
+
+    def _string_span(self, idx):
+        layout = self._layout
+        start = self._offset + RECORD_HEADER.size + layout['ints'].size
+        lengths = layout['lengths'].unpack_from(self._buf, start)
+        start += layout['lengths'].size + sum(lengths[:idx])
+        return start, lengths[idx]
+
+    def raw(self, name):
+        """
+        Returns a string field as an UTF-8 buffer over the archive.
+        """
+        start, length = self._string_span(self._layout['string_fields'][name])
+        return buffer(self._buf, start, length)
+
+    @property
+    def raw_text(self):
+        return self.raw('text')
+
+    def __getattr__(self, name):
+        layout = self._layout
+        if name in layout['int_fields']:
+            idx = layout['int_fields'][name]
+            value = struct.unpack_from('<q', self._buf, self._offset + \
+                                       RECORD_HEADER.size + idx * 8)[0]
+            if name == 'created_at':
+                return _fromtimestamp(value)
+            return value or None
+
+        if name in layout['flag_fields']:
+            return bool(self._flags & (1 << layout['flag_fields'][name]))
+
+        if name in layout['string_fields']:
+            start, length = self._string_span(layout['string_fields'][name])
+            if not length:
+                return None
+            return self._buf[start:start + length].decode('utf8')
+
+        raise AttributeError(name)
+
+    def to_object(self):
+        """
+        Build the TwitterStatus or TwitterSearchResult this record holds.
+        """
+        _, ints, flags, strings = KINDS[self._kind]
+        values = dict([(name, getattr(self, name) or None)
+                       for name in ints + flags + strings])
+        if self._kind == KIND_STATUS:
+            values['user'] = {'id': values.pop('user_id'),
+                              'screen_name': values.pop('screen_name')}
+
+        obj = object.__new__(self._layout['class'])
+        obj.__dict__.update(dict([(key, None) for key \
+                                  in obj._transformation]))
+        obj.__dict__.update(values)
+        if self._kind == KIND_STATUS:
+            obj.user = obj._transformation['user'](**obj.user)
+
+        return obj
+
+
+class ArchiveWriter(object):
+    """
+    Appends records to an archive (created if it doesn't exist). Records
+    appended are added to the sorted runs on flush (and close).
+    """
+
+    def __init__(self, path):
+        self.path = path
+        exists = os.path.exists(path + '.dat')
+        self._covered, self._runs = _read_manifest(path) if exists \
+                                    else (0, [])
+        self._next_seq = max([seq for seq, _ in self._runs] or [-1]) + 1
+        self._data = open(path + '.dat', 'ab')
+        self._index = open(path + '.idx', 'r+b' if exists else 'w+b')
+
+        if exists:
+            self._index.seek(0)
+            header = self._index.read(INDEX_HEADER)
+            self.order = ord(header[5])
+            self._index.seek(0, os.SEEK_END)
+            size = self._index.tell()
+            self._last_id = None
+            if size > INDEX_HEADER:
+                self._index.seek(size - INDEX_ENTRY.size)
+                self._last_id = INDEX_ENTRY.unpack(
+                    self._index.read(INDEX_ENTRY.size))[0]
+        else:
+            self._data.write(DATA_MAGIC)
+            self._index.write(INDEX_MAGIC + chr(ORDER_EMPTY) + '\x00\x00')
+            self.order = ORDER_EMPTY
+            self._last_id = None
+
+        self._data.seek(0, os.SEEK_END)
+        self._offset = self._data.tell()
+        self._index.seek(0, os.SEEK_END)
+        if self._covered > self._entries():
+            # Index was truncated under the runs, start them over.
+            self._covered, self._runs = 0, []
+
+    def _update_order(self, id):
+        last = self._last_id
+        if last is None:
+            return
+
+        order = self.order
+        if order == ORDER_EMPTY:
+            order = ORDER_ASCENDING if id > last else ORDER_DESCENDING
+        elif (order == ORDER_ASCENDING and id <= last) or \
+             (order == ORDER_DESCENDING and id >= last):
+            order = ORDER_NONE
+
+        if order != self.order:
+            self.order = order
+            self._index.seek(5)
+            self._index.write(chr(order))
+            self._index.seek(0, os.SEEK_END)
+
+    def append(self, obj):
+        """
+        Append a TwitterStatus or TwitterSearchResult.
+        """
+        record = encode(obj)
+        self._data.write(record)
+        self._update_order(obj.id)
+        self._index.write(INDEX_ENTRY.pack(obj.id, _timestamp(obj.created_at),
+                                           self._offset))
+        self._offset += len(record)
+        self._last_id = obj.id
+
+    def extend(self, objects):
+        """
+        Append every object of an iterable, like a PaginationSet. Returns
+        how many were appended.
+        """
+        count = 0
+        for obj in objects:
+            self.append(obj)
+            count += 1
+
+        self.flush()
+        return count
+
+    def _entries(self):
+        # Index entries (index file is positioned at its end).
+        return (self._index.tell() - INDEX_HEADER) / INDEX_ENTRY.size
+
+    def flush(self):
+        """
+        Flush appended records and add them to the sorted runs.
+        """
+        self._data.flush()
+        self._index.flush()
+        os.fsync(self._data.fileno())
+        os.fsync(self._index.fileno())
+
+        total = self._entries()
+        while self._covered < total:
+            count = min(total - self._covered, SORT_CHUNK)
+            self._index.seek(INDEX_HEADER + self._covered * INDEX_ENTRY.size)
+            # Entries are three int64 (offsets fit in a signed one), C
+            # longs in every platform we run on.
+            values = array(INT_TYPECODE)
+            values.fromstring(self._index.read(count * INDEX_ENTRY.size))
+            self._index.seek(0, os.SEEK_END)
+
+            offsets = values[2::3]
+            self._add_run(sorted(zip(values[0::3], offsets)),
+                          sorted(zip(values[1::3], offsets)),
+                          self._covered + count)
+
+    def _add_run(self, by_id, by_time, covered):
+        # Write a run with new entries, merged with the newest runs while
+        # they are less than twice as large, and update the manifest.
+        merged = []
+        count = len(by_id)
+        while self._runs and (self._runs[-1][1] <= 2 * count or
+                              len(self._runs) >= MAX_RUNS):
+            seq, run_count = self._runs.pop()
+            merged.append(_Run(self.path, seq, run_count))
+            count += run_count
+
+        seq = self._next_seq
+        self._next_seq += 1
+        fp = open(_run_path(self.path, seq), 'wb')
+        try:
+            fp.write(RUN_MAGIC)
+            _write_entries(fp, heapq.merge(by_id, *[run.entries(BY_ID)
+                                                    for run in merged]))
+            _write_entries(fp, heapq.merge(by_time, *[run.entries(BY_TIME)
+                                                      for run in merged]))
+            fp.flush()
+            os.fsync(fp.fileno())
+        finally:
+            fp.close()
+
+        self._runs.append((seq, count))
+        self._covered = covered
+        _write_manifest(self.path, covered, self._runs)
+        for run in merged:
+            run.close()
+            os.remove(run.path)
+
+    def close(self):
+        self.flush()
+        self._data.close()
+        self._index.close()
+
+
+class Archive(object):
+    """
+    Read only view of an archive. Files are memory mapped, nothing is
+    loaded up front.
+
+    Lookups by id and time ranges are binary searches in the sorted runs,
+    whatever order records were appended in. Only records appended after
+    the last flush of a writer (there are none once it's closed) are
+    scanned.
+
+    >>> import os, tempfile
+    >>> path = os.path.join(tempfile.mkdtemp(), 'tweets')
+    >>> writer = ArchiveWriter(path)
+    >>> writer.extend([TwitterStatus(id=id, text='tweet &lt;%d&gt;' % id,
+    ...                              created_at='Fri Oct 02 12:00:0%d +0000 2009' % id,
+    ...                              user={'id': 1, 'screen_name': 'testpy'})
+    ...                for id in (3, 2, 1)])
+    3
+    >>> writer.close()
+    >>> archive = Archive(path)
+    >>> len(archive), archive.order == ORDER_DESCENDING
+    (3, True)
+    >>> record = archive.get(2)
+    >>> record.text, record.screen_name, str(record.raw_text)
+    (u'tweet <2>', u'testpy', 'tweet <2>')
+    >>> [r.id for r in archive.between(until=record.created_at)]
+    [1]
+    >>> status = record.to_object()
+    >>> status.user.screen_name, status.created_at
+    (u'testpy', datetime.datetime(2009, 10, 2, 12, 0, 2))
+    >>> archive.get(4) is None
+    True
+    >>> archive.close()
+
+    A second walk appends newer ids after older ones, and a third one
+    an older id again. Runs are merged, and lookups still don't scan:
+
+    >>> for ids in [(7, 6, 5), (4,)]:
+    ...     writer = ArchiveWriter(path)
+    ...     writer.extend([TwitterStatus(id=id, text='tweet',
+    ...                                  created_at='Fri Oct 02 12:00:0%d +0000 2009' % id)
+    ...                    for id in ids])
+    ...     writer.close()
+    3
+    1
+    >>> archive = Archive(path)
+    >>> archive.order == ORDER_NONE, len(archive.runs), archive.unindexed
+    (True, 2, 0)
+    >>> [archive.get(id).id for id in (1, 3, 4, 5, 7)]
+    [1, 3, 4, 5, 7]
+    >>> [r.id for r in archive.between(archive.get(2).created_at,
+    ...                                archive.get(7).created_at)]
+    [2, 3, 4, 5, 6]
+    >>> archive.close()
+
+    """
+
+    def __init__(self, path):
+        self.path = path
+        # Runs first: records and index entries they cover are flushed
+        # before the manifest is written, so they are in the files mapped
+        # after.
+        self.runs = self._open_runs()
+        self._data_file = open(path + '.dat', 'rb')
+        self._index_file = open(path + '.idx', 'rb')
+        self._data = mmap.mmap(self._data_file.fileno(), 0,
+                               access=mmap.ACCESS_READ)
+        self._index = mmap.mmap(self._index_file.fileno(), 0,
+                                access=mmap.ACCESS_READ)
+
+        if self._data[:len(DATA_MAGIC)] != DATA_MAGIC or \
+           self._index[:len(INDEX_MAGIC)] != INDEX_MAGIC:
+            raise ValueError("%s is not a pytweet archive" % path)
+
+        self.order = ord(self._index[5])
+        # Index entries not in runs yet, scanned by lookups.
+        self.unindexed = len(self) - self._covered
+
+    def _open_runs(self):
+        # Map the runs of the manifest. A writer may merge (and remove)
+        # some of them meanwhile: then read the new manifest.
+        while True:
+            self._covered, manifest = _read_manifest(self.path)
+            runs = []
+            try:
+                for seq, count in manifest:
+                    runs.append(_Run(self.path, seq, count))
+            except (IOError, OSError):
+                for run in runs:
+                    run.close()
+                continue
+
+            return runs
+
+    def close(self):
+        for run in self.runs:
+            run.close()
+        self._data.close()
+        self._index.close()
+        self._data_file.close()
+        self._index_file.close()
+
+    def __len__(self):
+        return (len(self._index) - INDEX_HEADER) / INDEX_ENTRY.size
+
+    def _entry(self, i):
+        return INDEX_ENTRY.unpack_from(self._index,
+                                       INDEX_HEADER + i * INDEX_ENTRY.size)
+
+    def __getitem__(self, i):
+        """
+        Record at position i (append order).
+        """
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError("Archive index out of range")
+
+        return Record(self._data, self._entry(i)[2])
+
+    def __iter__(self):
+        for i in xrange(len(self)):
+            yield self[i]
+
+    def get(self, id):
+        """
+        Returns the record with the given id or None.
+        """
+        for i in xrange(len(self) - 1, self._covered - 1, -1):
+            entry_id, _, offset = self._entry(i)
+            if entry_id == id:
+                return Record(self._data, offset)
+
+        for run in reversed(self.runs):
+            offset = run.find(id)
+            if offset is not None:
+                return Record(self._data, offset)
+
+        return None
+
+    def between(self, since=None, until=None):
+        """
+        Yields records created in [since, until) (datetimes, both
+        optional), oldest first.
+        """
+        since = _timestamp(since) if since else None
+        until = _timestamp(until) if until else None
+        unindexed = []
+        for i in xrange(self._covered, len(self)):
+            _, created_at, offset = self._entry(i)
+            if (since is None or created_at >= since) and \
+               (until is None or created_at < until):
+                unindexed.append((created_at, offset))
+
+        unindexed.sort()
+        for _, offset in heapq.merge(unindexed,
+                                     *[run.entries(BY_TIME, since, until)
+                                       for run in self.runs]):
+            yield Record(self._data, offset)
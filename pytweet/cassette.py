@@ -0,0 +1,154 @@
+"""
+Record and replay HTTP interactions. A RecordingTransport saves every
+request/response pair made through another transport to a cassette file,
+and a ReplayTransport serves them back later without the network. That
+makes performance regression tests deterministic.
+
+Requests are matched by method, URL and parameters, leaving out OAuth
+values that change on every request (nonce, timestamp and signature).
+
+Usage:
+
+    api = Twitter(transport=RecordingTransport('timeline.cassette'))
+    statuses = api.user_timeline('testpy')[:300]
+
+    api = Twitter(transport=ReplayTransport('timeline.cassette'))
+    statuses = api.user_timeline('testpy')[:300] # No network
+"""
+
+import cgi
+import collections
+import simplejson
+import threading
+import time
+import urlparse
+from transport import Transport, Response, UrllibTransport
+
+# Parameters that are different on every request.
+VOLATILE_PARAMS = ('oauth_nonce', 'oauth_timestamp', 'oauth_signature')
+
+
+class CassetteError(LookupError):
+    """Request was not found in the cassette"""
+
+
+def normalize(method, url, body=None):
+    """
+    Returns the key a request is recorded with.
+
+    >>> normalize('GET', 'https://twitter.com/a.json?b=1&a=2&oauth_nonce=3')
+    'GET https://twitter.com/a.json?a=2&b=1'
+
+    """
+    parts = urlparse.urlsplit(url)
+    params = cgi.parse_qsl(parts[3], keep_blank_values=True)
+    if body:
+        params.extend(cgi.parse_qsl(body, keep_blank_values=True))
+
+    params = sorted([(k, v) for k, v in params if k not in VOLATILE_PARAMS])
+    query = '&'.join(['%s=%s' % param for param in params])
+    url = urlparse.urlunsplit(parts[:3] + (query, ''))
+    return '%s %s' % (method.upper(), url)
+
+
+def _encode_body(body):
+    try:
+        return {'body': body.decode('utf8')}
+    except UnicodeDecodeError:
+        return {'body_base64': body.encode('base64')}
+
+
+def _decode_body(record):
+    if 'body_base64' in record:
+        return record['body_base64'].decode('base64')
+
+    return record['body'].encode('utf8')
+
+
+class RecordingTransport(Transport):
+    """
+    Makes requests with `transport` and appends them to the cassette at
+    `path`, one JSON record per line.
+    """
+
+    def __init__(self, path, transport=None):
+        self.path = path
+        self.transport = transport or UrllibTransport()
+        self._lock = threading.Lock()
+
+    def request(self, method, url, headers=None, body=None, timeout=None):
+        start = time.time()
+        response = self.transport.request(method, url, headers, body, timeout)
+        record = {
+            'key': normalize(method, url, body),
+            'code': response.code,
+            'reason': response.reason,
+            'headers': response.headers,
+            'elapsed': time.time() - start,
+            'wire_bytes': response.wire_bytes,
+            'timings': response.timings,
+        }
+        record.update(_encode_body(response.body))
+
+        self._lock.acquire()
+        try:
+            cassette = open(self.path, 'a')
+            try:
+                cassette.write(simplejson.dumps(record) + '\n')
+            finally:
+                cassette.close()
+        finally:
+            self._lock.release()
+
+        return response
+
+    def close(self):
+        self.transport.close()
+
+
+class ReplayTransport(Transport):
+    """
+    Serves responses recorded in the cassette at `path`. When a request
+    was recorded many times, responses are served in the same order and
+    the last one is repeated.
+
+    params are:
+        path: Cassette file
+        realtime: If True wait as much as the recorded request took,
+                  otherwise replay at full speed. [optional]
+    """
+
+    def __init__(self, path, realtime=False):
+        self.realtime = realtime
+        self._records = collections.defaultdict(collections.deque)
+        self._lock = threading.Lock()
+
+        cassette = open(path)
+        try:
+            for line in cassette:
+                if line.strip():
+                    record = simplejson.loads(line)
+                    record['body'] = _decode_body(record)
+                    self._records[record['key']].append(record)
+        finally:
+            cassette.close()
+
+    def request(self, method, url, headers=None, body=None, timeout=None):
+        key = normalize(method, url, body)
+        self._lock.acquire()
+        try:
+            records = self._records.get(key)
+            if not records:
+                raise CassetteError("Request not recorded: %s" % key)
+            record = records.popleft() if len(records) > 1 else records[0]
+        finally:
+            self._lock.release()
+
+        if self.realtime:
+            time.sleep(record['elapsed'])
+
+        headers = dict([(str(k), str(v)) for k, v \
+                        in record['headers'].iteritems()])
+        return Response(record['code'], str(record['reason']), headers,
+                        record['body'], record['wire_bytes'],
+                        record.get('timings'))
@@ -0,0 +1,178 @@
+"""
+Columnar batches. Instead of one object per item, a batch holds one
+array per field, built straight from the decoded JSON:
+
+    integers (ids)    array('l') of int64, 0 for missing values
+    dates             array('l') of seconds since epoch, 0 if missing
+    booleans          array('b')
+    texts             lists of unicode, None if missing
+
+When NumPy is installed integer and boolean columns are NumPy arrays
+instead, ready for vectorized filtering and aggregation.
+
+Usage:
+
+    batch = api.search('python').columns(stop=5000,
+                                         fields=['id', 'from_user_id',
+                                                 'created_at', 'text'])
+    recent = batch['id'][batch['created_at'] > since]   # with NumPy
+
+"""
+
+import objects
+from array import array
+from parsers import parsedate, parsetimestamp, unescape
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# Integers are stored as C longs, 64 bits in every platform we run on.
+INT_TYPECODE = 'l'
+BOOL_TYPECODE = 'b'
+
+# Column kinds
+INT, TIMESTAMP, BOOL, TEXT = 'int', 'timestamp', 'bool', 'text'
+
+
+def _kind(fc):
+    if fc is int:
+        return INT
+    if fc is parsedate:
+        return TIMESTAMP
+    if fc is bool:
+        return BOOL
+    if fc is unicode or fc is unescape:
+        return TEXT
+
+    # Nested object
+    return None
+
+
+def column_kinds(resultclass, fields=None):
+    """
+    Returns [(field, path, kind, converter)] for the given fields, or every
+    plain (not nested) field of resultclass. Fields of nested objects are
+    named with dots, like 'user.id'.
+    """
+    if fields is None:
+        fields = sorted([key for key, fc in \
+                         resultclass._transformation.iteritems()
+                         if _kind(fc) is not None])
+
+    kinds = []
+    for field in fields:
+        path = field.split('.')
+        cls = resultclass
+        for key in path[:-1]:
+            cls = cls._transformation[key]
+            if isinstance(cls, str):
+                cls = getattr(objects, cls)
+
+        fc = cls._transformation[path[-1]]
+        kind = _kind(fc)
+        if kind is None:
+            raise ValueError("%s is an object, pick one of its fields" % \
+                             field)
+
+        kinds.append((field, path, kind, fc))
+
+    return kinds
+
+
+class Columns(dict):
+    """
+    Columns of a batch, by field name. len() is the number of items.
+
+    >>> from objects import TwitterStatus
+    >>> batch = Columns.from_items(TwitterStatus, [
+    ...     {'id': 2, 'text': 'a &amp; b', 'user': {'id': 7},
+    ...      'created_at': 'Fri Oct 02 12:00:00 +0000 2009'},
+    ...     {'id': 1, 'truncated': True}],
+    ...     fields=['id', 'created_at', 'text', 'truncated', 'user.id'])
+    >>> len(batch), list(batch['id']), list(batch['created_at'])
+    (2, [2, 1], [1254484800, 0])
+    >>> batch['text'], list(batch['truncated']), list(batch['user.id'])
+    ([u'a & b', None], [0, 1], [7, 0])
+
+    """
+
+    def __init__(self, kinds):
+        dict.__init__(self)
+        self.kinds = kinds
+        self.size = 0
+        for field, _, kind, _ in kinds:
+            if kind == TEXT:
+                self[field] = []
+            else:
+                self[field] = array(BOOL_TYPECODE if kind == BOOL \
+                                    else INT_TYPECODE)
+
+    def __len__(self):
+        return self.size
+
+    @classmethod
+    def from_items(cls, resultclass, items, fields=None):
+        """
+        Build columns from raw API items (dicts).
+        """
+        batch = cls(column_kinds(resultclass, fields))
+        batch.append(items)
+        return batch
+
+    def append(self, items):
+        """
+        Add raw API items (dicts) to the batch.
+        """
+        for field, path, kind, fc in self.kinds:
+            values = items
+            for key in path:
+                values = [value.get(key) if value else None
+                          for value in values]
+
+            if kind == INT:
+                values = [value and int(value) or 0 for value in values]
+            elif kind == TIMESTAMP:
+                values = [value and parsetimestamp(value) or 0
+                          for value in values]
+            elif kind == BOOL:
+                values = [value and 1 or 0 for value in values]
+            else:
+                values = [value and fc(value) or None for value in values]
+
+            self[field].extend(values)
+
+        self.size += len(items)
+
+    def extend(self, other, rows=None):
+        """
+        Add the items of another batch with the same fields, or only the
+        ones at positions `rows`.
+        """
+        for field in self:
+            values = other[field]
+            if rows is not None:
+                values = [values[row] for row in rows]
+            self[field].extend(values)
+
+        self.size += other.size if rows is None else len(rows)
+
+    def finish(self):
+        """
+        Batch as returned to users: converted to NumPy if it's installed.
+        """
+        return self.to_numpy() if numpy is not None else self
+
+    def to_numpy(self):
+        """
+        Convert integer and boolean columns to NumPy arrays (in place).
+        Returns the batch.
+        """
+        for field, _, kind, _ in self.kinds:
+            if kind == BOOL:
+                self[field] = numpy.array(self[field], dtype=numpy.bool_)
+            elif kind != TEXT:
+                self[field] = numpy.array(self[field], dtype=numpy.int64)
+
+        return self
@@ -0,0 +1,82 @@
+"""
+HTTP response compression. We ask for gzip/deflate bodies and decompress
+them as chunks arrive from the socket, so a compressed page is never kept
+in memory next to its decompressed copy.
+"""
+
+import zlib
+
+ACCEPT_ENCODING = 'gzip, deflate'
+CHUNK_SIZE = 16 * 1024
+
+
+class Decoder(object):
+    """
+    Incremental decoder for a Content-Encoding. It also counts bytes
+    received from the wire and bytes after decoding.
+
+    >>> import StringIO
+    >>> compressor = zlib.compressobj()
+    >>> data = compressor.compress('{"a": 1}' * 100) + compressor.flush()
+    >>> decoder = Decoder('deflate')
+    >>> decoder.read(StringIO.StringIO(data)) == '{"a": 1}' * 100
+    True
+    >>> decoder.wire_bytes < decoder.decoded_bytes
+    True
+
+    """
+
+    def __init__(self, encoding=None):
+        self.encoding = (encoding or '').strip().lower()
+        self.wire_bytes = 0
+        self.decoded_bytes = 0
+
+        if self.encoding in ('gzip', 'x-gzip'):
+            self._decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        elif self.encoding == 'deflate':
+            self._decompressor = zlib.decompressobj()
+        else:
+            self._decompressor = None
+
+    def decompress(self, chunk):
+        """
+        Decode a chunk of the body. Returns decoded data available so far.
+        """
+        self.wire_bytes += len(chunk)
+        if self._decompressor is None:
+            data = chunk
+        else:
+            try:
+                data = self._decompressor.decompress(chunk)
+            except zlib.error:
+                if self.encoding != 'deflate' or self.wire_bytes > len(chunk):
+                    raise
+
+                # Some servers send raw deflate streams (no zlib header).
+                self._decompressor = zlib.decompressobj(-zlib.MAX_WBITS)
+                data = self._decompressor.decompress(chunk)
+
+        self.decoded_bytes += len(data)
+        return data
+
+    def flush(self):
+        if self._decompressor is None:
+            return ''
+
+        data = self._decompressor.flush()
+        self.decoded_bytes += len(data)
+        return data
+
+    def read(self, response, chunk_size=CHUNK_SIZE):
+        """
+        Read a whole file-like response and return it decoded.
+        """
+        parts = []
+        while True:
+            chunk = response.read(chunk_size)
+            if not chunk:
+                break
+            parts.append(self.decompress(chunk))
+
+        parts.append(self.flush())
+        return ''.join(parts)
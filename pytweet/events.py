@@ -0,0 +1,65 @@
+"""
+Instrumentation hooks. The client emits structured events for every
+request, JSON decode and page of objects built, so time can be attributed
+to the network or to the library. Subscribers are plain callables taking
+the event name and a dict of data.
+
+Events are only built when somebody is listening: callers check the hooks
+object truth value first, so an empty registry costs a single test.
+
+Events emitted by pytweet:
+
+    request: endpoint, method, host, status, error, attempt, wire_bytes,
+             bytes, connect, ttfb, read, elapsed (times in seconds)
+    parse: endpoint, bytes, decode
+    construct: endpoint, resultclass, items, construct
+    page: endpoint, resultclass, page, items, construct
+    slice: endpoint, pages (fetched to serve a result set slice, 0 if it
+           was served from cache). Not emitted for items or iteration.
+    retry: endpoint, attempt, wait, error
+    ratelimit: endpoint, priority, wait (seconds the rate limiter waited)
+
+Usage:
+
+    >>> hooks = Hooks()
+    >>> bool(hooks)
+    False
+    >>> seen = []
+    >>> hooks.subscribe(lambda name, data: seen.append((name, data)))
+    >>> hooks.emit('parse', endpoint='/search.json', decode=0.001)
+    >>> seen
+    [('parse', {'decode': 0.001, 'endpoint': '/search.json'})]
+
+"""
+
+
+class Hooks(object):
+    """
+    Event subscribers registry.
+    """
+
+    def __init__(self):
+        self._subscribers = []
+
+    def __nonzero__(self):
+        return bool(self._subscribers)
+
+    def subscribe(self, callback, events=None):
+        """
+        Register `callback(name, data)`. If `events` is given only those
+        events are sent to it.
+        """
+        self._subscribers.append((callback, events and frozenset(events)))
+
+    def unsubscribe(self, callback):
+        self._subscribers = [(cb, events) for cb, events in self._subscribers
+                             if cb != callback]
+
+    def emit(self, name, **data):
+        """
+        Send an event to every subscriber. Subscribers are called
+        synchronously, so they should be fast and must not raise.
+        """
+        for callback, events in self._subscribers:
+            if events is None or name in events:
+                callback(name, data)
@@ -0,0 +1,300 @@
+"""
+Streaming export of result sets to JSON Lines or CSV files, plain, gzip
+or zstd compressed (zstd needs the zstandard package).
+
+Items are written a chunk of pages at a time, so memory doesn't grow
+with the export. After each chunk a checkpoint with the next page,
+max_id and file size is saved next to the file; if the export is
+interrupted, running it again resumes from there. Each chunk is a
+complete gzip member (or zstd frame), and concatenated members are a
+valid file, so the data written before a crash is never lost.
+
+Usage:
+
+    api.user_timeline('reflejo').export('reflejo.jsonl.gz')
+    api.search('python').export('python.csv.zst',
+                                fields=['id', 'from_user', 'text'])
+
+"""
+
+import csv
+import cStringIO
+import datetime
+import gzip
+import os
+import simplejson
+from objects import TwitterObject
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Pages written between checkpoints.
+CHECKPOINT_PAGES = 10
+
+FORMATS = ('jsonl', 'csv')
+COMPRESSIONS = (None, 'gzip', 'zstd')
+
+
+def guess_format(path):
+    """
+    Format and compression from a file name.
+
+    >>> guess_format('tweets.csv.gz')
+    ('csv', 'gzip')
+    >>> guess_format('tweets.jsonl.zst')
+    ('jsonl', 'zstd')
+
+    """
+    compression = None
+    if path.endswith('.gz'):
+        compression, path = 'gzip', path[:-3]
+    elif path.endswith('.zst'):
+        compression, path = 'zstd', path[:-4]
+
+    return ('csv' if path.endswith('.csv') else 'jsonl'), compression
+
+
+def _gzip(data, level):
+    buf = cStringIO.StringIO()
+    fp = gzip.GzipFile(fileobj=buf, mode='wb', compresslevel=level or 6)
+    fp.write(data)
+    fp.close()
+    return buf.getvalue()
+
+
+def _csv_value(value):
+    if value is None:
+        return ''
+    if isinstance(value, datetime.datetime):
+        return value.isoformat()
+    if isinstance(value, unicode):
+        return value.encode('utf8')
+
+    return value
+
+
+def default_fields(resultclass):
+    """
+    CSV columns for a result class: its fields, with nested objects
+    replaced by their id.
+    """
+    fields = []
+    for key, fc in sorted(resultclass._transformation.iteritems()):
+        nested = isinstance(fc, str) or \
+                 (isinstance(fc, type) and issubclass(fc, TwitterObject))
+        fields.append('%s.id' % key if nested else key)
+
+    return fields
+
+
+class Exporter(object):
+    """
+    Exports a PaginationSet to a file.
+
+    params are:
+        resultset: PaginationSet to export
+        path: Output file
+        format: 'jsonl' or 'csv'. Guessed from path by default. [optional]
+        compression: None, 'gzip' or 'zstd'. Guessed from path by default.
+                     [optional]
+        fields: CSV columns, nested values with dots ('user.screen_name').
+                All fields by default. [optional]
+        checkpoint: Checkpoint file. Default is path + '.checkpoint'.
+                    [optional]
+        checkpoint_pages: Pages written between checkpoints. [optional]
+        level: Compression level. [optional]
+        parser: parallel.ParallelParser to decode pages in other processes.
+                [optional]
+
+    JSON Lines items are in API form (see TwitterObject.to_dict), so they
+    can be loaded back with resultclass(**simplejson.loads(line)).
+
+    >>> import os, tempfile
+    >>> from setobjects import TwitterStatusSet
+    >>> statuses = [{'id': id, 'text': 'tweet %d' % id} for id in range(250, 0, -1)]
+    >>> def fetch(uri, get_data, **kwargs):
+    ...     if get_data['page'] == 3 and not resumed: raise IOError('crash')
+    ...     page = [s for s in statuses if s['id'] <= (get_data['max_id'] or 250)]
+    ...     return page[(get_data['page'] - 1) * 100:get_data['page'] * 100]
+    >>> timeline = lambda: TwitterStatusSet(fetch, '/statuses/user_timeline.json',
+    ...                                     user='testpy')
+    >>> path = os.path.join(tempfile.mkdtemp(), 'tweets.jsonl.gz')
+    >>> resumed = False
+    >>> timeline().export(path, checkpoint_pages=1)
+    Traceback (most recent call last):
+    ...
+    IOError: crash
+    >>> resumed = True
+    >>> timeline().export(path, checkpoint_pages=1)
+    50
+    >>> lines = gzip.open(path).readlines()
+    >>> len(lines), simplejson.loads(lines[-1])['id']
+    (250, 1)
+    >>> os.path.exists(path + '.checkpoint')
+    False
+
+    If the file was removed after a crash, the export starts over:
+
+    >>> resumed = False
+    >>> timeline().export(path, checkpoint_pages=1)
+    Traceback (most recent call last):
+    ...
+    IOError: crash
+    >>> os.remove(path)
+    >>> resumed = True
+    >>> timeline().export(path, checkpoint_pages=1)
+    250
+
+    """
+
+    def __init__(self, resultset, path, format=None, compression=None,
+                 fields=None, checkpoint=None,
+                 checkpoint_pages=CHECKPOINT_PAGES, level=None, parser=None):
+        guessed_format, guessed_compression = guess_format(path)
+        self.resultset = resultset
+        self.path = path
+        self.format = format or guessed_format
+        self.compression = compression or guessed_compression
+        self.fields = fields or default_fields(resultset.resultclass)
+        self.checkpoint = checkpoint or path + '.checkpoint'
+        self.checkpoint_pages = checkpoint_pages
+        self.level = level
+        self.parser = parser
+
+        if self.format not in FORMATS:
+            raise ValueError("Unknown export format: %s" % self.format)
+        if self.compression not in COMPRESSIONS:
+            raise ValueError("Unknown compression: %s" % self.compression)
+        if self.compression == 'zstd' and zstandard is None:
+            raise ImportError("zstd compression needs the zstandard package")
+
+    def _compress(self, data):
+        if self.compression == 'gzip':
+            return _gzip(data, self.level)
+        if self.compression == 'zstd':
+            return zstandard.ZstdCompressor(level=self.level or 3) \
+                            .compress(data)
+
+        return data
+
+    def _row(self, item):
+        row = []
+        for field in self.fields:
+            value = item
+            for attr in field.split('.'):
+                value = getattr(value, attr, None)
+            row.append(_csv_value(value))
+
+        return row
+
+    def _serialize(self, items, header=False):
+        buf = cStringIO.StringIO()
+        if self.format == 'csv':
+            writer = csv.writer(buf)
+            if header:
+                writer.writerow(self.fields)
+            writer.writerows([self._row(item) for item in items])
+        else:
+            for item in items:
+                buf.write(simplejson.dumps(item.to_dict()))
+                buf.write('\n')
+
+        return buf.getvalue()
+
+    def _load_checkpoint(self):
+        if not os.path.exists(self.checkpoint):
+            return None
+
+        fp = open(self.checkpoint)
+        try:
+            return simplejson.load(fp)
+        finally:
+            fp.close()
+
+    def _save_checkpoint(self, state):
+        # Write and rename, so a crash never leaves half a checkpoint.
+        tmp = self.checkpoint + '.tmp'
+        fp = open(tmp, 'w')
+        try:
+            simplejson.dump(state, fp)
+            fp.flush()
+            os.fsync(fp.fileno())
+        finally:
+            fp.close()
+
+        os.rename(tmp, self.checkpoint)
+
+    def run(self):
+        """
+        Export (or resume exporting) the result set. Returns the number of
+        items exported by this run.
+        """
+        resultset = self.resultset
+        ordered = hasattr(resultset, 'max_id')
+        state = self._load_checkpoint()
+        if state and not os.path.exists(self.path):
+            # The file is gone, and what the checkpoint says with it.
+            state = None
+
+        if state:
+            # Drop whatever was written after the last checkpoint.
+            fp = open(self.path, 'r+b')
+            fp.seek(0, os.SEEK_END)
+            if fp.tell() < state['offset']:
+                fp.close()
+                raise ValueError("%s is shorter than its checkpoint, remove "
+                                 "%s to export again" % (self.path,
+                                                         self.checkpoint))
+            fp.truncate(state['offset'])
+            fp.seek(0, os.SEEK_END)
+            if ordered and state['max_id']:
+                resultset.max_id = state['max_id']
+        else:
+            fp = open(self.path, 'wb')
+            state = {'page': 1, 'max_id': None, 'last_id': None, 'count': 0,
+                     'offset': 0}
+
+        count = 0
+        pending, pages = [], 0
+        try:
+            for page, items in resultset.iterpages(state['page'],
+                                                     self.parser):
+                if ordered and state['last_id']:
+                    # Pages shouldn't move once pinned, just in case.
+                    items = [item for item in items
+                             if item.id < state['last_id']]
+
+                pending.extend(items)
+                pages += 1
+                if items:
+                    state['last_id'] = items[-1].id
+                state['page'] = page + 1
+
+                if pages >= self.checkpoint_pages:
+                    count += self._flush(fp, pending, state)
+                    pending, pages = [], 0
+
+            if pending:
+                count += self._flush(fp, pending, state)
+        finally:
+            fp.close()
+
+        if os.path.exists(self.checkpoint):
+            os.remove(self.checkpoint)
+
+        return count
+
+    def _flush(self, fp, items, state):
+        # Write a chunk and checkpoint after it.
+        header = self.format == 'csv' and state['offset'] == 0
+        fp.write(self._compress(self._serialize(items, header)))
+        fp.flush()
+        os.fsync(fp.fileno())
+
+        state['offset'] = fp.tell()
+        state['count'] += len(items)
+        state['max_id'] = getattr(self.resultset, 'max_id', None)
+        self._save_checkpoint(state)
+        return len(items)
@@ -0,0 +1,325 @@
+"""
+Social graph crawler. Walks followers and/or friends breadth first from
+some seed users, up to a depth, with a bounded number of concurrent
+requests.
+
+No TwitterUser is ever built: visited ids are kept in a seen.IdSet,
+edges in int64 arrays (one per user and direction) and only the
+requested user fields are stored, in columns.Columns. Progress is
+checkpointed to disk and a crawl that is interrupted resumes from
+there.
+
+With ids_only edges come from the ids endpoints, 5000 per request
+instead of 100 users, and no user field but the id is stored. Users can
+be hydrated later, only the ones needed, with api.lookup_users(ids).
+
+Usage:
+
+    crawler = GraphCrawler(api, ['reflejo'], depth=2,
+                           edges=('followers', 'friends'),
+                           fields=['id', 'screen_name', 'followers_count'],
+                           checkpoint='reflejo.graph')
+    graph = crawler.crawl()
+    graph.followers[user_id]         # array of follower ids
+    graph.users['followers_count']   # one value per visited user
+
+"""
+
+import cPickle
+import os
+import sys
+import threading
+import Queue
+from array import array
+from columns import Columns, column_kinds
+from objects import TwitterUser
+from seen import IdSet
+from workers import WorkerPool
+
+# Ids are stored as C longs, 64 bits in every platform we run on.
+INT_TYPECODE = 'l'
+# Concurrent requests by default.
+WORKERS = 4
+# Users expanded between checkpoints.
+CHECKPOINT_USERS = 100
+EDGES = ('followers', 'friends')
+# Twitter methods listing the ids of each kind of edges.
+IDS_METHODS = {'followers': 'follower_ids', 'friends': 'friend_ids'}
+# Seconds workers wait on a full queue before checking if the crawl
+# stopped.
+PUT_TIMEOUT = 0.1
+
+
+class Graph(object):
+    """
+    A crawled graph.
+
+    params are:
+        fields: User fields stored (see columns.column_kinds)
+        visited: seen.IdSet of every user found
+        users: columns.Columns of visited users, in the order they were
+               found. Users are stored from the lists they were found in,
+               so seeds are only there if some other user lists them.
+        followers, friends: Dicts of user id to array of ids, for expanded
+                            users
+        failed: Dict of user id to the error that stopped its expansion
+    """
+
+    def __init__(self, fields):
+        self.fields = fields
+        self.visited = IdSet()
+        self.users = Columns(column_kinds(TwitterUser, fields))
+        self.followers = {}
+        self.friends = {}
+        self.failed = {}
+
+    def edges(self):
+        """
+        Yields (source, target) for every edge crawled: target follows
+        source, or source follows target for friends.
+        """
+        for source, targets in self.followers.iteritems():
+            for target in targets:
+                yield target, source
+
+        for source, targets in self.friends.iteritems():
+            for target in targets:
+                yield source, target
+
+
+class GraphCrawler(object):
+    """
+    Breadth first crawl of the follower/friend graph.
+
+    params are:
+        api: Twitter instance (or TwitterPool)
+        seeds: User ids or screen names to start from
+        depth: Levels to expand. 1 gets the edges of seeds only. [optional]
+        edges: 'followers', 'friends' or both [optional]
+        fields: User fields to store, id is always stored [optional]
+        workers: Max concurrent requests [optional]
+        checkpoint: File to save progress to and resume from [optional]
+        checkpoint_users: Users expanded between checkpoints [optional]
+        max_edges: Max edges fetched per user and direction, to avoid
+                   walking huge accounts completely [optional]
+        ids_only: List edges with the ids endpoints. Only the id field is
+                  stored. [optional]
+
+    >>> from setobjects import TwitterUserSet
+    >>> network = {1: [2, 3], 2: [1, 4], 3: [4], 4: [5]}
+    >>> class API(object):
+    ...     def followers(self, user):
+    ...         def fetch(uri, get_data, **kwargs):
+    ...             if get_data['page'] > 1:
+    ...                 return []
+    ...             return [{'id': id, 'screen_name': 'user%d' % id}
+    ...                     for id in network.get(get_data['user'], [])]
+    ...         return TwitterUserSet(fetch, '/statuses/followers.json',
+    ...                               user=user)
+    >>> graph = GraphCrawler(API(), [1], depth=2).crawl()
+    >>> sorted(graph.visited), graph.users['screen_name']
+    ([1, 2, 3, 4], [u'user2', u'user3', u'user4'])
+    >>> sorted((k, list(v)) for k, v in graph.followers.items())
+    [(1, [2, 3]), (2, [1, 4]), (3, [4])]
+
+    With ids_only:
+
+    >>> from setobjects import TwitterIdSet
+    >>> def follower_ids(user):
+    ...     def fetch(uri, get_data, **kwargs):
+    ...         return {'ids': network.get(get_data['user_id'], []),
+    ...                 'next_cursor': 0}
+    ...     return TwitterIdSet(fetch, '/followers/ids.json', user=user)
+    >>> API.follower_ids = staticmethod(follower_ids)
+    >>> graph = GraphCrawler(API(), [1], depth=3, ids_only=True).crawl()
+    >>> sorted(graph.visited), list(graph.users['id'])
+    ([1, 2, 3, 4, 5], [2, 3, 4, 5])
+
+    """
+
+    def __init__(self, api, seeds, depth=1, edges=('followers',),
+                 fields=('id', 'screen_name'), workers=WORKERS,
+                 checkpoint=None, checkpoint_users=CHECKPOINT_USERS,
+                 max_edges=None, ids_only=False):
+        if isinstance(edges, basestring):
+            edges = (edges,)
+        for edge in edges:
+            if edge not in EDGES:
+                raise ValueError("Unknown edges %r" % edge)
+
+        fields = ['id'] if ids_only else list(fields)
+        if 'id' not in fields:
+            fields.insert(0, 'id')
+
+        self.api = api
+        self.seeds = seeds
+        self.depth = depth
+        self.edges = edges
+        self.fields = fields
+        self.workers = workers
+        self.checkpoint = checkpoint
+        self.checkpoint_users = checkpoint_users
+        self.max_edges = max_edges
+        self.ids_only = ids_only
+
+    def _load_checkpoint(self):
+        if not self.checkpoint or not os.path.exists(self.checkpoint):
+            return None
+
+        fp = open(self.checkpoint, 'rb')
+        try:
+            return cPickle.load(fp)
+        finally:
+            fp.close()
+
+    def _save_checkpoint(self, state):
+        # Write and rename, so a crash never leaves half a checkpoint.
+        if not self.checkpoint:
+            return
+
+        state['graph'].visited.compact()
+        tmp = self.checkpoint + '.tmp'
+        fp = open(tmp, 'wb')
+        try:
+            cPickle.dump(state, fp, cPickle.HIGHEST_PROTOCOL)
+            fp.flush()
+            os.fsync(fp.fileno())
+        finally:
+            fp.close()
+
+        os.rename(tmp, self.checkpoint)
+
+    def _start(self):
+        # Initial state: seeds resolved to ids, level 0.
+        graph = Graph(self.fields)
+        frontier = array(INT_TYPECODE)
+        for seed in self.seeds:
+            if not isinstance(seed, (int, long)):
+                seed = self.api.user(seed).id
+            if graph.visited.add(seed):
+                frontier.append(seed)
+
+        return {'graph': graph, 'level': 0, 'frontier': frontier,
+                'next': array(INT_TYPECODE), 'done': IdSet()}
+
+    def _put(self, out, stop, item):
+        # Put an item on out, unless the crawl stopped meanwhile. Returns
+        # False if it did.
+        while not stop.isSet():
+            try:
+                out.put(item, timeout=PUT_TIMEOUT)
+                return True
+            except Queue.Full:
+                pass
+
+        return False
+
+    def _expand(self, user, edge, out, stop):
+        # Worker: walk the edges of a user, putting (user, edge, array of
+        # ids, columns.Columns of users or None) on out for every page.
+        # Ids are None when done, with sys.exc_info() if the walk failed.
+        try:
+            count = 0
+            if self.ids_only:
+                method = getattr(self.api, IDS_METHODS[edge])
+                pages = ((ids, None) for page, ids
+                         in method(user).iterpages())
+            else:
+                pages = ((batch['id'], batch) for page, batch
+                         in getattr(self.api, edge)(user).iterbatches(
+                             self.fields))
+
+            for ids, batch in pages:
+                if self.max_edges is not None:
+                    ids = ids[:self.max_edges - count]
+                count += len(ids)
+                if not self._put(out, stop, (user, edge, ids, batch)):
+                    return
+                if self.max_edges is not None and count >= self.max_edges:
+                    break
+
+            self._put(out, stop, (user, edge, None, None))
+        except:
+            self._put(out, stop, (user, edge, None, sys.exc_info()))
+
+    def crawl(self):
+        """
+        Crawl (or resume crawling) the graph. Returns a Graph.
+        """
+        state = self._load_checkpoint() or self._start()
+        graph = state['graph']
+        pool = WorkerPool(self.workers)
+        # Bounded, so workers wait for us rather than piling up pages.
+        out = Queue.Queue(self.workers * 4)
+        stop = threading.Event()
+        try:
+            while state['level'] < self.depth and state['frontier']:
+                self._crawl_level(state, pool, out, stop)
+
+                state['level'] += 1
+                state['frontier'] = state['next']
+                state['next'] = array(INT_TYPECODE)
+                state['done'] = IdSet()
+                self._save_checkpoint(state)
+        except:
+            # Nothing may hit the API once crawl() is gone: drop queued
+            # expansions and wait for the running ones to give up.
+            stop.set()
+            pool.close(wait=True, cancel=True)
+            raise
+
+        pool.close()
+        graph.visited.compact()
+        return graph
+
+    def _crawl_level(self, state, pool, out, stop):
+        # Expand every user of the frontier not done yet.
+        graph, done = state['graph'], state['done']
+        # Next frontier is only needed if there is another level.
+        last = state['level'] + 1 >= self.depth
+
+        # Edges of users in progress, and directions left for each.
+        partial, left = {}, {}
+        for user in state['frontier']:
+            if user in done:
+                continue
+
+            left[user] = len(self.edges)
+            for edge in self.edges:
+                partial[user, edge] = array(INT_TYPECODE)
+                pool.submit(self._expand, user, edge, out, stop)
+
+        expanded = 0
+        while left:
+            user, edge, ids, batch = out.get()
+            if ids is None and batch is not None:
+                graph.failed[user] = batch[1]
+            elif ids is not None:
+                targets, new = partial[user, edge], []
+                for row, id in enumerate(ids):
+                    id = int(id)
+                    targets.append(id)
+                    if graph.visited.add(id):
+                        new.append(row)
+                        if not last:
+                            state['next'].append(id)
+                if batch is None:
+                    graph.users.append([{'id': ids[row]} for row in new])
+                else:
+                    graph.users.extend(batch, new)
+                continue
+
+            getattr(graph, edge)[user] = partial.pop((user, edge))
+            left[user] -= 1
+            if left[user]:
+                continue
+
+            # User done
+            del left[user]
+            if user in graph.failed:
+                for edge in self.edges:
+                    getattr(graph, edge).pop(user, None)
+            done.add(user)
+            expanded += 1
+            if expanded % self.checkpoint_users == 0:
+                self._save_checkpoint(state)
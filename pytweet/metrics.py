@@ -0,0 +1,327 @@
+"""
+Client metrics. Counters and rolling histograms per endpoint fed from
+instrumentation events (see events module), with quantile queries and a
+text exposition in Prometheus format, optionally served over HTTP.
+
+Usage:
+
+    metrics = Metrics()
+    metrics.attach(api)
+    metrics.serve(9100)     # http://127.0.0.1:9100/metrics
+    metrics.request_seconds.quantile(0.99, endpoint='/search.json')
+
+"""
+
+import BaseHTTPServer
+import bisect
+import collections
+import re
+import threading
+import time
+
+# Buckets upper bounds, in seconds.
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+PAGE_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+
+# Default rolling window for quantiles, in seconds, and how many slices
+# it's divided in (old slices are dropped as a whole).
+WINDOW = 60
+WINDOW_SLICES = 6
+
+# Path segments with ids or screen names are replaced to keep label
+# cardinality low: /users/show/reflejo.json -> /users/show/:id.json
+_ID_SEGMENT = re.compile(r'/(show|create|destroy)/[^/]+\.json$')
+
+
+def endpoint_label(endpoint):
+    """
+    >>> endpoint_label('/statuses/destroy/1234.json')
+    '/statuses/destroy/:id.json'
+
+    """
+    return _ID_SEGMENT.sub(r'/\1/:id.json', endpoint or '')
+
+
+def _labels_key(labels):
+    return tuple(sorted(labels.iteritems()))
+
+
+def _format_labels(key, extra=()):
+    pairs = list(key) + list(extra)
+    if not pairs:
+        return ''
+
+    return '{%s}' % ','.join(['%s="%s"' % (k, str(v).replace('\\', '\\\\')
+                                                     .replace('"', '\\"'))
+                              for k, v in pairs])
+
+
+class Counter(object):
+    """
+    Monotonic counter with labels.
+
+    >>> counter = Counter('hits', 'Hits')
+    >>> counter.inc(endpoint='/a'); counter.inc(2, endpoint='/a')
+    >>> counter.get(endpoint='/a')
+    3
+    >>> print counter.expose()
+    # HELP hits Hits
+    # TYPE hits counter
+    hits{endpoint="/a"} 3
+
+    """
+
+    def __init__(self, name, help):
+        self.name = name
+        self.help = help
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = _labels_key(labels)
+        self._lock.acquire()
+        self._values[key] = self._values.get(key, 0) + amount
+        self._lock.release()
+
+    def get(self, **labels):
+        return self._values.get(_labels_key(labels), 0)
+
+    def expose(self):
+        lines = ['# HELP %s %s' % (self.name, self.help),
+                 '# TYPE %s counter' % self.name]
+        for key, value in sorted(self._values.items()):
+            lines.append('%s%s %s' % (self.name, _format_labels(key), value))
+
+        return '\n'.join(lines)
+
+
+class _Series(object):
+    # Histogram data for one set of labels.
+
+    def __init__(self, nbuckets):
+        self.buckets = [0] * nbuckets
+        self.count = 0
+        self.sum = 0.0
+        # Rolling window: deque of (slice start time, bucket counts)
+        self.slices = collections.deque()
+
+
+class Histogram(object):
+    """
+    Histogram with fixed buckets and labels. Totals since start are
+    exposed (as Prometheus expects) and quantiles are estimated over a
+    rolling window of recent observations.
+
+    >>> hist = Histogram('latency', 'Latency', buckets=(1, 2, 4))
+    >>> for value in (0.5, 1.5, 1.5, 3): hist.observe(value)
+    >>> hist.quantile(0.5)
+    1.5
+    >>> hist.count()
+    4
+
+    """
+
+    def __init__(self, name, help, buckets=LATENCY_BUCKETS, window=WINDOW,
+                 slices=WINDOW_SLICES):
+        self.name = name
+        self.help = help
+        self.bounds = tuple(buckets)
+        self.window = window
+        self.slice_length = float(window) / slices
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def _rotate(self, series, now):
+        # Drop slices out of the window and make sure the last one is
+        # current.
+        while series.slices and series.slices[0][0] <= now - self.window:
+            series.slices.popleft()
+
+        if not series.slices or \
+           series.slices[-1][0] <= now - self.slice_length:
+            series.slices.append((now, [0] * (len(self.bounds) + 1)))
+
+    def observe(self, value, **labels):
+        key = _labels_key(labels)
+        idx = bisect.bisect_left(self.bounds, value)
+        self._lock.acquire()
+        try:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = _Series(len(self.bounds) + 1)
+
+            series.buckets[idx] += 1
+            series.count += 1
+            series.sum += value
+            self._rotate(series, time.time())
+            series.slices[-1][1][idx] += 1
+        finally:
+            self._lock.release()
+
+    def count(self, **labels):
+        series = self._series.get(_labels_key(labels))
+        return series.count if series else 0
+
+    def quantile(self, q, **labels):
+        """
+        Estimate quantile `q` (0 to 1) over the rolling window, by linear
+        interpolation inside the bucket. Returns None if there is no data.
+        """
+        self._lock.acquire()
+        try:
+            series = self._series.get(_labels_key(labels))
+            if series is None:
+                return None
+
+            self._rotate(series, time.time())
+            counts = [sum(column) for column in \
+                      zip(*[buckets for _, buckets in series.slices])]
+        finally:
+            self._lock.release()
+
+        total = sum(counts)
+        if not total:
+            return None
+
+        rank = q * total
+        seen = 0
+        for idx, count in enumerate(counts):
+            if count and seen + count >= rank:
+                if idx >= len(self.bounds):
+                    # Overflow bucket, best we can say is the last bound.
+                    return self.bounds[-1]
+
+                lower = self.bounds[idx - 1] if idx else 0
+                upper = self.bounds[idx]
+                return lower + (upper - lower) * (rank - seen) / count
+            seen += count
+
+        return self.bounds[-1]
+
+    def expose(self):
+        lines = ['# HELP %s %s' % (self.name, self.help),
+                 '# TYPE %s histogram' % self.name]
+        for key, series in sorted(self._series.items()):
+            cumulative = 0
+            for bound, count in zip(self.bounds + ('+Inf',), series.buckets):
+                cumulative += count
+                lines.append('%s_bucket%s %d' % (
+                    self.name, _format_labels(key, [('le', bound)]),
+                    cumulative))
+            lines.append('%s_sum%s %s' % (self.name, _format_labels(key),
+                                          series.sum))
+            lines.append('%s_count%s %d' % (self.name, _format_labels(key),
+                                            series.count))
+
+        return '\n'.join(lines)
+
+
+class Metrics(object):
+    """
+    Standard pytweet metrics. Attach it to one or more Twitter clients
+    and it will keep itself up to date from their events.
+
+    params are:
+        window: Rolling window for quantiles, in seconds. [optional]
+    """
+
+    def __init__(self, window=WINDOW):
+        self.requests = Counter('pytweet_requests_total',
+                                'HTTP requests by endpoint and status.')
+        self.request_seconds = Histogram('pytweet_request_seconds',
+                                         'HTTP request latency.',
+                                         window=window)
+        self.response_bytes = Counter('pytweet_response_bytes_total',
+                                      'Response bytes received from the '
+                                      'wire.')
+        self.decode_seconds = Histogram('pytweet_decode_seconds',
+                                        'JSON decode time.', window=window)
+        self.construct_seconds = Histogram('pytweet_construct_seconds',
+                                           'Objects construction time per '
+                                           'page.', window=window)
+        self.pages = Histogram('pytweet_pages_per_slice',
+                               'Pages fetched per result set slice.',
+                               buckets=PAGE_BUCKETS, window=window)
+        self.cache_hits = Counter('pytweet_cache_hits_total',
+                                  'Result set slices served without '
+                                  'requests.')
+        self.retries = Counter('pytweet_retries_total', 'Requests retried.')
+        self.ratelimit_wait_seconds = Histogram(
+            'pytweet_ratelimit_wait_seconds',
+            'Time waited by the rate limiter before sending a request.',
+            window=window)
+
+        self._server = None
+
+    def attach(self, api):
+        """
+        Start recording events from a Twitter client.
+        """
+        api.hooks.subscribe(self.record)
+
+    def detach(self, api):
+        api.hooks.unsubscribe(self.record)
+
+    def record(self, name, data):
+        """
+        Hooks subscriber. Updates metrics from an event.
+        """
+        endpoint = endpoint_label(data.get('endpoint'))
+        if name == 'request':
+            self.requests.inc(endpoint=endpoint, status=data['status'])
+            self.request_seconds.observe(data['elapsed'], endpoint=endpoint)
+            if data['wire_bytes']:
+                self.response_bytes.inc(data['wire_bytes'], endpoint=endpoint)
+        elif name == 'parse':
+            self.decode_seconds.observe(data['decode'], endpoint=endpoint)
+        elif name == 'page':
+            self.construct_seconds.observe(data['construct'],
+                                           endpoint=endpoint)
+        elif name == 'slice':
+            self.pages.observe(data['pages'], endpoint=endpoint)
+            if not data['pages']:
+                self.cache_hits.inc(endpoint=endpoint)
+        elif name == 'retry':
+            self.retries.inc(endpoint=endpoint)
+        elif name == 'ratelimit':
+            self.ratelimit_wait_seconds.observe(data['wait'],
+                                                endpoint=endpoint)
+
+    def render(self):
+        """
+        Returns every metric in Prometheus text format.
+        """
+        metrics = [self.requests, self.request_seconds, self.response_bytes,
+                   self.decode_seconds, self.construct_seconds, self.pages,
+                   self.cache_hits, self.retries, self.ratelimit_wait_seconds]
+        return '\n'.join([metric.expose() for metric in metrics]) + '\n'
+
+    def serve(self, port=9100, host='127.0.0.1'):
+        """
+        Serve metrics at http://host:port/metrics from a background thread.
+        Returns the HTTP server (call shutdown() on it to stop).
+        """
+        metrics = self
+
+        class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path != '/metrics':
+                    self.send_error(404)
+                    return
+
+                body = metrics.render()
+                self.send_response(200)
+                self.send_header('Content-Type',
+                                 'text/plain; version=0.0.4')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self._server = BaseHTTPServer.HTTPServer((host, port), Handler)
+        thread = threading.Thread(target=self._server.serve_forever)
+        thread.setDaemon(True)
+        thread.start()
+        return self._server
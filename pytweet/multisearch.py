@@ -0,0 +1,209 @@
+"""
+Search fan-out. Runs many queries concurrently and merges their results
+into a single stream, newest first, with results matching several
+queries only once.
+
+Every query is a paginated search walked in the background (a page
+ahead of the merge), so memory is bounded to a couple of pages per
+query. Since each stream comes ordered by id, they are merged with a
+heap and duplicates are always next to each other: no set of seen ids
+is needed.
+
+Usage:
+
+    searches = MultiSearch(api, ['python', 'django', 'pytweet'])
+    for result, queries in searches.poll():
+        print result.id, queries
+    ...
+    for result, queries in searches.poll():   # Only new results
+        ...
+
+"""
+
+import heapq
+import sys
+import time
+import Queue
+from workers import WorkerPool
+
+# Concurrent requests by default.
+WORKERS = 8
+
+
+class SearchState(object):
+    """
+    Per query state.
+
+    params are:
+        query: Search terms
+        since_id: Only results newer than this are fetched
+        max_id: Newest result of the last poll (its pages are pinned to it)
+        count: Results fetched by the last poll
+        error: Exception that stopped the last poll of this query, if any
+        polled_at: time.time() of the last complete poll
+    """
+
+    def __init__(self, query, since_id=0):
+        self.query = query
+        self.since_id = since_id
+        self.max_id = 0
+        self.count = 0
+        self.error = None
+        self.polled_at = None
+
+    def __repr__(self):
+        return '<SearchState %r since_id=%s>' % (self.query, self.since_id)
+
+
+class _Stream(object):
+    # Pages of a query, fetched in the background one page ahead.
+
+    def __init__(self, state, resultset):
+        self.state = state
+        self.resultset = resultset
+        self.pages = resultset.iterpages()
+        self.buffer = Queue.Queue()
+        self.newest = state.since_id
+
+
+class MultiSearch(object):
+    """
+    Concurrent searches merged in one stream.
+
+    params are:
+        api: Twitter instance (or TwitterPool)
+        queries: Search terms [optional]
+        workers: Max concurrent requests [optional]
+        search_kwargs: Other search() params, like lang or geocode
+                       [optional]
+
+    >>> from tweet import Twitter
+    >>> from transport import MemoryTransport
+    >>> transport = MemoryTransport()
+    >>> def results(q, ids):
+    ...     transport.add('/search.json', {'results': [
+    ...         {'id': id, 'text': '%s %d' % (q, id)} for id in ids],
+    ...         'max_id': max(ids + [0]), 'completed_in': 0.01},
+    ...         query={'q': q})
+    >>> results('python', [9, 7, 4]); results('django', [8, 7, 1])
+    >>> searches = MultiSearch(Twitter(transport=transport),
+    ...                        ['python', 'django'])
+    >>> for result, queries in searches.poll():
+    ...     print result.id, queries
+    9 ['python']
+    8 ['django']
+    7 ['python', 'django']
+    4 ['python']
+    1 ['django']
+    >>> searches.states['python']
+    <SearchState 'python' since_id=9>
+
+    """
+
+    def __init__(self, api, queries=(), workers=WORKERS, **search_kwargs):
+        self.api = api
+        self.search_kwargs = search_kwargs
+        self.states = {}
+        self._order = []
+        self._pool = WorkerPool(workers)
+        for query in queries:
+            self.add(query)
+
+    def add(self, query, since_id=0):
+        """
+        Track a new query. Only results newer than since_id are fetched.
+        """
+        if query not in self.states:
+            self._order.append(query)
+        self.states[query] = SearchState(query, since_id)
+
+    def remove(self, query):
+        self._order.remove(query)
+        del self.states[query]
+
+    def close(self):
+        self._pool.close(wait=False)
+
+    def _fetch(self, stream):
+        # Worker: fetch next page of a stream to its buffer. None means
+        # the stream is over.
+        try:
+            page, items = stream.pages.next()
+            stream.buffer.put(items)
+        except StopIteration:
+            stream.buffer.put(None)
+        except:
+            stream.buffer.put(sys.exc_info())
+
+    def _items(self, stream):
+        # Results of a stream, newest first. Errors stop the stream and are
+        # recorded in its state.
+        state = stream.state
+        while True:
+            page = stream.buffer.get()
+            if page is None:
+                # Complete, next poll starts from here.
+                state.since_id = stream.newest
+                state.polled_at = time.time()
+                return
+
+            if isinstance(page, tuple):
+                state.error = page[1]
+                return
+
+            # Fetch the next page while this one is merged.
+            self._pool.submit(self._fetch, stream)
+            state.max_id = stream.resultset.max_id
+            for item in page:
+                if item.id > stream.newest:
+                    stream.newest = item.id
+                state.count += 1
+                yield item
+
+    def poll(self):
+        """
+        Yields (result, queries) for new results of every query, newest
+        first. Queries advance their since_id when their results are
+        completely consumed.
+        """
+        streams = []
+        for query in self._order:
+            state = self.states[query]
+            state.count = 0
+            state.error = None
+            resultset = self.api.search(query, since_id=state.since_id,
+                                        **self.search_kwargs)
+            stream = _Stream(state, resultset)
+            streams.append(stream)
+            self._pool.submit(self._fetch, stream)
+
+        # Heap of (-id, stream index, result, iterator)
+        heap = []
+        for idx, stream in enumerate(streams):
+            items = self._items(stream)
+            for item in items:
+                heap.append((-item.id, idx, item, items))
+                break
+        heapq.heapify(heap)
+
+        current, queries = None, []
+        while heap:
+            _, idx, item, items = heap[0]
+            for following in items:
+                heapq.heapreplace(heap, (-following.id, idx, following,
+                                         items))
+                break
+            else:
+                heapq.heappop(heap)
+
+            query = streams[idx].state.query
+            if current is not None and item.id == current.id:
+                queries.append(query)
+                continue
+
+            if current is not None:
+                yield current, queries
+            current, queries = item, [query]
+
+        if current is not None:
+            yield current, queries
@@ -3,7 +3,8 @@ Twitter Objects representation. Data is normalized to python types.
 """
 
 import sys
-from parsers import parsedate, unescape
+from itertools import izip
+from parsers import parsedate, unescape, formatdate, escape
 
 #########################################################
 # Basic Objects
@@ -30,6 +31,88 @@ class TwitterObject(object):
             val = fc(kwargs[key]) if key in kwargs and kwargs[key] else None
             setattr(self, key, val)
 
+    @classmethod
+    def from_list(cls, items):
+        """
+        Build objects from a list of dictionaries, like cls(**item) for each
+        one but transforming values a field at a time (a column of the page)
+        instead of walking _transformation for every item.
+
+        >>> items = [{'id': '1', 'text': 'a &amp; b', 'truncated': False,
+        ...           'user': {'id': 2, 'status': {'id': 3}}}, {'id': 4}]
+        >>> batch = [obj.to_dict() for obj in TwitterStatus.from_list(items)]
+        >>> batch == [TwitterStatus(**item).to_dict() for item in items]
+        True
+
+        """
+        if not items:
+            return []
+
+        if cls.__init__.im_func is not TwitterObject.__init__.im_func:
+            # Custom constructor, we can't skip it.
+            return [cls(**item) for item in items]
+
+        keys = cls._transformation.keys()
+        columns = []
+        for key in keys:
+            fc = cls._transformation[key]
+            if isinstance(fc, str):
+                fc = getattr(sys.modules[__name__], fc)
+
+            values = [item.get(key) for item in items]
+            if isinstance(fc, type) and issubclass(fc, TwitterObject):
+                # Nested objects are built in a batch too.
+                present = [i for i, val in enumerate(values) if val]
+                built = fc.from_list([values[i] for i in present])
+                values = [None] * len(values)
+                for i, obj in izip(present, built):
+                    values[i] = obj
+            elif fc is parsedate:
+                # Items of a page share many dates, parse each once.
+                dates = {}
+                for i, val in enumerate(values):
+                    if val:
+                        if val not in dates:
+                            dates[val] = fc(val)
+                        values[i] = dates[val]
+                    else:
+                        values[i] = None
+            else:
+                values = [fc(val) if val else None for val in values]
+
+            columns.append(values)
+
+        objects = []
+        new = object.__new__
+        for row in izip(*columns) if columns else [()] * len(items):
+            obj = new(cls)
+            obj.__dict__.update(izip(keys, row))
+            objects.append(obj)
+
+        return objects
+
+    def to_dict(self):
+        """
+        Returns a dictionary like the one the object was built from, with
+        API values (dates and escaped texts as returned by twitter).
+        So TwitterObject(**obj.to_dict()) builds an equivalent object.
+        """
+        result = {}
+        for key, fc in self._transformation.iteritems():
+            val = getattr(self, key, None)
+            if val is None:
+                pass
+            elif isinstance(val, TwitterObject):
+                val = val.to_dict()
+            elif fc is parsedate:
+                val = formatdate(val)
+            elif fc is unescape:
+                val = escape(val)
+
+            result[key] = val
+
+        return result
+
 
 class TwitterSearchResult(TwitterObject):
     """
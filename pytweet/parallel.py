@@ -0,0 +1,213 @@
+"""
+Parallel page parsing for bulk backfills. JSON decoding and object
+construction are CPU bound and, in a single process, they leave the
+network idle. A ParallelParser fetches page bodies from a background
+thread and hands them to a pool of processes, which decode them and
+build objects (or columns). Pages are still delivered in order.
+
+It's opt-in, for long walks where it pays off:
+
+    parser = ParallelParser(processes=4)
+    for page, statuses in api.user_timeline('reflejo').iterpages(
+            parser=parser):
+        ...
+    api.search('python').export('python.jsonl.gz', parser=parser)
+    parser.close()
+
+"""
+
+import multiprocessing
+import Queue
+import simplejson
+import sys
+import threading
+import time
+from columns import Columns
+from setobjects import ITEMS_PER_PAGE, truncate_since
+from tweet import check_response
+
+
+def _parse_page(body, resultclass, results_key, since_id, kinds):
+    # Runs in a worker process. Returns (items, newest raw id, metadata,
+    # decode seconds, construct seconds).
+    start = time.time()
+    parsed = check_response(simplejson.loads(body))
+    decode = time.time() - start
+
+    results = parsed[results_key] if results_key else parsed
+    metadata = None
+    if results_key:
+        metadata = dict([(k, v) for k, v in parsed.iteritems()
+                         if k != results_key])
+
+    results = results[:ITEMS_PER_PAGE]
+    if since_id:
+        results = truncate_since(results, since_id)
+    newest_id = results and results[0].get('id')
+
+    start = time.time()
+    if kinds is None:
+        items = resultclass.from_list(results)
+    else:
+        items = Columns(kinds)
+        items.append(results)
+
+    return items, newest_id, metadata, decode, time.time() - start
+
+
+class ParallelParser(object):
+    """
+    Decodes pages and builds their objects in a pool of processes.
+
+    params are:
+        processes: Worker processes. Default is one per CPU. [optional]
+        window: Max pages fetched and not yet delivered. The fetcher may
+                request up to this many pages past the last one, since it
+                doesn't know where the end is until pages are parsed.
+                Default is twice the processes. [optional]
+
+    >>> from setobjects import TwitterStatusSet
+    >>> def fetch(uri, get_data, raw=False, **kwargs):
+    ...     count = 100 if get_data['page'] < 3 else 10
+    ...     first = 1000 - get_data['page'] * 100
+    ...     return simplejson.dumps([{'id': first - i} for i in range(count)])
+    >>> statuses = TwitterStatusSet(fetch, '/statuses/user_timeline.json',
+    ...                             user='testpy')
+    >>> parser = ParallelParser(processes=2)
+    >>> [(page, len(items)) for page, items in statuses.iterpages(
+    ...     parser=parser)]
+    [(1, 100), (2, 100), (3, 10)]
+    >>> parser.close()
+
+    """
+
+    def __init__(self, processes=None, window=None):
+        self.processes = processes or multiprocessing.cpu_count()
+        self.window = window or 2 * self.processes
+        self._pool = None
+        self._lock = threading.Lock()
+
+    def _get_pool(self):
+        self._lock.acquire()
+        try:
+            if self._pool is None:
+                self._pool = multiprocessing.Pool(self.processes)
+            return self._pool
+        finally:
+            self._lock.release()
+
+    def close(self):
+        """
+        Stop worker processes.
+        """
+        if self._pool is not None:
+            self._pool.close()
+            self._pool.join()
+            self._pool = None
+
+    def _submit(self, resultset, page, kinds):
+        # Fetch a page body and send it to the pool.
+        deadline = time.time() + resultset.deadline if resultset.deadline \
+                   else None
+        body = resultset._request(page, deadline, raw=True)
+        return len(body), self._get_pool().apply_async(
+            _parse_page, (body, resultset.resultclass, resultset.results_key,
+                          resultset.since_id, kinds))
+
+    def _produce(self, resultset, page, kinds, pending, stop):
+        # Fetcher thread: submit pages in order until a short page is
+        # seen or the consumer stops.
+        def put(entry):
+            while not stop.isSet():
+                try:
+                    pending.put(entry, timeout=0.1)
+                    return True
+                except Queue.Full:
+                    pass
+            return False
+
+        jobs = []
+        try:
+            if page > 1:
+                resultset._anchor(time.time() + resultset.deadline
+                                  if resultset.deadline else None)
+            first = True
+            while not stop.isSet():
+                size, job = self._submit(resultset, page, kinds)
+                if first:
+                    # Next pages depend on this one (max_id pinning and
+                    # metadata), wait for it. Before queueing it: results
+                    # only wake up one waiting thread.
+                    first = False
+                    items, newest_id, metadata, _, _ = job.get()
+                    if metadata is not None:
+                        resultset._fill_metadata(metadata)
+                    if page == 1:
+                        resultset._pin(newest_id)
+                    if not put((page, size, job)) or \
+                       len(items) < ITEMS_PER_PAGE:
+                        return
+                elif not put((page, size, job)):
+                    return
+
+                # Stop fetching once a page comes back short (or failed).
+                running = []
+                for other in jobs + [job]:
+                    if not other.ready():
+                        running.append(other)
+                    elif not other.successful() or \
+                         len(other.get()[0]) < ITEMS_PER_PAGE:
+                        return
+                jobs = running
+
+                page += 1
+        except:
+            put((None, None, sys.exc_info()))
+        finally:
+            put(None)
+
+    def pages(self, resultset, page=1, kinds=None):
+        """
+        Yields (page, items) of a PaginationSet in order, like iterpages.
+        With kinds (see columns.column_kinds) items are columns.Columns.
+        """
+        # Start workers from this thread, forking from the fetcher thread
+        # could copy locks other threads hold.
+        self._get_pool()
+        pending = Queue.Queue(self.window)
+        stop = threading.Event()
+        thread = threading.Thread(target=self._produce,
+                                  args=(resultset, page, kinds, pending, stop))
+        thread.setDaemon(True)
+        thread.start()
+
+        hooks = resultset.hooks
+        try:
+            while True:
+                entry = pending.get()
+                if entry is None:
+                    return
+
+                page, size, job = entry
+                if page is None:
+                    raise job[0], job[1], job[2]
+
+                items, _, metadata, decode, construct = job.get()
+                if metadata is not None:
+                    resultset._fill_metadata(metadata)
+
+                if hooks:
+                    hooks.emit('parse', endpoint=resultset.uri, bytes=size,
+                               decode=decode)
+                    hooks.emit('page', endpoint=resultset.uri, page=page,
+                               resultclass=Columns.__name__ if kinds \
+                                           else resultset.resultclass.__name__,
+                               items=len(items), construct=construct)
+
+                if len(items):
+                    yield page, items
+
+                if len(items) < ITEMS_PER_PAGE:
+                    return
+        finally:
+            stop.set()
@@ -1,3 +1,5 @@
+import calendar
+import cgi
 import datetime
 import htmlentitydefs
 import re
@@ -25,6 +27,23 @@ def parsedate(datestr):
     return datetime.datetime(*rfc_tuple[:7])
 
 
+def parsetimestamp(datestr):
+    # Convert a date string to seconds since epoch, with no datetime in
+    # between. Timezone is ignored. (UTC assumed)
+    return calendar.timegm(rfc822.parsedate_tz(datestr)[:9])
+
+
+def formatdate(date):
+    # Convert a datetime object to a date string like the ones the API
+    # returns. parsedate(formatdate(date)) == date
+    return date.strftime('%a %b %d %H:%M:%S +0000 %Y')
+
+
+def escape(text):
+    # Inverse of unescape: unescape(escape(text)) == text
+    return text and cgi.escape(text)
+
+
 def unescape(text, encoding="UTF-8"):
     """
     Removes HTML or XML character references and entities from a text string.
@@ -55,4 +74,8 @@ def unescape(text, encoding="UTF-8"):
 
     # Decode string as needed
     text = text.decode(encoding) if isinstance(text, str) else text 
-    return text and re.sub("&#?\w+;", fixup, text)
+    if not text or '&' not in text:
+        # Nothing to unescape, skip the regexp.
+        return text
+
+    return re.sub("&#?\w+;", fixup, text)
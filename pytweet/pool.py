@@ -0,0 +1,141 @@
+"""
+Pool of Twitter clients. Every credential has its own rate limit, so
+spreading calls across many of them multiplies the available throughput.
+"""
+
+import threading
+from ratelimit import PRIORITY_INTERACTIVE
+from setobjects import PaginationSet, TwitterIdSet, LazyUsers
+from tweet import Twitter
+
+
+class TwitterPool(object):
+    """
+    Routes each API call to the least loaded credential that still has
+    budget. Result sets are pinned to the credential which created them,
+    so every page of a walk is fetched by the same client.
+
+    params are:
+        credentials: list of Twitter instances or dicts with Twitter
+                     arguments (username/password or key/secret/access_token)
+
+    Usage:
+
+      >>> pool = TwitterPool([{'username': 'testpy', 'password': 'testpy'},
+      ...                     {'username': 'testpy2', 'password': 'testpy'}])
+      >>> search = pool.search('python')  # Every page uses the same client.
+      >>> res = search[:200]    # doctest: +SKIP
+
+    Served from memory:
+
+      >>> from transport import MemoryTransport
+      >>> def client(username):
+      ...     transport = MemoryTransport()
+      ...     for page in (1, 2):
+      ...         top = 400 - page * 100
+      ...         transport.add('/search.json', {
+      ...             'results': [{'id': id, 'text': 'python'}
+      ...                         for id in range(top, top - 100, -1)],
+      ...             'max_id': 300, 'completed_in': 0.01},
+      ...             query={'page': str(page)})
+      ...     return Twitter(username=username, password='testpy',
+      ...                    transport=transport)
+      >>> pool = TwitterPool([client('testpy'), client('testpy2')])
+      >>> res = pool.search('python')[:200]
+      >>> len(res), res[-1].id
+      (200, 101)
+      >>> sorted([len(api.transport.requests) for api in pool.clients])
+      [0, 2]
+
+    """
+
+    def __init__(self, credentials):
+        self.clients = []
+        for cred in credentials:
+            if not isinstance(cred, Twitter):
+                cred = Twitter(**cred)
+            self.clients.append(cred)
+
+        if not self.clients:
+            raise ValueError("You must specify at least one credential")
+
+        self._inflight = [0] * len(self.clients)
+        self._lock = threading.Lock()
+
+    def _load(self, idx):
+        # Sorting key: clients with budget first, then less requests in
+        # flight, then more remaining hits.
+        limiter = self.clients[idx].rate_limiter
+        remaining = limiter.remaining
+        if remaining is None:
+            remaining = float('inf')
+
+        return (limiter.peek(PRIORITY_INTERACTIVE), self._inflight[idx],
+                -remaining)
+
+    def _choose(self, track=False):
+        # With track, the request is counted in flight for the chosen
+        # client before the lock is released, so concurrent callers see it.
+        self._lock.acquire()
+        try:
+            idx = min(xrange(len(self.clients)), key=self._load)
+            if track:
+                self._inflight[idx] += 1
+            return idx
+        finally:
+            self._lock.release()
+
+    def _done(self, idx):
+        self._lock.acquire()
+        self._inflight[idx] -= 1
+        self._lock.release()
+
+    def _track(self, idx, func):
+        # Wraps func so requests in flight are counted for client idx.
+        def _tracked(*args, **kwargs):
+            self._lock.acquire()
+            self._inflight[idx] += 1
+            self._lock.release()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self._done(idx)
+
+        return _tracked
+
+    def client(self):
+        """
+        Returns the least loaded client. Useful to make several calls with
+        the same credential.
+        """
+        return self.clients[self._choose()]
+
+    def __getattr__(self, name):
+        attr = getattr(Twitter, name, None)
+        if not callable(attr) or name.startswith('_'):
+            raise AttributeError(name)
+
+        def _call(*args, **kwargs):
+            idx = self._choose(track=True)
+            client = self.clients[idx]
+            try:
+                result = getattr(client, name)(*args, **kwargs)
+            finally:
+                self._done(idx)
+
+            # Pin the walk: next pages will be fetched by this client too.
+            if isinstance(result, (PaginationSet, TwitterIdSet, LazyUsers)):
+                result._fetch = self._track(idx, client._fetchurl)
+
+            return result
+
+        _call.__name__ = name
+        _call.__doc__ = attr.__doc__
+        return _call
+
+    @property
+    def rate_remaining(self):
+        """
+        Remaining API requests for the current hour across all credentials.
+        """
+        return sum(client.rate_remaining for client in self.clients)
@@ -0,0 +1,250 @@
+"""
+Rate limit bookkeeping. Twitter gives every account (or IP address) an
+hourly budget of requests. Here we keep track of what is left of it and
+pace requests so the budget lasts until the window is reset, instead of
+burning it and stalling until the next hour.
+"""
+
+import threading
+import time
+
+# Interactive requests are the ones a user is waiting for: they may use
+# the whole remaining budget. Background requests (pagination walks) are
+# paced and keep a reserve of hits for interactive ones.
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BACKGROUND = 1
+
+# Default amount of hits reserved to interactive requests.
+DEFAULT_RESERVE = 10
+# Default amount of background requests allowed in a burst.
+DEFAULT_BURST = 5
+# How long background requests wait for pending interactive ones.
+INTERACTIVE_POLL = 0.5
+
+
+class TokenBucket(object):
+    """
+    Classic token bucket. Tokens are added at `rate` per second up to
+    `capacity`, and every request takes one of them.
+
+    >>> bucket = TokenBucket(rate=1, capacity=2)
+    >>> bucket.take(), bucket.take()
+    (0, 0)
+    >>> bucket.peek() > 0, bucket.take() > 0
+    (True, True)
+
+    """
+
+    def __init__(self, rate, capacity):
+        self.rate = float(rate)
+        self.capacity = float(capacity)
+        self.tokens = self.capacity
+        self._last = time.time()
+
+    def _available(self, now):
+        return min(self.capacity, self.tokens + (now - self._last) * self.rate)
+
+    def _refill(self):
+        now = time.time()
+        self.tokens = self._available(now)
+        self._last = now
+
+    def _wait(self, available, tokens):
+        if available >= tokens:
+            return 0
+
+        if self.rate <= 0:
+            return float('inf')
+
+        return (tokens - available) / self.rate
+
+    def take(self, tokens=1):
+        """
+        Takes `tokens` from the bucket. Returns 0 if they were taken, or
+        the number of seconds to wait until they are available otherwise.
+        """
+        self._refill()
+        wait = self._wait(self.tokens, tokens)
+        if not wait:
+            self.tokens -= tokens
+
+        return wait
+
+    def peek(self, tokens=1):
+        """
+        Seconds to wait until `tokens` are available, without taking them.
+        """
+        return self._wait(self._available(time.time()), tokens)
+
+
+class RateLimiter(object):
+    """
+    Tracks the remaining hourly budget and the time when it's reset, and
+    makes callers wait when they are going too fast.
+
+    Budget information is read from X-RateLimit-* response headers
+    (see update) or from a rate_limit_status response (see
+    update_from_status). Until any of them is seen nothing is paced.
+
+    params are:
+        reserve: hits kept for interactive requests. [optional]
+        burst: background requests allowed in a burst. [optional]
+
+    >>> limiter = RateLimiter(reserve=1)
+    >>> limiter.update({'x-ratelimit-limit': '150',
+    ...                 'x-ratelimit-remaining': '0',
+    ...                 'x-ratelimit-reset': str(int(time.time()) + 60)})
+    >>> limiter.remaining, limiter.limit
+    (0, 150)
+    >>> 0 < limiter.peek() <= 60
+    True
+    >>> limiter.acquire(deadline=time.time() + 1) is None
+    True
+
+    """
+
+    def __init__(self, reserve=DEFAULT_RESERVE, burst=DEFAULT_BURST):
+        self.reserve = reserve
+        self.limit = None
+        self.remaining = None
+        self.reset = None
+        self.waited = 0.0
+        self._bucket = TokenBucket(0, burst)
+        self._interactive = 0
+        self._cond = threading.Condition()
+
+    def update(self, headers):
+        """
+        Update budget from response headers. `headers` can be any mapping
+        with case insensitive keys (like httplib messages) or a dict
+        with lowercase keys.
+        """
+        remaining = headers.get('x-ratelimit-remaining')
+        if remaining is None:
+            return
+
+        self._set(headers.get('x-ratelimit-limit'), remaining,
+                  headers.get('x-ratelimit-reset'))
+
+    def update_from_status(self, status):
+        """
+        Update budget from a /account/rate_limit_status.json response.
+        """
+        self._set(status.get('hourly_limit'), status['remaining_hits'],
+                  status.get('reset_time_in_seconds'))
+
+    def _set(self, limit, remaining, reset):
+        self._cond.acquire()
+        try:
+            self.remaining = int(remaining)
+            if limit is not None:
+                self.limit = int(limit)
+            if reset is not None:
+                self.reset = int(reset)
+
+            # Spread what is left of the budget (but the reserve) until reset.
+            window = max((self.reset or 0) - time.time(), 1)
+            self._bucket.rate = max(self.remaining - self.reserve, 0) / window
+            self._cond.notifyAll()
+        finally:
+            self._cond.release()
+
+    def is_fresh(self):
+        """
+        True if we know the budget for the current window.
+        """
+        return self.remaining is not None and self.reset is not None \
+            and self.reset > time.time()
+
+    def _until_reset(self):
+        return max((self.reset or 0) - time.time(), 0)
+
+    def _wait(self, priority, remaining, reset, burst):
+        # Seconds to wait for `remaining` hits in a window ending at
+        # `reset`, with the window still open. burst is the bucket's peek
+        # or take, for background requests that can go.
+        if priority == PRIORITY_INTERACTIVE:
+            return 0 if remaining > 0 else self._until_reset()
+
+        if self._interactive:
+            return INTERACTIVE_POLL
+
+        if remaining <= self.reserve:
+            return self._until_reset()
+
+        if reset is None:
+            return 0
+
+        return burst()
+
+    def peek(self, priority=PRIORITY_INTERACTIVE):
+        """
+        Estimate of how many seconds a request with the given priority
+        would wait before being sent. Unlike delay, it changes nothing, so
+        it can be called without holding the limiter's lock.
+        """
+        remaining, reset = self.remaining, self.reset
+        if remaining is None or reset is not None and reset <= time.time():
+            return 0
+
+        return self._wait(priority, remaining, reset, self._bucket.peek)
+
+    def delay(self, priority=PRIORITY_INTERACTIVE):
+        """
+        Returns how many seconds a request with the given priority should
+        wait before being sent. It's the send side of acquire and must be
+        called with the lock held: an expired window is reset here, and a
+        background request that can go now takes a token of the burst
+        bucket. Hits are taken from the budget by acquire. Use peek for
+        estimates.
+        """
+        if self.remaining is None:
+            return 0
+
+        if self.reset is not None and self.reset <= time.time():
+            # Window was reset, assume we have a full budget again until
+            # next response tell us the truth.
+            self.remaining = self.limit
+            self.reset = None
+            self._bucket.rate = 0
+            self._bucket.tokens = self._bucket.capacity
+            return 0
+
+        return self._wait(priority, self.remaining, self.reset,
+                          self._bucket.take)
+
+    def acquire(self, priority=PRIORITY_INTERACTIVE, deadline=None):
+        """
+        Blocks until a request with the given priority can be sent and
+        takes one hit from the budget. Returns the seconds waited, or None
+        without taking anything if the request can't be sent before
+        `deadline` (absolute time, as in time.time()).
+        """
+        start = time.time()
+        self._cond.acquire()
+        try:
+            if priority == PRIORITY_INTERACTIVE:
+                self._interactive += 1
+
+            try:
+                while True:
+                    wait = self.delay(priority)
+                    if not wait:
+                        break
+                    if deadline is not None and \
+                       time.time() + wait > deadline:
+                        return None
+                    self._cond.wait(wait)
+            finally:
+                if priority == PRIORITY_INTERACTIVE:
+                    self._interactive -= 1
+                    self._cond.notifyAll()
+
+            if self.remaining is not None:
+                self.remaining = max(self.remaining - 1, 0)
+
+            waited = time.time() - start
+            self.waited += waited
+            return waited
+        finally:
+            self._cond.release()
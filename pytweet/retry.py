@@ -0,0 +1,164 @@
+"""
+Retry policies and circuit breakers. Transient errors (a 502 in the middle
+of a long pagination walk) are retried with exponential backoff and
+jitter, while a circuit breaker stops hammering a host that is down.
+"""
+
+import random
+import threading
+import time
+
+# HTTP codes worth retrying. Everything else is the caller's fault.
+RETRY_CODES = (500, 502, 503, 504)
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half-open'
+
+
+class RetryPolicy(object):
+    """
+    Tells if and when a failed request should be retried.
+
+    params are:
+        retries: max number of retries. [optional]
+        backoff: base delay in seconds, doubled on each attempt. [optional]
+        max_backoff: max delay between attempts. [optional]
+        jitter: if True use "full jitter": a random delay between 0 and
+                the exponential one. [optional]
+        codes: HTTP codes that can be retried. Network errors (no code)
+               are always retried. [optional]
+
+    >>> policy = RetryPolicy(retries=2, backoff=1, jitter=False)
+    >>> policy.should_retry(0, 502), policy.should_retry(0, 404)
+    (True, False)
+    >>> policy.should_retry(2, None)
+    False
+    >>> policy.delay(0), policy.delay(3)
+    (1, 8)
+
+    """
+
+    def __init__(self, retries=3, backoff=0.5, max_backoff=30, jitter=True,
+                 codes=RETRY_CODES):
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.jitter = jitter
+        self.codes = codes
+
+    def is_transient(self, code):
+        """
+        True if an error with the given HTTP code (or None for network
+        errors) is likely to go away.
+        """
+        return code is None or code in self.codes
+
+    def should_retry(self, attempt, code):
+        """
+        True if the request that failed on `attempt` (zero based) with
+        HTTP `code` should be tried again.
+        """
+        return attempt < self.retries and self.is_transient(code)
+
+    def delay(self, attempt):
+        """
+        Seconds to wait before retrying after `attempt` failed.
+        """
+        delay = min(self.max_backoff, self.backoff * 2 ** attempt)
+        if self.jitter:
+            delay = random.uniform(0, delay)
+
+        return delay
+
+
+NO_RETRY = RetryPolicy(retries=0)
+
+
+class CircuitBreaker(object):
+    """
+    Per host circuit breaker. After `threshold` consecutive failures the
+    circuit is opened and requests fail fast for `reset_timeout` seconds.
+    Then one request is let through (half-open); if it succeeds the
+    circuit is closed again, otherwise it's opened for another period.
+
+    >>> breaker = CircuitBreaker(threshold=2, reset_timeout=60)
+    >>> breaker.failure(); breaker.allow()
+    True
+    >>> breaker.failure(); breaker.allow()
+    False
+    >>> breaker.stats()['state']
+    'open'
+
+    """
+
+    def __init__(self, threshold=5, reset_timeout=30):
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = None
+        self.total_failures = 0
+        self.total_rejected = 0
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """
+        True if a request can be sent.
+        """
+        self._lock.acquire()
+        try:
+            if self.state == OPEN:
+                if time.time() - self.opened_at < self.reset_timeout:
+                    self.total_rejected += 1
+                    return False
+
+                # Give it a chance.
+                self.state = HALF_OPEN
+                return True
+
+            if self.state == HALF_OPEN:
+                # There is a probe in flight already.
+                self.total_rejected += 1
+                return False
+
+            return True
+        finally:
+            self._lock.release()
+
+    def success(self):
+        self._lock.acquire()
+        self.state = CLOSED
+        self.failures = 0
+        self._lock.release()
+
+    def cancel(self):
+        """
+        The request allowed wasn't sent after all. If it was the half-open
+        probe, the next request is let through instead.
+        """
+        self._lock.acquire()
+        if self.state == HALF_OPEN:
+            self.state = OPEN
+        self._lock.release()
+
+    def failure(self):
+        self._lock.acquire()
+        self.failures += 1
+        self.total_failures += 1
+        if self.state == HALF_OPEN or self.failures >= self.threshold:
+            self.state = OPEN
+            self.opened_at = time.time()
+        self._lock.release()
+
+    def stats(self):
+        """
+        Breaker state for monitoring.
+        """
+        return {
+            'state': self.state,
+            'failures': self.failures,
+            'total_failures': self.total_failures,
+            'total_rejected': self.total_rejected,
+            'opened_at': self.opened_at,
+        }
@@ -0,0 +1,375 @@
+"""
+Adaptive polling of standing searches. Instead of polling every query at
+a fixed interval, each query is polled as often as its results come in:
+the scheduler keeps a moving average of every query velocity (results
+per second) and aims at `target` new results per poll. Quiet queries
+are polled rarely and busy ones often, and when the sum of all of them
+would exceed the rate budget every interval is stretched evenly.
+
+Each poll only asks for results newer than the last one seen: since_id
+moves to the search max_id (see TwitterSearchResultSet._fill_metadata),
+even when nothing new was found.
+
+Usage:
+
+    def found(query, results):
+        ...
+
+    scheduler = PollingScheduler(api, callback=found)
+    for query in queries:
+        scheduler.add(query)
+    scheduler.start()       # Polls from a background thread
+    ...
+    scheduler.stop()
+
+New results can be read from a queue instead (queue=Queue.Queue()), as
+(query, results) tuples.
+"""
+
+import calendar
+import heapq
+import itertools
+import sys
+import threading
+import time
+from workers import WorkerPool
+
+# Poll intervals bounds, in seconds.
+MIN_INTERVAL = 30
+MAX_INTERVAL = 3600
+# New results we would like to get on every poll.
+TARGET_RESULTS = 20
+# Weight of the last poll in the velocity moving average.
+ALPHA = 0.3
+# Concurrent polls.
+WORKERS = 4
+
+
+class QueryState(object):
+    """
+    Scheduling state of a standing query.
+
+    params are:
+        query: Search terms
+        since_id: Newest result id seen
+        velocity: Moving average of new results per second (None until
+                  known)
+        interval: Seconds between polls, before budget stretching
+        next_poll: time.time() of next poll
+        last_poll: time.time() of the last poll
+        polls: Number of successful polls
+        failures: Consecutive failed polls
+        error: Exception raised by the last poll, if it failed
+    """
+
+    def __init__(self, query, since_id=0, search_kwargs=None):
+        self.query = query
+        self.since_id = since_id
+        self.search_kwargs = search_kwargs or {}
+        self.velocity = None
+        self.interval = MIN_INTERVAL
+        self.next_poll = 0
+        self.last_poll = None
+        self.polls = 0
+        self.failures = 0
+        self.error = None
+
+    def __repr__(self):
+        return '<QueryState %r interval=%.0f>' % (self.query, self.interval)
+
+
+class PollingScheduler(object):
+    """
+    Keeps standing searches up to date.
+
+    params are:
+        api: Twitter instance (or TwitterPool)
+        callback: Called with (query, results) for new results, newest
+                  first. [optional]
+        queue: Queue where (query, results) tuples are put. [optional]
+        min_interval, max_interval: Poll interval bounds in seconds.
+                                    [optional]
+        target: New results wanted per poll. [optional]
+        budget: Requests per hour for all the polls. By default it's what
+                the client rate limiter says is left. [optional]
+        workers: Concurrent polls. [optional]
+
+    >>> import Queue
+    >>> from tweet import Twitter
+    >>> from transport import MemoryTransport
+    >>> transport = MemoryTransport()
+    >>> transport.add('/search.json', {'results': [
+    ...     {'id': 3, 'created_at': 'Fri, 02 Oct 2009 12:00:10 +0000'},
+    ...     {'id': 2, 'created_at': 'Fri, 02 Oct 2009 12:00:00 +0000'}],
+    ...     'max_id': 3, 'completed_in': 0.01})
+    >>> results = Queue.Queue()
+    >>> scheduler = PollingScheduler(Twitter(transport=transport),
+    ...                              queue=results, min_interval=1)
+    >>> scheduler.add('python')
+    >>> scheduler.run_pending()
+    1
+    >>> query, found = results.get_nowait()
+    >>> query, [result.id for result in found]
+    ('python', [3, 2])
+    >>> state = scheduler.states['python']
+    >>> state.since_id, state.velocity, state.interval
+    (3, 0.2, 100.0)
+
+    """
+
+    def __init__(self, api, callback=None, queue=None,
+                 min_interval=MIN_INTERVAL, max_interval=MAX_INTERVAL,
+                 target=TARGET_RESULTS, budget=None, workers=WORKERS):
+        self.api = api
+        self.callback = callback
+        self.queue = queue
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.target = target
+        self.budget = budget
+        self.states = {}
+
+        # Heap of (next poll, sequence, query). Entries of removed or
+        # rescheduled queries are skipped when popped.
+        self._heap = []
+        self._seq = itertools.count()
+        self._polling = set()
+        # Sum of 1 / interval: requests per second we'd like to make.
+        self._rate = 0.0
+        self._cond = threading.Condition()
+        self._pool = WorkerPool(workers)
+        self._thread = None
+        self._stopped = threading.Event()
+
+    def add(self, query, since_id=0, **search_kwargs):
+        """
+        Start polling a query. search_kwargs are passed to search (lang,
+        geocode).
+        """
+        self._cond.acquire()
+        try:
+            if query in self.states:
+                self._rate -= 1.0 / self.states[query].interval
+
+            state = QueryState(query, since_id, search_kwargs)
+            state.interval = self.min_interval
+            self.states[query] = state
+            self._rate += 1.0 / state.interval
+            self._push(state, time.time())
+        finally:
+            self._cond.release()
+
+    def remove(self, query):
+        self._cond.acquire()
+        try:
+            state = self.states.pop(query)
+            self._rate -= 1.0 / state.interval
+        finally:
+            self._cond.release()
+
+    def _push(self, state, when):
+        # Schedule a poll (lock held).
+        state.next_poll = when
+        heapq.heappush(self._heap, (when, self._seq.next(), state.query))
+        self._cond.notify()
+
+    def budget_rate(self):
+        """
+        Requests per second available for polls, or None if unknown.
+        """
+        if self.budget is not None:
+            return self.budget / 3600.0
+
+        clients = getattr(self.api, 'clients', [self.api])
+        rate = 0.0
+        for client in clients:
+            limiter = client.rate_limiter
+            if not limiter.is_fresh():
+                return None
+
+            window = max(limiter.reset - time.time(), 1)
+            rate += max(limiter.remaining - limiter.reserve, 0) / window
+
+        return rate
+
+    def _interval(self, velocity):
+        # Poll interval for a velocity, before budget stretching.
+        if velocity is None:
+            return self.min_interval
+        if velocity <= 0:
+            return self.max_interval
+
+        return min(max(self.target / velocity, self.min_interval),
+                   self.max_interval)
+
+    def _stretch(self):
+        # How much intervals have to be stretched to fit in the budget.
+        budget = self.budget_rate()
+        if budget is None or self._rate <= budget:
+            return 1.0
+        if budget <= 0:
+            return float(self.max_interval) / self.min_interval
+
+        return self._rate / budget
+
+    def _velocity(self, state, results, now):
+        # Update the velocity moving average after a poll.
+        if state.last_poll is not None:
+            observed = len(results) / max(now - state.last_poll, 1e-3)
+        elif len(results) > 1 and results[0].created_at and \
+             results[-1].created_at:
+            # First poll: estimate from the results dates.
+            span = calendar.timegm(results[0].created_at.utctimetuple()) - \
+                   calendar.timegm(results[-1].created_at.utctimetuple())
+            observed = len(results) / float(max(span, 1))
+        else:
+            return state.velocity
+
+        if state.velocity is None:
+            return observed
+
+        return ALPHA * observed + (1 - ALPHA) * state.velocity
+
+    def poll(self, query, now=None):
+        """
+        Poll a query now and schedule its next poll. Returns the number of
+        new results.
+        """
+        state = self.states[query]
+        now = now or time.time()
+        try:
+            resultset = self.api.search(query, since_id=state.since_id,
+                                        **state.search_kwargs)
+            if state.since_id:
+                results = []
+                for page, items in resultset.iterpages():
+                    results.extend(items)
+            else:
+                # First poll, no need to backfill: the first page will do.
+                results = resultset[:]
+        except:
+            state.error = sys.exc_info()[1]
+            state.failures += 1
+            self._reschedule(state, now, state.velocity, failed=True)
+            raise
+
+        state.error = None
+        state.failures = 0
+        state.polls += 1
+        velocity = self._velocity(state, results, now)
+        state.last_poll = now
+        if results:
+            state.since_id = max(state.since_id, results[0].id)
+        state.since_id = max(state.since_id, resultset.max_id)
+        self._reschedule(state, now, velocity)
+
+        if results:
+            if self.callback is not None:
+                self.callback(query, results)
+            if self.queue is not None:
+                self.queue.put((query, results))
+
+        return len(results)
+
+    def _reschedule(self, state, now, velocity, failed=False):
+        self._cond.acquire()
+        try:
+            if self.states.get(state.query) is not state:
+                # Removed (or added again) while polling.
+                return
+
+            self._rate -= 1.0 / state.interval
+            state.velocity = velocity
+            state.interval = self._interval(velocity)
+            self._rate += 1.0 / state.interval
+
+            delay = state.interval * self._stretch()
+            if failed:
+                # Back off from failing queries.
+                delay = min(delay * 2 ** min(state.failures, 6),
+                            self.max_interval)
+            self._push(state, now + delay)
+        finally:
+            self._cond.release()
+
+    def _due(self, now):
+        # Pop queries whose poll is due (lock held).
+        due = []
+        while self._heap and self._heap[0][0] <= now:
+            when, _, query = heapq.heappop(self._heap)
+            state = self.states.get(query)
+            if state is None or state.next_poll != when or \
+               query in self._polling:
+                continue
+
+            due.append(query)
+
+        return due
+
+    def run_pending(self, now=None):
+        """
+        Poll every query that is due, in this thread. Returns how many
+        were polled. Failures are recorded in their QueryState.
+        """
+        now = now or time.time()
+        self._cond.acquire()
+        try:
+            due = self._due(now)
+        finally:
+            self._cond.release()
+
+        for query in due:
+            try:
+                self.poll(query, now)
+            except Exception:
+                pass
+
+        return len(due)
+
+    def _poll_async(self, query):
+        try:
+            self.poll(query)
+        except Exception:
+            pass
+        finally:
+            self._cond.acquire()
+            self._polling.discard(query)
+            self._cond.release()
+
+    def _run(self):
+        while not self._stopped.isSet():
+            self._cond.acquire()
+            try:
+                due = self._due(time.time())
+                if not due:
+                    wait = self._heap[0][0] - time.time() if self._heap \
+                           else 1
+                    self._cond.wait(min(max(wait, 0.01), 1))
+                    continue
+
+                self._polling.update(due)
+            finally:
+                self._cond.release()
+
+            for query in due:
+                self._pool.submit(self._poll_async, query)
+
+    def start(self):
+        """
+        Poll from a background thread until stop() is called.
+        """
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run)
+        self._thread.setDaemon(True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        self._cond.acquire()
+        self._cond.notify()
+        self._cond.release()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+        self._pool.close()
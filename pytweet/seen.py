@@ -0,0 +1,295 @@
+"""
+Seen-id filters for long running consumers, to process every status (or
+search result) once. A set of ints grows forever and costs about 70
+bytes per id; these don't:
+
+    SeenIds     Exact. Ids are kept in 8 byte sorted arrays, one per
+                generation of time, and forgotten after max_age seconds.
+    SeenBloom   Approximate, fixed memory. Rotating Bloom filters that
+                remember the last ids added, with a configurable false
+                positive rate (an id not seen taken as seen).
+
+Both have the same interface:
+
+    seen = SeenIds(max_age=7 * 24 * 3600)
+    for status in seen.filter(api.search('python').tail()):
+        ...
+
+"""
+
+import bisect
+import itertools
+import math
+import time
+from array import array
+
+# Ids are stored as C longs, 64 bits in every platform we run on.
+INT_TYPECODE = 'l'
+MASK64 = (1 << 64) - 1
+
+
+class SeenFilter(object):
+    """
+    Base class of seen-id filters. Subclasses implement add() and
+    __contains__.
+    """
+
+    def add(self, id):
+        """
+        Remember an id. Returns False if it was already seen.
+        """
+        raise NotImplementedError
+
+    def __contains__(self, id):
+        raise NotImplementedError
+
+    def filter(self, items):
+        """
+        Yields the items (objects with an id) not seen yet, and remembers
+        them.
+        """
+        for item in items:
+            if self.add(item.id):
+                yield item
+
+
+class SeenIds(SeenFilter):
+    """
+    Exact seen-id set with time based eviction. Ids of the current
+    generation are in a set, older generations are sealed in sorted
+    int64 arrays. Ids are remembered for at least max_age seconds, so
+    memory is bounded by the ids added in max_age (plus a generation).
+
+    params are:
+        max_age: Seconds ids are remembered [optional]
+        generations: Generations max_age is split in. More generations
+                     evict earlier but make lookups a bit slower.
+                     [optional]
+        clock: Function returning current time [optional]
+
+    >>> now = [0]
+    >>> seen = SeenIds(max_age=60, generations=2, clock=lambda: now[0])
+    >>> seen.add(10), seen.add(10), 10 in seen
+    (True, False, True)
+    >>> now[0] = 40
+    >>> seen.add(11), len(seen), 10 in seen
+    (True, 2, True)
+    >>> now[0] = 100
+    >>> 10 in seen, 11 in seen, len(seen)
+    (False, True, 1)
+
+    After an idle period, ids go as soon as their generation is too old:
+
+    >>> seen.add(12)
+    True
+    >>> now[0] = 200
+    >>> 12 in seen, len(seen)
+    (False, 0)
+
+    """
+
+    def __init__(self, max_age=7 * 24 * 3600, generations=8,
+                 clock=time.time):
+        self.max_age = max_age
+        self.generation = float(max_age) / generations
+        self.clock = clock
+        self._current = set()
+        self._started = clock()
+        # (ended, sorted array of ids), oldest first
+        self._sealed = []
+
+    def _rotate(self):
+        # Seal the current generation if it's over, and evict the ones
+        # older than max_age.
+        now = self.clock()
+        if now - self._started >= self.generation:
+            # Sealed with the end of its window, not now: after an idle
+            # period it would be kept up to max_age longer.
+            if self._current:
+                ended = self._started + self.generation
+                self._sealed.append((ended, array(INT_TYPECODE,
+                                                  sorted(self._current))))
+            self._current = set()
+            self._started = now
+
+        while self._sealed and self._sealed[0][0] <= now - self.max_age:
+            del self._sealed[0]
+
+    def add(self, id):
+        self._rotate()
+        if id in self:
+            return False
+
+        self._current.add(id)
+        return True
+
+    def __contains__(self, id):
+        self._rotate()
+        if id in self._current:
+            return True
+
+        for _, ids in self._sealed:
+            idx = bisect.bisect_left(ids, id)
+            if idx < len(ids) and ids[idx] == id:
+                return True
+
+        return False
+
+    def __len__(self):
+        self._rotate()
+        return len(self._current) + sum([len(ids) for _, ids in self._sealed])
+
+
+class IdSet(SeenFilter):
+    """
+    Exact id set with no eviction, for things like the users visited by
+    a graph crawl. Ids live in a sorted int64 array; new ones go to a
+    small set first, merged into the array when it gets to a quarter of
+    its size (or merge_size), so adding stays cheap.
+
+    params are:
+        ids: Initial ids [optional]
+        merge_size: Min new ids to merge [optional]
+
+    >>> ids = IdSet([5, 3], merge_size=2)
+    >>> ids.add(4), ids.add(3), 4 in ids, 6 in ids, len(ids)
+    (True, False, True, False, 3)
+    >>> list(ids)
+    [3, 4, 5]
+
+    """
+
+    def __init__(self, ids=(), merge_size=4096):
+        self.merge_size = merge_size
+        self._ids = array(INT_TYPECODE)
+        self._new = set()
+        for id in ids:
+            self.add(id)
+
+    def compact(self):
+        """
+        Merge new ids into the sorted array.
+        """
+        if self._new:
+            # Two sorted runs, sorted() merges them in linear time.
+            self._ids = array(INT_TYPECODE, sorted(itertools.chain(
+                self._ids, sorted(self._new))))
+            self._new = set()
+
+    def add(self, id):
+        new, ids = self._new, self._ids
+        if id in new:
+            return False
+        idx = bisect.bisect_left(ids, id)
+        if idx < len(ids) and ids[idx] == id:
+            return False
+
+        new.add(id)
+        if len(new) >= max(self.merge_size, len(ids) // 4):
+            self.compact()
+        return True
+
+    def __contains__(self, id):
+        if id in self._new:
+            return True
+
+        idx = bisect.bisect_left(self._ids, id)
+        return idx < len(self._ids) and self._ids[idx] == id
+
+    def __len__(self):
+        return len(self._ids) + len(self._new)
+
+    def __iter__(self):
+        self.compact()
+        return iter(self._ids)
+
+
+def _hash(id):
+    # splitmix64 finalizer: spreads sequential ids over 64 bits.
+    z = (id + 0x9e3779b97f4a7c15) & MASK64
+    z = ((z ^ (z >> 30)) * 0xbf58476d1ce4e5b9) & MASK64
+    z = ((z ^ (z >> 27)) * 0x94d049bb133111eb) & MASK64
+    return z ^ (z >> 31)
+
+
+class SeenBloom(SeenFilter):
+    """
+    Rotating Bloom filter. Each generation is a filter for `capacity` ids;
+    when the newest one is full a new one is started and the oldest is
+    dropped. The last capacity * (generations - 1) ids are always
+    remembered, older ones are forgotten eventually. Memory is fixed:
+    about generations * capacity * 1.44 * log2(1 / error_rate) bits.
+
+    params are:
+        capacity: Ids per generation [optional]
+        error_rate: Max false positive rate, of all generations together
+                    [optional]
+        generations: Filters kept [optional]
+
+    >>> seen = SeenBloom(capacity=1000, error_rate=0.01)
+    >>> seen.add(10), seen.add(10), 10 in seen, 11 in seen
+    (True, False, True, False)
+    >>> false = [id for id in xrange(10 ** 6, 10 ** 6 + 1000)
+    ...          if not seen.add(id)]
+    >>> len(false) < 20
+    True
+    >>> seen.size
+    2758
+
+    """
+
+    def __init__(self, capacity=10 ** 6, error_rate=0.001, generations=2):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.generations = generations
+
+        # A false positive can come from any generation.
+        rate = error_rate / generations
+        self.bits = int(math.ceil(-capacity * math.log(rate) /
+                                  math.log(2) ** 2))
+        self.hashes = max(int(round(self.bits / float(capacity) *
+                                    math.log(2))), 1)
+        self.size = (self.bits + 7) // 8 * generations
+
+        # [bytearray, ids added], oldest first
+        self._filters = [[bytearray((self.bits + 7) // 8), 0]]
+
+    def _positions(self, id):
+        h = _hash(id)
+        h1, h2 = h & 0xffffffff, (h >> 32) | 1
+        bits = self.bits
+        return [(h1 + i * h2) % bits for i in xrange(self.hashes)]
+
+    def _rotate(self):
+        self._filters.append([bytearray((self.bits + 7) // 8), 0])
+        if len(self._filters) > self.generations:
+            del self._filters[0]
+
+    def add(self, id):
+        positions = self._positions(id)
+        if self._contains(positions):
+            return False
+
+        current = self._filters[-1]
+        if current[1] >= self.capacity:
+            self._rotate()
+            current = self._filters[-1]
+
+        bits = current[0]
+        for pos in positions:
+            bits[pos >> 3] |= 1 << (pos & 7)
+        current[1] += 1
+        return True
+
+    def _contains(self, positions):
+        for bits, _ in self._filters:
+            for pos in positions:
+                if not bits[pos >> 3] & (1 << (pos & 7)):
+                    break
+            else:
+                return True
+
+        return False
+
+    def __contains__(self, id):
+        return self._contains(self._positions(id))
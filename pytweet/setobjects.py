@@ -3,13 +3,37 @@ Twitter Objects Set. Here we define objects that can return more than
 one result taking care of pagination logic.
 """
 
+import copy
 import math
+import time
+from array import array
 from parsers import parse_iso8601
+from ratelimit import PRIORITY_INTERACTIVE, PRIORITY_BACKGROUND
+from columns import Columns, column_kinds
 from datetime import datetime
+from export import Exporter
 from objects import TwitterUser, TwitterStatus, TwitterTrend, \
                     TwitterSearchResult
 
 ITEMS_PER_PAGE = 100
+# Users per lookup request.
+LOOKUP_SIZE = 100
+# Ids are stored as C longs, 64 bits in every platform we run on.
+INT_TYPECODE = 'l'
+
+
+def truncate_since(results, since_id):
+    # Drop raw items (newest first) at or below since_id.
+    #
+    # There is a bug in twitter API. You cannot use max_id 
+    # and since_id together. See:
+    # http://code.google.com/p/twitter-api/issues/detail?id=486
+    for i, item in enumerate(results):
+        if int(item.get('id') or 0) <= since_id:
+            return results[:i]
+
+    return results
+
 
 #########################################################
 # Status Set
@@ -24,15 +48,36 @@ class PaginationSet(object):
         uri: URI for request
         kwargs: depends on Pagination class. usually will 
                 use domain and since_id
+
+    deadline attribute can be set to the max seconds a slice can take, all
+    pages included. DeadlineExceeded is raised when it's not enough. Walks
+    (iterpages, iterbatches, columns, export and tail) can go on for any
+    number of pages, so for them the deadline is per page.
+
+    timeout attribute overrides the client socket timeout for every
+    request of the set.
+
+    >>> def fetch(uri, get_data, **kwargs):
+    ...     print 'page', get_data['page'], 'timeout', kwargs['timeout']
+    ...     return []
+    >>> users = TwitterUserSet(fetch, '/statuses/followers.json',
+    ...                        user='testpy', timeout=2)
+    >>> users[:10]
+    page 1 timeout 2
+    []
     """
 
     resultclass = None
+    results_key = None
+    deadline = None
+    timeout = None
 
     def __init__(self, fetch, uri, **kwargs):
         self._fetch = fetch
         self.uri = uri
         self.domain = kwargs.pop('domain', None)
         self.since_id = kwargs.pop('since_id', 0)
+        self.hooks = kwargs.pop('hooks', None)
         
         # Defaults
         self._results = []
@@ -51,33 +96,83 @@ class PaginationSet(object):
 
     def _get_results(self, result):
         # Get result with some criteria like a dict key or something.
-        # By default we just return given list.
-        return result
+        # By default we just return given list, or its results_key.
+        return result[self.results_key] if self.results_key else result
 
-    def _fetch_results(self, offset):
-        page = int(math.ceil(offset / ITEMS_PER_PAGE)) + 1
+    def _pin(self, newest_id):
+        # Pin next pages to the first one (see iterpages), given the
+        # newest item of page 1. By default there is nothing to pin.
+        pass
+
+    def _anchor(self, deadline=None):
+        # Pin before a walk that starts past page 1, so its pages are
+        # still counted from the first one. By default there is nothing
+        # to pin.
+        pass
+
+    def _request(self, page, deadline=None, raw=False):
+        # Request a page. With raw the response body is returned as is.
         data = self._get_data(page)
 
+        # First page is what the user is waiting for, next ones are just
+        # pagination and can be paced by the rate limiter.
+        priority = PRIORITY_INTERACTIVE if page == 1 else PRIORITY_BACKGROUND
+        kwargs = {'raw': True} if raw else {}
+        return self._fetch(self.uri, get_data=data, domain=self.domain,
+                           priority=priority, timeout=self.timeout,
+                           deadline=deadline, **kwargs)
+
+    def _fetch_raw(self, page, deadline=None):
+        # Fetch a page of raw items (decoded JSON). Items at or below
+        # since_id are dropped.
+        result = self._request(page, deadline)
+        results = self._get_results(result)[:ITEMS_PER_PAGE]
+        if self.since_id:
+            results = truncate_since(results, self.since_id)
+
+        self._fill_metadata(result)
+        return results
+
+    def _build_page(self, page, items):
+        # Build objects from raw items.
+        start = time.time()
+        items = self.resultclass.from_list(items)
+        if self.hooks:
+            self.hooks.emit('page', endpoint=self.uri, page=page,
+                            resultclass=self.resultclass.__name__,
+                            items=len(items), construct=time.time() - start)
+
+        return items
+
+    def _build_batch(self, page, items, kinds):
+        # Build columns from raw items.
+        start = time.time()
+        batch = Columns(kinds)
+        batch.append(items)
+        if self.hooks:
+            self.hooks.emit('page', endpoint=self.uri, page=page,
+                            resultclass=Columns.__name__,
+                            items=len(items), construct=time.time() - start)
+
+        return batch
+
+    def _fetch_page(self, page, deadline=None):
+        # Fetch a page and build its objects.
+        return self._build_page(page, self._fetch_raw(page, deadline))
+
+    def _fetch_results(self, offset, deadline=None):
+        page = int(math.ceil(offset / ITEMS_PER_PAGE)) + 1
+
         # Fill results with empty values. This is done because user can slice
         # a distance of more than one page for example results[10000:10010]
         fill_amount = (page - 1) * ITEMS_PER_PAGE
         for i in xrange(len(self._results), fill_amount):
             self._results.append(None)
 
-        result = self._fetch(self.uri, get_data=data,
-                             domain=self.domain)
-        results = self._get_results(result)
-        results_count = len(results)
+        items = self._fetch_page(page, deadline)
+        results_count = len(items)
         for i in xrange(ITEMS_PER_PAGE):
-            add = '' if i >= results_count else self.resultclass(**results[i])
-
-            # There is a bug in twitter API. You cannot use max_id 
-            # and since_id together. See:
-            # http://code.google.com/p/twitter-api/issues/detail?id=486
-            if hasattr(add, 'id') and add.id <= self.since_id:
-                results_count = i
-                add = ''
-
+            add = items[i] if i < results_count else ''
             if len(self._results) > offset:
                 self._results[offset] = add
             else:
@@ -85,9 +180,118 @@ class PaginationSet(object):
 
             offset += 1
 
-        self._fill_metadata(result)
         return results_count
 
+    def _walk(self, page):
+        # Yields (page, raw items) from `page` on, pinning pages to the
+        # first one.
+        if page > 1:
+            self._anchor(time.time() + self.deadline if self.deadline
+                         else None)
+        while True:
+            deadline = time.time() + self.deadline if self.deadline else None
+            items = self._fetch_raw(page, deadline)
+            if page == 1:
+                self._pin(items and items[0].get('id'))
+            if items:
+                yield page, items
+
+            # if we got less results that per_page we are done.
+            if len(items) < ITEMS_PER_PAGE:
+                return
+
+            page += 1
+
+    def iterpages(self, page=1, parser=None):
+        """
+        Yields (page, items) from `page` on, without keeping them in the
+        set, so memory stays bounded to a page however long the walk is.
+        Pages after the first one are pinned to it (with max_id) when the
+        API allows it, so new items don't shift them. Walks starting past
+        the first page fetch it first to pin to it.
+
+        @page: First page [optional]
+        @parser: parallel.ParallelParser to decode pages and build their
+                 objects in other processes. [optional]
+
+        >>> timeline = [{'id': id} for id in range(1000, 0, -1)]
+        >>> def fetch(uri, get_data, **kwargs):
+        ...     items = [item for item in timeline
+        ...              if item['id'] <= (get_data['max_id'] or 1000)]
+        ...     start = (get_data['page'] - 1) * ITEMS_PER_PAGE
+        ...     return items[start:start + ITEMS_PER_PAGE]
+        >>> statuses = TwitterStatusSet(fetch, '/statuses/user_timeline.json',
+        ...                             user='testpy')
+        >>> [(page, items[0].id) for page, items in statuses.iterpages(8)]
+        [(8, 300), (9, 200), (10, 100)]
+        """
+        if parser is not None:
+            for page, items in parser.pages(self, page):
+                yield page, items
+            return
+
+        for page, items in self._walk(page):
+            yield page, self._build_page(page, items)
+
+    def iterbatches(self, fields=None, page=1, parser=None):
+        """
+        Like iterpages, but yields (page, columns.Columns) and no object is
+        ever built.
+
+        @fields: Fields to get (see columns.column_kinds). All the plain
+                 ones by default. [optional]
+        @page: First page [optional]
+        @parser: parallel.ParallelParser [optional]
+        """
+        kinds = column_kinds(self.resultclass, fields)
+        if parser is not None:
+            for page, batch in parser.pages(self, page, kinds):
+                yield page, batch.finish()
+            return
+
+        for page, items in self._walk(page):
+            yield page, self._build_batch(page, items, kinds).finish()
+
+    def columns(self, start=0, stop=None, fields=None):
+        """
+        Columns of items [start:stop) in a single batch (see iterbatches).
+        With no stop every page is fetched.
+
+        >>> timeline = [{'id': id} for id in range(1000, 0, -1)]
+        >>> def fetch(uri, get_data, **kwargs):
+        ...     items = [item for item in timeline
+        ...              if item['id'] <= (get_data['max_id'] or 1000)]
+        ...     start = (get_data['page'] - 1) * ITEMS_PER_PAGE
+        ...     return items[start:start + ITEMS_PER_PAGE]
+        >>> statuses = TwitterStatusSet(fetch, '/statuses/user_timeline.json',
+        ...                             user='testpy')
+        >>> ids = list(statuses.columns(250, 450, fields=['id'])['id'])
+        >>> ids == range(750, 550, -1)
+        True
+        """
+        kinds = column_kinds(self.resultclass, fields)
+        batch = Columns(kinds)
+        page = start // ITEMS_PER_PAGE + 1
+        if stop is None or stop > start:
+            for page, items in self._walk(page):
+                offset = (page - 1) * ITEMS_PER_PAGE
+                upper = None if stop is None else stop - offset
+                batch.extend(self._build_batch(
+                    page, items[max(start - offset, 0):upper], kinds))
+                if stop is not None and offset + len(items) >= stop:
+                    break
+
+        return batch.finish()
+
+    def export(self, path, **kwargs):
+        """
+        Stream every item to a file, JSON Lines or CSV, optionally
+        compressed. Interrupted exports resume from their last checkpoint.
+        See export.Exporter for params. Returns the number of items
+        exported.
+        """
+        return Exporter(self, path, **kwargs).run()
+
     def __len__(self):
         raise Exception("I can't tell you D:")
 
@@ -129,6 +333,8 @@ class PaginationSet(object):
             offset = k
             limit = 1
 
+        deadline = time.time() + self.deadline if self.deadline else None
+        pages = 0
         while True:
             # Check if some result is None or if result is smaller than 
             # requested index.
@@ -141,7 +347,8 @@ class PaginationSet(object):
                 break
 
             # if we got less results that per_page we are done.
-            fetch_total = self._fetch_results(offset)
+            fetch_total = self._fetch_results(offset, deadline)
+            pages += 1
             if fetch_total < ITEMS_PER_PAGE:
                 break
 
@@ -149,11 +356,106 @@ class PaginationSet(object):
             limit -= fetch_total
 
         if isinstance(k, slice):
+            # Only real slices, item access (and iteration) would count
+            # every item as a cache hit.
+            if self.hooks:
+                self.hooks.emit('slice', endpoint=self.uri, pages=pages)
             return [res for res in self._results[k] if res != '']
         else:
             return self._results[k] or None
 
 
+class TimelineSet(PaginationSet):
+    """
+    Result set of items ordered by id, newest first (statuses and search
+    results). Only these have a meaning for "newer than since_id", so
+    only these can be tailed.
+    """
+
+    def __init__(self, *args, **kwargs):
+        # Round of tail() in progress: newest item and last item yielded.
+        self._tail_newest = 0
+        self._tail_floor = 0
+        super(TimelineSet, self).__init__(*args, **kwargs)
+
+    def _since(self, since_id, max_id=0):
+        # Fresh copy of the set for items newer than since_id, and not
+        # newer than max_id if given.
+        clone = copy.copy(self)
+        clone._results = []
+        clone._actualidx = 0
+        clone.since_id = since_id
+        clone.max_id = max_id
+        return clone
+
+    def tail(self, interval=60, max_interval=600, backfill=False):
+        """
+        Yields new items forever, as they show up. Every round walks the
+        items newer than since_id (newest first) and then moves since_id
+        forward, so nothing is yielded twice and items already seen are
+        dropped before objects are built for them. Rounds are `interval`
+        apart; once an empty round has waited that long, every other
+        empty round in a row doubles the wait, up to max_interval.
+
+        A tail that is stopped (or fails) halfway a round resumes where it
+        was with another tail() call on the same set.
+
+        @interval: Seconds between rounds [optional]
+        @max_interval: Max seconds between rounds [optional]
+        @backfill: With no since_id, walk every page on the first round
+                   instead of just the first one. [optional]
+
+        >>> import itertools
+        >>> timeline = [{'id': id} for id in range(250, 0, -1)]
+        >>> def fetch(uri, get_data, **kwargs):
+        ...     # Newest first, max_id and since_id can't be used together.
+        ...     items = [item for item in timeline if (get_data['max_id'] \\
+        ...              and item['id'] <= get_data['max_id']) or \\
+        ...              (not get_data['max_id'] and \\
+        ...               item['id'] > (get_data['since_id'] or 0))]
+        ...     start = (get_data['page'] - 1) * ITEMS_PER_PAGE
+        ...     return items[start:start + ITEMS_PER_PAGE]
+        >>> statuses = TwitterStatusSet(fetch, '/statuses/user_timeline.json',
+        ...                             user='testpy', since_id=240)
+        >>> new = statuses.tail(interval=0)
+        >>> [status.id for status in itertools.islice(new, 3)]
+        [250, 249, 248]
+        >>> timeline[:0] = [{'id': 252}, {'id': 251}]
+        >>> [status.id for status in itertools.islice(new, 9)]
+        [247, 246, 245, 244, 243, 242, 241, 252, 251]
+        >>> statuses.since_id
+        250
+        """
+        wait, idle = interval, False
+        while True:
+            since_id = self.since_id or 0
+            newest = self._tail_newest
+            upper = self._tail_floor - 1 if self._tail_floor else 0
+            current = self._since(since_id, upper)
+            for page, items in current._walk(1):
+                newest = max(newest, int(items[0].get('id') or 0))
+                self._tail_newest = newest
+                for item in current._build_page(page, items):
+                    self._tail_floor = item.id
+                    yield item
+
+                if not since_id and not backfill:
+                    break
+
+            # Round complete. Search sets also know the newest result id
+            # even if there was nothing new for us.
+            self.since_id = max(since_id, newest, current.max_id)
+            self._tail_newest = self._tail_floor = 0
+
+            if newest > since_id:
+                wait, idle = interval, False
+            elif idle:
+                wait = min(wait * 2, max_interval)
+            else:
+                idle = True
+            time.sleep(wait)
+
+
 class TwitterUserSet(PaginationSet):
     """
     User result set. It's a lazy bunch of users. 
@@ -168,6 +470,212 @@ class TwitterUserSet(PaginationSet):
         }
 
 
+class TwitterIdSet(object):
+    """
+    Lazy set of user ids, from the followers/friends ids endpoints. Pages
+    are walked with cursors and come as int64 arrays, 5000 ids per
+    request instead of 100 users.
+
+    params are:
+        fetch: callback function to fetch url
+        uri: URI for request
+        user: The ID or screen name of a user
+        domain: Twitter domain API [optional]
+        timeout: Socket timeout for every request, defaults to the client
+                 timeout [optional]
+
+    deadline works as in PaginationSet, per page. Users hydrated from the
+    set get it and the timeout too.
+
+    >>> def fetch(uri, get_data, **kwargs):
+    ...     pages = {-1: ([3, 2], 7), 7: ([1], 0)}
+    ...     ids, next_cursor = pages[get_data['cursor']]
+    ...     return {'ids': ids, 'next_cursor': next_cursor}
+    >>> ids = TwitterIdSet(fetch, '/followers/ids.json', user='testpy')
+    >>> ids.ids()
+    array('l', [3, 2, 1])
+    >>> users = ids.hydrate()
+    >>> len(users)
+    3
+
+    """
+
+    deadline = None
+
+    def __init__(self, fetch, uri, user=None, hooks=None, domain=None,
+                 timeout=None):
+        self._fetch = fetch
+        self.uri = uri
+        self.user = user
+        self.hooks = hooks
+        self.domain = domain
+        self.timeout = timeout
+
+    def _get_data(self, cursor):
+        data = {'cursor': cursor}
+        if isinstance(self.user, (int, long)):
+            data['user_id'] = self.user
+        else:
+            data['screen_name'] = self.user
+
+        return data
+
+    def iterpages(self):
+        """
+        Yields (page, array of ids), walking every cursor.
+        """
+        cursor, page = -1, 1
+        while cursor:
+            deadline = time.time() + self.deadline if self.deadline else None
+            priority = PRIORITY_INTERACTIVE if page == 1 \
+                       else PRIORITY_BACKGROUND
+            result = self._fetch(self.uri, get_data=self._get_data(cursor),
+                                 domain=self.domain, priority=priority,
+                                 timeout=self.timeout, deadline=deadline)
+
+            start = time.time()
+            if isinstance(result, list):
+                # Not cursored: every id at once.
+                ids, cursor = result, 0
+            else:
+                ids, cursor = result['ids'], result.get('next_cursor')
+            ids = array(INT_TYPECODE, ids)
+            if self.hooks:
+                self.hooks.emit('page', endpoint=self.uri, page=page,
+                                resultclass=array.__name__, items=len(ids),
+                                construct=time.time() - start)
+
+            if ids:
+                yield page, ids
+            page += 1
+
+    def __iter__(self):
+        for page, ids in self.iterpages():
+            for id in ids:
+                yield id
+
+    def ids(self):
+        """
+        Every id in a single array.
+        """
+        result = array(INT_TYPECODE)
+        for page, ids in self.iterpages():
+            result.extend(ids)
+
+        return result
+
+    def hydrate(self):
+        """
+        LazyUsers for every id. Users are only fetched when accessed.
+        """
+        users = LazyUsers(self._fetch, self.ids(), hooks=self.hooks,
+                          domain=self.domain, timeout=self.timeout)
+        users.deadline = self.deadline
+        return users
+
+
+class LazyUsers(object):
+    """
+    Users by id, fetched in bulk (LOOKUP_SIZE ids per request) only when
+    they are accessed. Indexing and slicing fetch the blocks of ids
+    needed, and keep them; iterating fetches block by block without
+    keeping them. Users that no longer exist are None.
+
+    params are:
+        fetch: callback function to fetch url
+        ids: User ids
+        domain: Twitter domain API [optional]
+        timeout: Socket timeout for every request, defaults to the client
+                 timeout [optional]
+
+    deadline works as in PaginationSet, per request. Lookups for indexing
+    and the first block of an iteration are interactive, the rest of an
+    iteration is background work for the rate limiter.
+
+    >>> def fetch(uri, get_data, **kwargs):
+    ...     print 'lookup', get_data['user_id']
+    ...     return [{'id': int(id), 'screen_name': 'user' + id}
+    ...             for id in get_data['user_id'].split(',') if id != '2']
+    >>> users = LazyUsers(fetch, range(150, 0, -1))
+    >>> users[0].screen_name    # doctest: +ELLIPSIS
+    lookup 150,149,...,51
+    u'user150'
+    >>> [user.id for user in users[98:101]]    # doctest: +ELLIPSIS
+    lookup 50,49,...,1
+    [52, 51, 50]
+    >>> users[148]
+    >>> len([user for user in users if user])
+    149
+
+    """
+
+    uri = '/users/lookup.json'
+    deadline = None
+
+    def __init__(self, fetch, ids, hooks=None, domain=None, timeout=None):
+        self._fetch = fetch
+        self.ids = ids
+        self.hooks = hooks
+        self.domain = domain
+        self.timeout = timeout
+        # Fetched blocks, by block number
+        self._blocks = {}
+
+    def __len__(self):
+        return len(self.ids)
+
+    def _lookup(self, ids, priority=PRIORITY_INTERACTIVE):
+        # Fetch users, in the order of ids.
+        deadline = time.time() + self.deadline if self.deadline else None
+        result = self._fetch(self.uri, get_data={
+            'user_id': ','.join([str(id) for id in ids])},
+            domain=self.domain, priority=priority, timeout=self.timeout,
+            deadline=deadline)
+
+        start = time.time()
+        users = dict([(user.id, user) for user in \
+                      TwitterUser.from_list(result)])
+        if self.hooks:
+            self.hooks.emit('page', endpoint=self.uri, page=1,
+                            resultclass=TwitterUser.__name__,
+                            items=len(users), construct=time.time() - start)
+
+        return [users.get(id) for id in ids]
+
+    def _block(self, block):
+        if block not in self._blocks:
+            start = block * LOOKUP_SIZE
+            self._blocks[block] = self._lookup(
+                self.ids[start:start + LOOKUP_SIZE])
+
+        return self._blocks[block]
+
+    def __getitem__(self, k):
+        if isinstance(k, slice):
+            return [self[i] for i in xrange(*k.indices(len(self.ids)))]
+
+        if k < 0:
+            k += len(self.ids)
+        if not 0 <= k < len(self.ids):
+            raise IndexError("LazyUsers index out of range")
+
+        return self._block(k // LOOKUP_SIZE)[k % LOOKUP_SIZE]
+
+    def __iter__(self):
+        for block in xrange(0, (len(self.ids) + LOOKUP_SIZE - 1) //
+                               LOOKUP_SIZE):
+            users = self._blocks.get(block)
+            if users is None:
+                start = block * LOOKUP_SIZE
+                priority = PRIORITY_INTERACTIVE if block == 0 \
+                           else PRIORITY_BACKGROUND
+                users = self._lookup(self.ids[start:start + LOOKUP_SIZE],
+                                     priority)
+
+            for user in users:
+                yield user
+
+
 class TwitterTrendSet(dict):
     """
     Trends are an especial case of sets since they don't need pagination.
@@ -182,12 +690,13 @@ class TwitterTrendSet(dict):
                 self.setdefault(dat, []).append(TwitterTrend(**trend))
 
 
-class TwitterSearchResultSet(PaginationSet):
+class TwitterSearchResultSet(TimelineSet):
     """
     Status result set. It's a lazy bunch of search results. 
     """
 
     resultclass = TwitterSearchResult
+    results_key = 'results'
 
     def __init__(self, *args, **kwargs):
         self.max_id = 0
@@ -197,9 +706,6 @@ class TwitterSearchResultSet(PaginationSet):
         self.completed_in = metadata['completed_in']
         self.max_id = max(self.max_id, metadata['max_id'])
 
-    def _get_results(self, result):
-        return result['results']
-
     def _get_data(self, page):
         return {
             'q': self.query,
@@ -212,7 +718,7 @@ class TwitterSearchResultSet(PaginationSet):
         }
 
 
-class TwitterStatusSet(PaginationSet):
+class TwitterStatusSet(TimelineSet):
     """
     Status result set. It's a lazy bunch of statuses. 
     """
@@ -223,6 +729,15 @@ class TwitterStatusSet(PaginationSet):
         self.max_id = 0
         super(TwitterStatusSet, self).__init__(*args, **kwargs)
 
+    def _pin(self, newest_id):
+        if not self.max_id and newest_id:
+            self.max_id = int(newest_id)
+
+    def _anchor(self, deadline=None):
+        if not self.max_id:
+            items = self._fetch_raw(1, deadline)
+            self._pin(items and items[0].get('id'))
+
     def _get_data(self, page):
         return {
             'page': page,
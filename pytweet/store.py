@@ -0,0 +1,437 @@
+"""
+Local SQLite store for statuses, users and search results, and a sync
+engine that keeps it up to date fetching only what is new.
+
+Every synced stream (a user timeline or a search) has a watermark: the
+newest id synced. Syncs ask only for items above it (since_id). Ranges
+not stored yet are remembered as gaps and filled by next syncs with
+max_id: moving the watermark records what it skips as a gap, and every
+stored batch shrinks it in the same transaction. So a sync that stops
+before reaching the old watermark (an error, the max_items limit or a
+crash) never loses items.
+
+Usage:
+
+    store = StatusStore('tweets.db')
+    sync = SyncEngine(api, store)
+    sync.sync_user_timeline('reflejo')   # Only new statuses are fetched
+    store.user_timeline('reflejo')[:20]   # No requests at all
+
+"""
+
+import calendar
+import sqlite3
+import simplejson
+import threading
+from objects import TwitterStatus, TwitterUser, TwitterSearchResult
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    id INTEGER PRIMARY KEY,
+    screen_name TEXT,
+    created_at INTEGER,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS users_screen_name ON users (screen_name);
+
+CREATE TABLE IF NOT EXISTS statuses (
+    id INTEGER PRIMARY KEY,
+    user_id INTEGER,
+    screen_name TEXT,
+    created_at INTEGER,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS statuses_user ON statuses (user_id, id);
+CREATE INDEX IF NOT EXISTS statuses_screen_name
+    ON statuses (screen_name, id);
+CREATE INDEX IF NOT EXISTS statuses_created_at ON statuses (created_at);
+
+CREATE TABLE IF NOT EXISTS search_results (
+    id INTEGER PRIMARY KEY,
+    from_user_id INTEGER,
+    created_at INTEGER,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS search_results_user
+    ON search_results (from_user_id, id);
+CREATE INDEX IF NOT EXISTS search_results_created_at
+    ON search_results (created_at);
+
+CREATE TABLE IF NOT EXISTS search_hits (
+    query TEXT NOT NULL,
+    id INTEGER NOT NULL,
+    PRIMARY KEY (query, id)
+);
+
+CREATE TABLE IF NOT EXISTS watermarks (
+    stream TEXT PRIMARY KEY,
+    since_id INTEGER NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS gaps (
+    stream TEXT NOT NULL,
+    max_id INTEGER NOT NULL,
+    since_id INTEGER NOT NULL,
+    PRIMARY KEY (stream, max_id)
+);
+"""
+
+# Items stored in the same transaction while syncing.
+BATCH_SIZE = 100
+
+
+def _timestamp(date):
+    return date and calendar.timegm(date.utctimetuple())
+
+
+class StatusStore(object):
+    """
+    SQLite backed store. Objects are kept as JSON (see
+    TwitterObject.to_dict) with ids, users and dates in indexed columns.
+
+    >>> store = StatusStore()
+    >>> store.add_statuses([TwitterStatus(id=2, text='b &amp; c',
+    ...                     user={'id': 1, 'screen_name': 'testpy'})])
+    >>> store.user_timeline('testpy')[0].text
+    u'b & c'
+    >>> store.user(1).screen_name
+    u'testpy'
+
+    """
+
+    def __init__(self, path=':memory:'):
+        self.path = path
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.executescript(SCHEMA)
+        self._lock = threading.RLock()
+
+    def close(self):
+        self._db.close()
+
+    def _execute(self, sql, args=()):
+        self._lock.acquire()
+        try:
+            return self._db.execute(sql, args).fetchall()
+        finally:
+            self._lock.release()
+
+    def _write(self, statements):
+        # Run (sql, args) statements in a single transaction.
+        self._lock.acquire()
+        try:
+            for sql, args in statements:
+                self._db.execute(sql, args)
+            self._db.commit()
+        except:
+            self._db.rollback()
+            raise
+        finally:
+            self._lock.release()
+
+    def _user_row(self, user):
+        return ('INSERT OR REPLACE INTO users VALUES (?, ?, ?, ?)',
+                (user.id, user.screen_name, _timestamp(user.created_at),
+                 simplejson.dumps(user.to_dict())))
+
+    def add_users(self, users):
+        """
+        Store (or update) TwitterUser objects.
+        """
+        self._write([self._user_row(user) for user in users])
+
+    def _gap_rows(self, stream, old, new):
+        # Statements replacing gap `old` of a stream with `new`. Gaps are
+        # (max_id, since_id), or None.
+        statements = []
+        if old is not None:
+            statements.append(('DELETE FROM gaps WHERE stream = ? AND '
+                               'max_id = ?', (stream, old[0])))
+        if new is not None and new[0] > new[1]:
+            statements.append(('INSERT OR REPLACE INTO gaps VALUES (?, ?, ?)',
+                               (stream, new[0], new[1])))
+
+        return statements
+
+    def add_statuses(self, statuses, gap=None):
+        """
+        Store (or update) TwitterStatus objects and their users.
+
+        @gap: (stream, old, new) to replace a gap of a stream in the same
+              transaction (see replace_gap). [optional]
+        """
+        statements = []
+        for status in statuses:
+            user = status.user
+            if user and user.id:
+                statements.append(self._user_row(user))
+
+            statements.append((
+                'INSERT OR REPLACE INTO statuses VALUES (?, ?, ?, ?, ?)',
+                (status.id, user and user.id, user and user.screen_name,
+                 _timestamp(status.created_at),
+                 simplejson.dumps(status.to_dict()))))
+
+        if gap is not None:
+            statements.extend(self._gap_rows(*gap))
+        self._write(statements)
+
+    def add_search_results(self, query, results, gap=None):
+        """
+        Store TwitterSearchResult objects found by `query`.
+
+        @gap: (stream, old, new) to replace a gap of a stream in the same
+              transaction (see replace_gap). [optional]
+        """
+        statements = []
+        for result in results:
+            statements.append((
+                'INSERT OR REPLACE INTO search_results VALUES (?, ?, ?, ?)',
+                (result.id, result.from_user_id,
+                 _timestamp(result.created_at),
+                 simplejson.dumps(result.to_dict()))))
+            statements.append((
+                'INSERT OR IGNORE INTO search_hits VALUES (?, ?)',
+                (query, result.id)))
+
+        if gap is not None:
+            statements.extend(self._gap_rows(*gap))
+        self._write(statements)
+
+    def _build(self, resultclass, rows):
+        return resultclass.from_list([simplejson.loads(row[0])
+                                      for row in rows])
+
+    def status(self, id):
+        """
+        Returns the TwitterStatus with the given id or None.
+        """
+        rows = self._execute('SELECT data FROM statuses WHERE id = ?', (id,))
+        return self._build(TwitterStatus, rows)[0] if rows else None
+
+    def user(self, user):
+        """
+        Returns a TwitterUser by id or screen name, or None.
+        """
+        column = 'id' if isinstance(user, (int, long)) else 'screen_name'
+        rows = self._execute('SELECT data FROM users WHERE %s = ?' % column,
+                             (user,))
+        return self._build(TwitterUser, rows)[0] if rows else None
+
+    def _range(self, since_id, max_id, since, until):
+        # WHERE conditions for id and date ranges.
+        conditions, args = [], []
+        for sql, value in (('id > ?', since_id), ('id <= ?', max_id),
+                           ('created_at >= ?', _timestamp(since)),
+                           ('created_at < ?', _timestamp(until))):
+            if value is not None:
+                conditions.append(sql)
+                args.append(value)
+
+        return conditions, args
+
+    def user_timeline(self, user, since_id=None, max_id=None, since=None,
+                      until=None, limit=None):
+        """
+        Returns stored statuses of a user (id or screen name), newest
+        first. Ids and dates (datetime) ranges are optional.
+        """
+        column = 'user_id' if isinstance(user, (int, long)) \
+                 else 'screen_name'
+        conditions, args = self._range(since_id, max_id, since, until)
+        sql = 'SELECT data FROM statuses WHERE %s ORDER BY id DESC' % \
+              ' AND '.join(['%s = ?' % column] + conditions)
+        if limit:
+            sql += ' LIMIT %d' % limit
+
+        return self._build(TwitterStatus, self._execute(sql, [user] + args))
+
+    def search_results(self, query, since_id=None, max_id=None, since=None,
+                       until=None, limit=None):
+        """
+        Returns stored results of a search, newest first.
+        """
+        conditions, args = self._range(since_id, max_id, since, until)
+        conditions = ['search_results.%s' % c for c in conditions]
+        sql = 'SELECT data FROM search_results JOIN search_hits USING (id) ' \
+              'WHERE %s ORDER BY id DESC' % \
+              ' AND '.join(['query = ?'] + conditions)
+        if limit:
+            sql += ' LIMIT %d' % limit
+
+        return self._build(TwitterSearchResult,
+                           self._execute(sql, [query] + args))
+
+    def watermark(self, stream):
+        """
+        Newest id synced for a stream, or 0.
+        """
+        rows = self._execute('SELECT since_id FROM watermarks '
+                             'WHERE stream = ?', (stream,))
+        return rows[0][0] if rows else 0
+
+    def set_watermark(self, stream, since_id):
+        self._write([('INSERT OR REPLACE INTO watermarks VALUES (?, ?)',
+                      (stream, since_id))])
+
+    def gaps(self, stream):
+        """
+        Missing (max_id, since_id) ranges of a stream, newest first.
+        """
+        return self._execute('SELECT max_id, since_id FROM gaps '
+                             'WHERE stream = ? ORDER BY max_id DESC',
+                             (stream,))
+
+    def replace_gap(self, stream, old, new, watermark=None):
+        """
+        Replace gap `old` of a stream with `new`, both (max_id, since_id)
+        or None, in a single transaction. Empty gaps are dropped.
+
+        @watermark: New watermark of the stream, set in the same
+                    transaction. [optional]
+        """
+        statements = self._gap_rows(stream, old, new)
+        if watermark is not None:
+            statements.append(('INSERT OR REPLACE INTO watermarks '
+                               'VALUES (?, ?)', (stream, watermark)))
+        self._write(statements)
+
+    def add_gap(self, stream, max_id, since_id):
+        self.replace_gap(stream, None, (max_id, since_id))
+
+    def remove_gap(self, stream, max_id):
+        self.replace_gap(stream, (max_id, None), None)
+
+
+class SyncEngine(object):
+    """
+    Pulls timelines and searches into a StatusStore, asking only for what
+    is not stored yet.
+
+    params are:
+        api: Twitter instance (or TwitterPool)
+        store: StatusStore
+        max_items: Max items fetched by a single sync of a stream. What is
+                   left is recorded as a gap. [optional]
+
+    A sync killed before storing anything still leaves what it skipped as
+    a gap:
+
+    >>> class API(object):
+    ...     def user_timeline(self, user, since_id=None, max_id=None):
+    ...         return iter([TwitterStatus(id=id, user={'id': 1,
+    ...                                                 'screen_name': user})
+    ...                      for id in range(300, since_id or 0, -1)
+    ...                      if not max_id or id <= max_id])
+    >>> store = StatusStore()
+    >>> def crash(statuses, gap=None):
+    ...     raise SystemExit
+    >>> add, store.add_statuses = store.add_statuses, crash
+    >>> sync = SyncEngine(API(), store)
+    >>> sync.sync_user_timeline('testpy')
+    Traceback (most recent call last):
+    SystemExit
+    >>> store.watermark('timeline:testpy'), store.gaps('timeline:testpy')
+    (300, [(300, 0)])
+    >>> store.add_statuses = add
+    >>> sync.sync_user_timeline('testpy')
+    300
+    >>> len(store.user_timeline('testpy')), store.gaps('timeline:testpy')
+    (300, [])
+
+    """
+
+    def __init__(self, api, store, max_items=None):
+        self.api = api
+        self.store = store
+        self.max_items = max_items
+
+    def sync_user_timeline(self, user):
+        """
+        Sync statuses of `user` (screen name). Returns how many were
+        fetched.
+        """
+        stream = 'timeline:%s' % user
+        fetch = lambda since_id, max_id: self.api.user_timeline(
+            user, since_id=since_id, max_id=max_id)
+        store = lambda statuses, gap: self.store.add_statuses(statuses, gap)
+        return self._sync(stream, fetch, store)
+
+    def sync_search(self, query):
+        """
+        Sync results of a search. Returns how many were fetched.
+        """
+        stream = 'search:%s' % query
+        fetch = lambda since_id, max_id: self.api.search(
+            query, since_id=since_id, max_id=max_id)
+        store = lambda results, gap: self.store.add_search_results(
+            query, results, gap)
+        return self._sync(stream, fetch, store)
+
+    def _sync(self, stream, fetch, store):
+        total = 0
+        limit = self.max_items
+
+        # Old gaps first, then everything newer than the watermark.
+        for max_id, since_id in self.store.gaps(stream):
+            remaining = None if limit is None else limit - total
+            if remaining is not None and remaining <= 0:
+                return total
+
+            total += self._pull(stream, fetch, store, since_id, max_id,
+                                remaining)
+
+        since_id = self.store.watermark(stream)
+        remaining = None if limit is None else limit - total
+        if remaining is not None and remaining <= 0:
+            return total
+
+        return total + self._pull(stream, fetch, store, since_id, None,
+                                  remaining, move_watermark=True)
+
+    def _pull(self, stream, fetch, store, since_id, max_id, limit,
+              move_watermark=False):
+        # Fetch (since_id, max_id] newest first, storing in batches. The
+        # range is a gap until it's stored: a gap pull starts from its
+        # gap, a watermark move records the range it skips as one. Every
+        # batch shrinks it in the transaction that stores the batch.
+        results = fetch(since_id, max_id)
+        pending = None if move_watermark else (max_id, since_id)
+        batch = []
+        count = 0
+        complete = False
+        try:
+            while limit is None or count < limit:
+                try:
+                    item = results.next()
+                except StopIteration:
+                    complete = True
+                    break
+
+                if move_watermark and not count:
+                    # Anything below is older than the new watermark.
+                    pending = (item.id, since_id)
+                    self.store.replace_gap(stream, None, pending,
+                                           watermark=item.id)
+
+                batch.append(item)
+                count += 1
+                if len(batch) >= BATCH_SIZE:
+                    pending = self._store(stream, store, batch, pending)
+                    batch = []
+        finally:
+            if batch:
+                pending = self._store(stream, store, batch, pending)
+
+        if complete and pending is not None:
+            # Nothing left between the last item and since_id.
+            self.store.replace_gap(stream, pending, None)
+
+        return count
+
+    def _store(self, stream, store, batch, pending):
+        # Store a batch and shrink the pending gap below it. Returns the
+        # gap left, or None.
+        since_id = pending[1]
+        left = (batch[-1].id - 1, since_id)
+        store(batch, (stream, pending, left))
+        return left if left[0] > since_id else None
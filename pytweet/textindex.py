@@ -0,0 +1,269 @@
+"""
+In-process full-text index over a sliding window of statuses or search
+results. Feed it what you fetch anyway (a tail(), a MultiSearch) and
+answer repeated text queries locally; only what the window can't answer
+goes to search().
+
+Text is tokenized in lowercase words, hashtags and mentions ('#python'
+is indexed as '#python' and 'python'). Queries use the search syntax
+for terms: words are ANDed, OR between them, and a leading '-'
+excludes a word:
+
+    index = TextIndex(api, window=3600)
+    for status in index.feed(api.search('python').tail()):
+        ...
+    index.search('django OR flask -php')
+
+Postings are kept by time slices: int64 arrays of ids per term and
+slice. A whole slice is dropped when it leaves the window, so eviction
+never walks posting lists.
+"""
+
+import calendar
+import re
+import time
+from array import array
+
+# Ids are stored as C longs, 64 bits in every platform we run on.
+INT_TYPECODE = 'l'
+# Slices the window is split in.
+SLICES = 12
+
+TOKEN_RE = re.compile(r'[#@]?\w+', re.UNICODE)
+# Query operators only search() understands, like from:user or near:place.
+OPERATOR_RE = re.compile(r'(^|\s)-?\w+:\S', re.UNICODE)
+
+
+def tokenize(text):
+    """
+    Index terms of a text.
+
+    >>> tokenize(u'Hello #Python & @reflejo')
+    [u'hello', u'#python', u'python', u'@reflejo', u'reflejo']
+
+    """
+    tokens = []
+    for token in TOKEN_RE.findall((text or u'').lower()):
+        tokens.append(token)
+        if token[0] in '#@' and len(token) > 1:
+            tokens.append(token[1:])
+
+    return tokens
+
+
+def parse_query(query):
+    """
+    Parse a query into OR clauses of (required terms, excluded terms).
+
+    >>> parse_query(u'django OR flask -php')
+    [([u'django'], []), ([u'flask'], [u'php'])]
+
+    """
+    clauses = []
+    for clause in re.split(r'\s+OR\s+', query.strip()):
+        required, excluded = [], []
+        for word in clause.split():
+            terms = excluded if word.startswith('-') else required
+            # Words like "don't" are more than one term, all required.
+            terms.extend(TOKEN_RE.findall(word.lower()))
+        clauses.append((required, excluded))
+
+    return clauses
+
+
+class _Slice(object):
+    # Postings of items created in [start, start + length).
+
+    def __init__(self, start):
+        self.start = start
+        self.postings = {}
+        self.ids = array(INT_TYPECODE)
+
+    def add(self, id, terms):
+        self.ids.append(id)
+        for term in terms:
+            posting = self.postings.get(term)
+            if posting is None:
+                posting = self.postings[term] = array(INT_TYPECODE)
+            posting.append(id)
+
+    def match(self, required, excluded):
+        # Ids matching a clause. With no required terms, every id.
+        if required:
+            postings = [self.postings.get(term) for term in required]
+            if None in postings:
+                return set()
+
+            postings.sort(key=len)
+            ids = set(postings[0])
+            for posting in postings[1:]:
+                ids.intersection_update(posting)
+        else:
+            ids = set(self.ids)
+
+        for term in excluded:
+            if ids and term in self.postings:
+                ids.difference_update(self.postings[term])
+
+        return ids
+
+
+class TextIndex(object):
+    """
+    Inverted index of the items created in the last `window` seconds.
+
+    The index assumes it is fed every item of interest from the moment
+    it was created on (or from complete_since): searches reaching
+    further back, or using operators like from:, go to the API.
+
+    params are:
+        api: Twitter instance used for queries the index can't answer.
+             [optional]
+        window: Seconds of items kept [optional]
+        slices: Slices the window is split in; eviction goes a slice at
+                a time [optional]
+        complete_since: Time since the index has every item [optional]
+        clock: Function returning current time [optional]
+
+    >>> import datetime
+    >>> from objects import TwitterStatus
+    >>> from parsers import formatdate
+    >>> now = [1254484800]
+    >>> def status(id, text, seconds):
+    ...     created = datetime.datetime(2009, 10, 2, 12) + \\
+    ...               datetime.timedelta(seconds=seconds)
+    ...     return TwitterStatus(id=id, text=text,
+    ...                          created_at=formatdate(created))
+    >>> index = TextIndex(window=60, slices=2, clock=lambda: now[0],
+    ...                   complete_since=0)
+    >>> index.extend([status(1, u'I love #python', -40),
+    ...               status(2, u'python &amp; django', -10),
+    ...               status(3, u'django or flask?', 0)])
+    >>> [status.id for status in index.search(u'python')]
+    [2, 1]
+    >>> [status.id for status in index.search(u'django -python OR love')]
+    [3, 1]
+    >>> now[0] += 30
+    >>> len(index), [status.id for status in index.search(u'django')]
+    (2, [3, 2])
+    >>> now[0] += 25    # Status 2 left the window, not its slice
+    >>> [status.id for status in index.search(u'django')]
+    [3]
+
+    """
+
+    def __init__(self, api=None, window=3600, slices=SLICES,
+                 complete_since=None, clock=time.time):
+        self.api = api
+        self.window = window
+        self.length = float(window) / slices
+        self.clock = clock
+        self.complete_since = clock() if complete_since is None \
+                              else complete_since
+        self.items = {}
+        # Slices by number (start // length)
+        self._slices = {}
+        self.local_queries = self.remote_queries = 0
+
+    def __len__(self):
+        self._evict()
+        return len(self.items)
+
+    def _timestamp(self, item):
+        created_at = getattr(item, 'created_at', None)
+        if created_at is None:
+            return self.clock()
+
+        return calendar.timegm(created_at.utctimetuple())
+
+    def _evict(self):
+        # Drop slices that are completely out of the window.
+        horizon = self.clock() - self.window
+        for number in [number for number in self._slices
+                       if (number + 1) * self.length <= horizon]:
+            for id in self._slices.pop(number).ids:
+                del self.items[id]
+
+    def add(self, item):
+        """
+        Index an item (with id, text and created_at). Returns False if it
+        was already indexed or is out of the window.
+        """
+        if item.id in self.items:
+            return False
+
+        timestamp = self._timestamp(item)
+        if timestamp < self.clock() - self.window:
+            return False
+
+        number = int(timestamp // self.length)
+        slice = self._slices.get(number)
+        if slice is None:
+            self._evict()
+            slice = self._slices[number] = _Slice(number * self.length)
+
+        slice.add(item.id, set(tokenize(item.text)))
+        self.items[item.id] = item
+        return True
+
+    def extend(self, items):
+        for item in items:
+            self.add(item)
+
+    def feed(self, items):
+        """
+        Index items as they are yielded.
+        """
+        for item in items:
+            self.add(item)
+            yield item
+
+    def can_answer(self, query, since=None):
+        """
+        Whether the index has every result of a query since a time
+        (the start of the window by default).
+        """
+        oldest = self.clock() - self.window
+        since = oldest if since is None else since
+        return since >= max(self.complete_since, oldest) and \
+               not OPERATOR_RE.search(query)
+
+    def search(self, query, since=None):
+        """
+        Items matching a query created since a time (the start of the
+        window by default), newest first. Queries the index can't answer
+        go to the API if there is one, or raise ValueError.
+        """
+        if not self.can_answer(query, since):
+            if self.api is None:
+                raise ValueError("Query out of the local index: %r" % query)
+            self.remote_queries += 1
+            return self._search_remote(query, since)
+
+        self.local_queries += 1
+        self._evict()
+        if since is None:
+            # Oldest slices are only partly in the window.
+            since = self.clock() - self.window
+        first = int(since // self.length)
+        clauses = parse_query(query)
+        ids = set()
+        for number, slice in self._slices.iteritems():
+            if number < first:
+                continue
+            for required, excluded in clauses:
+                ids.update(slice.match(required, excluded))
+
+        return [self.items[id] for id in sorted(ids, reverse=True)
+                if self._timestamp(self.items[id]) >= since]
+
+    def _search_remote(self, query, since):
+        # Walk search pages until results are older than since.
+        results = []
+        for page, items in self.api.search(query).iterpages():
+            for item in items:
+                if since is not None and self._timestamp(item) < since:
+                    return results
+                results.append(item)
+
+        return results
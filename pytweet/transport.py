@@ -0,0 +1,284 @@
+"""
+HTTP transports. A transport sends one request and returns the whole
+(decompressed) response. Twitter takes one as a parameter, so HTTP work
+can be done by urllib2 (the default), by a pool of persistent
+connections, or served from memory to measure the library without
+the network.
+
+Transports don't raise on HTTP errors, they just return the response
+with its code. Network errors are raised as they come (urllib2.URLError,
+httplib.HTTPException or socket.error).
+"""
+
+import httplib
+import simplejson
+import threading
+import time
+import urllib2
+import urlparse
+from compression import Decoder
+
+# Requests safe to send again when a reused connection turns out stale.
+IDEMPOTENT_METHODS = ('GET', 'HEAD')
+
+
+class Response(object):
+    """
+    HTTP response.
+
+    params are:
+        code: HTTP status code
+        reason: HTTP reason phrase
+        headers: dict of headers with lowercase names
+        body: decoded body
+        wire_bytes: body size as received from the wire [optional]
+        timings: dict with seconds spent connecting ('connect'), waiting
+                 for the first byte ('ttfb') and reading the body ('read').
+                 Missing values are None. [optional]
+    """
+
+    def __init__(self, code, reason, headers, body, wire_bytes=None,
+                 timings=None):
+        self.code = code
+        self.reason = reason
+        self.headers = headers
+        self.body = body
+        self.wire_bytes = len(body) if wire_bytes is None else wire_bytes
+        self.timings = timings or {'connect': None, 'ttfb': None,
+                                   'read': None}
+
+
+def _lower_headers(items):
+    return dict([(k.lower(), v) for k, v in items])
+
+
+def _read(code, reason, headers, fp, timings):
+    # Read and decode a file-like body.
+    start = time.time()
+    decoder = Decoder(headers.get('content-encoding'))
+    body = decoder.read(fp)
+    timings['read'] = time.time() - start
+    return Response(code, reason, headers, body, decoder.wire_bytes, timings)
+
+
+class Transport(object):
+    """
+    Transport interface.
+    """
+
+    def request(self, method, url, headers=None, body=None, timeout=None):
+        """
+        Sends a request and returns a Response.
+
+        @method: HTTP method
+        @url: Absolute URL
+        @headers: dict of HTTP headers [optional]
+        @body: Request body [optional]
+        @timeout: Socket timeout in seconds [optional]
+        """
+        raise NotImplementedError
+
+    def close(self):
+        """
+        Release any resource held by the transport.
+        """
+        pass
+
+
+class UrllibTransport(Transport):
+    """
+    Default transport. Uses urllib2, one connection per request.
+    """
+
+    def request(self, method, url, headers=None, body=None, timeout=None):
+        if method == 'POST' and body is None:
+            body = ''
+
+        req = urllib2.Request(url, body, headers or {})
+        start = time.time()
+        try:
+            handle = urllib2.urlopen(req, timeout=timeout)
+        except urllib2.HTTPError, e:
+            handle = e
+
+        # urllib2 doesn't tell connection time apart, it's in ttfb.
+        timings = {'connect': None, 'ttfb': time.time() - start}
+        return _read(handle.code, getattr(handle, 'msg', ''),
+                     _lower_headers(handle.info().items()), handle, timings)
+
+
+class PooledTransport(Transport):
+    """
+    Keeps persistent (keep-alive) connections to each host and reuses
+    them, saving a TCP (and SSL) handshake per request. It's thread safe:
+    each thread takes an idle connection or opens a new one.
+
+    params are:
+        maxsize: max idle connections kept per host. [optional]
+    """
+
+    def __init__(self, maxsize=4):
+        self.maxsize = maxsize
+        self._idle = {}
+        self._lock = threading.Lock()
+
+    def _connect(self, scheme, netloc, timeout):
+        cls = httplib.HTTPSConnection if scheme == 'https' \
+              else httplib.HTTPConnection
+        return cls(netloc, timeout=timeout)
+
+    def _get(self, key):
+        self._lock.acquire()
+        try:
+            idle = self._idle.get(key)
+            return idle.pop() if idle else None
+        finally:
+            self._lock.release()
+
+    def _put(self, key, conn):
+        self._lock.acquire()
+        try:
+            idle = self._idle.setdefault(key, [])
+            if len(idle) < self.maxsize:
+                idle.append(conn)
+                return
+        finally:
+            self._lock.release()
+
+        conn.close()
+
+    def request(self, method, url, headers=None, body=None, timeout=None):
+        scheme, netloc, path, query, _ = urlparse.urlsplit(url)
+        key = (scheme, netloc)
+        path = '%s?%s' % (path, query) if query else path
+
+        conn = self._get(key)
+        reused = conn is not None
+        while True:
+            if conn is None:
+                conn = self._connect(scheme, netloc, timeout)
+
+            conn.timeout = timeout
+            if conn.sock:
+                conn.sock.settimeout(timeout)
+
+            timings = {'connect': 0.0}
+            try:
+                start = time.time()
+                if not conn.sock:
+                    conn.connect()
+                    timings['connect'] = time.time() - start
+                    start = time.time()
+
+                conn.request(method, path, body, headers or {})
+                response = conn.getresponse()
+                timings['ttfb'] = time.time() - start
+            except (httplib.HTTPException, IOError):
+                conn.close()
+                if not reused or method not in IDEMPOTENT_METHODS:
+                    raise
+
+                # Server probably closed an idle connection. Try once with
+                # a fresh one. Not for a POST: it may have been received
+                # already, and sending it again could post a status twice.
+                conn, reused = None, False
+                continue
+
+            try:
+                result = _read(response.status, response.reason,
+                               _lower_headers(response.getheaders()),
+                               response, timings)
+            except:
+                # Body half read (a timeout, a broken gzip stream): the
+                # connection can't be used again.
+                conn.close()
+                raise
+
+            if response.will_close:
+                conn.close()
+            else:
+                self._put(key, conn)
+
+            return result
+
+    def close(self):
+        self._lock.acquire()
+        try:
+            for idle in self._idle.itervalues():
+                for conn in idle:
+                    conn.close()
+            self._idle = {}
+        finally:
+            self._lock.release()
+
+
+class MemoryTransport(Transport):
+    """
+    Serves canned responses from memory. Useful to benchmark the library
+    itself (pagination, parsing, object construction) with no network.
+
+    Responses are matched by path and, optionally, by a subset of query
+    parameters. Bodies that aren't strings are encoded as JSON. Requests
+    are recorded in `requests` as (method, url, headers, body) tuples.
+
+    >>> transport = MemoryTransport()
+    >>> transport.add('/statuses/user_timeline.json', [{'id': 1}],
+    ...               query={'page': '1'})
+    >>> transport.request('GET', 'http://twitter.com/statuses/'
+    ...                   'user_timeline.json?page=1').body
+    '[{"id": 1}]'
+    >>> transport.request('GET', 'http://twitter.com/nothing.json').code
+    404
+
+    """
+
+    def __init__(self):
+        self.responses = []
+        self.requests = []
+        self._lock = threading.Lock()
+
+    def add(self, path, body, code=200, headers=None, query=None):
+        """
+        Add a canned response. Last added responses are matched first.
+
+        @path: URL path to match
+        @body: Response body. It can be a string, an object to be encoded
+               as JSON or a function that takes (method, url, headers, body)
+               and returns one of those.
+        @code: HTTP status code [optional]
+        @headers: Response headers [optional]
+        @query: Query parameters that must be present [optional]
+        """
+        self.responses.insert(0, (path, query or {}, code,
+                                  _lower_headers((headers or {}).items()),
+                                  body))
+
+    def _match(self, url):
+        parts = urlparse.urlsplit(url)
+        params = dict(urlparse.parse_qsl(parts[3]))
+        for path, query, code, headers, body in self.responses:
+            if path != parts[2]:
+                continue
+
+            if all(params.get(k) == str(v) for k, v in query.iteritems()):
+                return code, headers, body
+
+        return 404, {}, ''
+
+    def request(self, method, url, headers=None, body=None, timeout=None):
+        self._lock.acquire()
+        self.requests.append((method, url, headers, body))
+        self._lock.release()
+
+        code, resp_headers, resp_body = self._match(url)
+        if callable(resp_body):
+            resp_body = resp_body(method, url, headers, body)
+        if not isinstance(resp_body, basestring):
+            resp_body = simplejson.dumps(resp_body)
+
+        start = time.time()
+        decoder = Decoder(resp_headers.get('content-encoding'))
+        decoded = decoder.decompress(resp_body) + decoder.flush()
+        timings = {'connect': 0.0, 'ttfb': 0.0, 'read': time.time() - start}
+        return Response(code, httplib.responses.get(code, ''), resp_headers,
+                        decoded, decoder.wire_bytes, timings)
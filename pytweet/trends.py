@@ -0,0 +1,247 @@
+"""
+Trend tracking. A TrendTracker polls trends() and, instead of whole
+snapshots, keeps what changed: every new snapshot is compared with the
+previous one (TrendDelta) and the rank of every trend is appended to a
+fixed size ring buffer (RankHistory).
+
+Usage:
+
+    tracker = TrendTracker(api)
+    for delta in tracker.poll():        # Every few minutes
+        print delta.appeared, delta.dropped
+    tracker.changes(since=time.time() - 3600)  # What changed in an hour
+    tracker.history['#python'].items()  # [(timestamp, rank)]
+
+With daily or weekly trends, every hour (or day) of the response is a
+snapshot, and only the ones newer than the last seen are processed.
+"""
+
+import calendar
+import collections
+from array import array
+from tweet import DATECURRENT
+
+# Snapshots kept in rank histories and deltas.
+HISTORY = 48
+# Rank recorded when a trend drops out.
+DROPPED = 0
+
+
+def _timestamp(date):
+    return calendar.timegm(date.utctimetuple())
+
+
+class RankHistory(object):
+    """
+    Ring buffer of (timestamp, rank) of a trend. Rank is 1 based, and
+    DROPPED when the trend dropped out of the list.
+
+    >>> history = RankHistory(3)
+    >>> for i in range(5): history.append(i * 60, i + 1)
+    >>> history.items(), history.last()
+    ([(120, 3), (180, 4), (240, 5)], (240, 5))
+
+    """
+
+    def __init__(self, size=HISTORY):
+        self.size = size
+        self.times = array('l', [0] * size)
+        self.ranks = array('b', [0] * size)
+        self.count = 0
+
+    def __len__(self):
+        return min(self.count, self.size)
+
+    def append(self, timestamp, rank):
+        pos = self.count % self.size
+        self.times[pos] = timestamp
+        self.ranks[pos] = rank
+        self.count += 1
+
+    def items(self):
+        """
+        [(timestamp, rank)], oldest first.
+        """
+        start = self.count - len(self)
+        return [(self.times[i % self.size], self.ranks[i % self.size])
+                for i in xrange(start, self.count)]
+
+    def last(self):
+        if not self.count:
+            return None
+
+        pos = (self.count - 1) % self.size
+        return self.times[pos], self.ranks[pos]
+
+
+class TrendDelta(object):
+    """
+    Changes between a trends snapshot and the previous one.
+
+    params are:
+        date: Date of the snapshot
+        timestamp: Same date, in seconds since epoch
+        appeared: Names of new trends, by rank
+        dropped: Names of trends no longer listed
+        moved: Dict of name to (old rank, new rank), for trends that
+               changed their rank
+    """
+
+    def __init__(self, date, appeared, dropped, moved):
+        self.date = date
+        self.timestamp = _timestamp(date)
+        self.appeared = appeared
+        self.dropped = dropped
+        self.moved = moved
+
+    def __repr__(self):
+        return '<TrendDelta %s +%r -%r>' % (self.date, self.appeared,
+                                            self.dropped)
+
+
+class TrendTracker(object):
+    """
+    Keeps track of trends changes.
+
+    params are:
+        api: Twitter instance
+        by: tweet.DATECURRENT, DATEDAILY or DATEWEEKLY [optional]
+        exclude_hash: Exclude hashtags from trends [optional]
+        history: Snapshots kept, in rank histories and deltas [optional]
+
+    >>> from setobjects import TwitterTrendSet
+    >>> snapshots = [['#a', '#b', '#c'], ['#b', '#a', '#d'], ['#b', '#a']]
+    >>> class API(object):
+    ...     def trends(self, exclude_hash=False, by='current'):
+    ...         date = '2009-10-02 12:%02d' % (30 - len(snapshots) * 10)
+    ...         names = snapshots.pop(0)
+    ...         return TwitterTrendSet({'as_of': 1254484800, 'trends': {
+    ...             date: [{'name': name, 'query': name} for name in names]}})
+    >>> tracker = TrendTracker(API())
+    >>> tracker.poll()
+    [<TrendDelta 2009-10-02 12:00:00 +[u'#a', u'#b', u'#c'] -[]>]
+    >>> delta = tracker.poll()[0]
+    >>> delta.appeared, delta.dropped, sorted(delta.moved.items())
+    ([u'#d'], [u'#c'], [(u'#a', (1, 2)), (u'#b', (2, 1))])
+    >>> tracker.poll()
+    [<TrendDelta 2009-10-02 12:20:00 +[] -[u'#d']>]
+    >>> tracker.trends
+    [u'#b', u'#a']
+    >>> tracker.history[u'#a'].items()
+    [(1254484800, 1), (1254485400, 2), (1254486000, 2)]
+
+    Changes since a time are net changes: #d came and went.
+
+    >>> tracker.changes(since=1254484800)
+    ([], [u'#c'])
+
+    Changes older than the deltas kept can't be told:
+
+    >>> snapshots = [['#a'], ['#b'], ['#c']]
+    >>> tracker = TrendTracker(API(), history=2)
+    >>> for i in range(3): deltas = tracker.poll()
+    >>> tracker.changes(since=1254484800)
+    ([u'#c'], [u'#a'])
+    >>> tracker.changes(since=1254484200)
+    Traceback (most recent call last):
+    ...
+    ValueError: Changes since 1254484200 are no longer kept, ...
+
+    """
+
+    def __init__(self, api, by=DATECURRENT, exclude_hash=False,
+                 history=HISTORY):
+        self.api = api
+        self.by = by
+        self.exclude_hash = exclude_hash
+        self.size = history
+        # Current trends names, by rank
+        self.trends = []
+        self.history = {}
+        self.deltas = collections.deque(maxlen=history)
+        # Timestamp of the newest delta no longer kept: changes since
+        # before it are unknown.
+        self.expired = None
+        self.last_date = None
+        self.snapshots = 0
+
+    def poll(self):
+        """
+        Fetch trends and process the snapshots newer than the last one.
+        Returns a TrendDelta for each.
+        """
+        trendset = self.api.trends(exclude_hash=self.exclude_hash,
+                                   by=self.by)
+        deltas = []
+        for date in sorted(trendset):
+            if self.last_date is not None and date <= self.last_date:
+                continue
+
+            deltas.append(self._update(date, [trend.name for trend in
+                                              trendset[date]]))
+
+        return deltas
+
+    def _update(self, date, names):
+        # Process a snapshot: delta against the current trends and rank
+        # histories.
+        old = dict([(name, rank) for rank, name in
+                    enumerate(self.trends, 1)])
+        new = dict([(name, rank) for rank, name in enumerate(names, 1)])
+
+        delta = TrendDelta(
+            date,
+            [name for name in names if name not in old],
+            [name for name in self.trends if name not in new],
+            dict([(name, (old[name], rank)) for name, rank in new.iteritems()
+                  if name in old and old[name] != rank]))
+
+        for name, rank in new.iteritems():
+            if name not in self.history:
+                self.history[name] = RankHistory(self.size)
+            self.history[name].append(delta.timestamp, rank)
+        for name in delta.dropped:
+            self.history[name].append(delta.timestamp, DROPPED)
+
+        self.trends = names
+        if len(self.deltas) == self.deltas.maxlen:
+            self.expired = self.deltas[0].timestamp
+        self.deltas.append(delta)
+        self.last_date = date
+        self.snapshots += 1
+        self._forget()
+        return delta
+
+    def _forget(self):
+        # Forget histories of trends dropped before the oldest delta kept,
+        # so memory is bounded by the trends seen in `history` snapshots.
+        if len(self.deltas) < self.size:
+            return
+
+        oldest = self.deltas[0].timestamp
+        for name, history in self.history.items():
+            last = history.last()
+            if last[1] == DROPPED and last[0] < oldest:
+                del self.history[name]
+
+    def changes(self, since):
+        """
+        Net changes since a time (seconds since epoch): (appeared, dropped)
+        names. Trends that came and went in between are not included.
+        Raises ValueError if changes that old are no longer kept: the
+        caller needs a full resync from `trends`.
+        """
+        if self.expired is not None and since < self.expired:
+            raise ValueError("Changes since %d are no longer kept, oldest "
+                             "known is %d" % (since, self.expired))
+
+        current = set(self.trends)
+        before = set(current)
+        for delta in reversed(self.deltas):
+            if delta.timestamp <= since:
+                break
+            before.difference_update(delta.appeared)
+            before.update(delta.dropped)
+
+        return ([name for name in self.trends if name not in before],
+                sorted(before - current))
@@ -18,14 +18,24 @@ A pythonic library that provides a simple interface to the Twitter API.
 Oh, and values are normalized to python types.
 """
 
+import collections
 import httplib
 import oauth
+import Queue
 import simplejson
+import socket
+import threading
+import time
 import urllib, urllib2
 import urlparse
 from objects import TwitterUser, TwitterStatus
+from compression import ACCEPT_ENCODING
+from events import Hooks
+from ratelimit import RateLimiter, PRIORITY_INTERACTIVE
+from retry import RetryPolicy, CircuitBreaker
+from transport import UrllibTransport
 from setobjects import TwitterTrendSet, TwitterUserSet, TwitterStatusSet, \
-                       TwitterSearchResultSet
+                       TwitterSearchResultSet, TwitterIdSet, LazyUsers
 
 __author__ = 'Martin Conte Mac Donell <Reflejo@gmail.com>'
 __version__ = '0.1-beta'
@@ -44,6 +54,10 @@ DATEDAILY = 'daily'
 DATEWEEKLY = 'weekly'
 DATECURRENT = 'current'
 SOCKET_TIMEOUT = 10
+# Latencies kept to compute hedging percentile, and how many of them we
+# need before hedging.
+HEDGE_SAMPLES = 200
+HEDGE_MIN_SAMPLES = 20
 
 class TwitterError(Exception):
     """Base class for Twitter errors"""
@@ -62,6 +76,27 @@ class ConnectionError(TwitterError):
         super(ConnectionError, self).__init__(message)
 
 
+class DeadlineExceeded(ConnectionError):
+    """Request couldn't be completed before its deadline"""
+
+
+class CircuitOpenError(ConnectionError):
+    """Host has failed too many times and requests are not being sent"""
+
+
+def check_response(parsed):
+    # Raise TwitterError if a parsed response is empty or an error. An
+    # empty list is fine, it's a page past the end.
+    if not parsed and not isinstance(parsed, list):
+        raise TwitterError("Empty response from twitter")
+
+    # Check if there is any error in response
+    if 'error' in parsed:
+        raise TwitterError(parsed['error'])
+
+    return parsed
+
+
 def authenticated(func):
     """
     Decorator for methods that need authentication
@@ -90,14 +125,36 @@ class Twitter(object):
     """
 
     def __init__(self, username=None, password=None, key=None, secret=None, 
-                 access_token=None):
+                 access_token=None, rate_limiter=None, retry_policy=None,
+                 circuit_breakers=None, timeout=SOCKET_TIMEOUT, hedge=None,
+                 transport=None):
         self._auth_header = ()
+        self.transport = transport or UrllibTransport()
+        # Instrumentation events subscribers (see events module).
+        self.hooks = Hooks()
+        self.token = None
+        self.rate_limiter = rate_limiter or RateLimiter()
+        self.retry_policy = retry_policy or RetryPolicy()
+        # Can be shared between clients: {host: CircuitBreaker}
+        self.circuit_breakers = {} if circuit_breakers is None \
+                                else circuit_breakers
+        self.retries = 0
+        # Sockets timeout for this client. Don't use socket default timeout,
+        # it's global to the process.
+        self.timeout = timeout
+        # Latency percentile (like 0.95) after which a duplicate GET is sent
+        # and the fastest response is used. None disables hedging.
+        self.hedge = hedge
+        self.hedged = 0
+        # Bytes received from the wire and after decompression.
+        self.wire_bytes = 0
+        self.decoded_bytes = 0
+        self._latencies = collections.deque(maxlen=HEDGE_SAMPLES)
+        # Counters above are updated from every thread using the client.
+        self._stats_lock = threading.Lock()
         if (username and password) or (key and secret):
             self.authenticate(username, password, key, secret, access_token)
 
-        # This is the only way we can prevent socket hangs.
-        urllib2.socket.setdefaulttimeout(SOCKET_TIMEOUT)
-
     def is_authenticated(self):
         """
         If auth_header has data we asume that API is authenticated
@@ -121,7 +178,6 @@ class Twitter(object):
 
         elif key and secret:
             self._consumer = oauth.OAuthConsumer(key, secret)
-            self._connection = httplib.HTTPSConnection(SERVER)
             self._signature_method = oauth.OAuthSignatureMethod_HMAC_SHA1()
             if access_token: 
                 self.token = oauth.OAuthToken.from_string(access_token)
@@ -130,18 +186,17 @@ class Twitter(object):
             raise ValueError("You must specify either user/password or " \
                              "key/secret")
 
-    def _parse_response(self, response):
+    def _parse_response(self, response, endpoint=None):
         # Parse JSON response.
-        parsed = simplejson.loads(response)
-
-        if not parsed:
-            raise TwitterError("Empty response from twitter")
-
-        # Check if there is any error in response
-        if 'error' in parsed:
-            raise TwitterError(parsed['error'])
+        if self.hooks:
+            start = time.time()
+            parsed = simplejson.loads(response)
+            self.hooks.emit('parse', endpoint=endpoint, bytes=len(response),
+                            decode=time.time() - start)
+        else:
+            parsed = simplejson.loads(response)
 
-        return parsed
+        return check_response(parsed)
 
     def get_unauthorized_request_token(self):
         # Obtain unauthorized request_token to init OAuth autentication
@@ -151,7 +206,7 @@ class Twitter(object):
                                    None)
         resp = self._fetch_oauth_response(oauth_request)
         try:
-            token = oauth.OAuthToken.from_string(resp.read())
+            token = oauth.OAuthToken.from_string(resp.body)
         except KeyError:
             return None
 
@@ -175,17 +230,20 @@ class Twitter(object):
         oauth_request.sign_request(self._signature_method, self._consumer, 
                                    unauthed_token)
         resp = self._fetch_oauth_response(oauth_request)
-        return oauth.OAuthToken.from_string(resp.read())
+        return oauth.OAuthToken.from_string(resp.body)
 
-    def _fetch_oauth_response(self, oauth_request):
+    def _fetch_oauth_response(self, oauth_request, timeout=None, headers=None):
         # Fetch response using OAuth
         # @oauth_request: OAuth request object
-        url = oauth_request.to_url()
-        self._connection.request(oauth_request.http_method, url)
-        return self._connection.getresponse()
+        # @timeout: Socket timeout in seconds [optional]
+        # @headers: Extra HTTP headers [optional]
+        return self.transport.request(oauth_request.http_method,
+                                      oauth_request.to_url(), headers,
+                                      timeout=timeout or self.timeout)
 
-    def _fetchurl_with_oauth(self, url, get_data, post_data):
+    def _fetchurl_with_oauth(self, url, get_data, post_data, timeout=None):
         # Gets a OAuthRequest object and makes the request using this object.
+        # Returns a transport Response.
         assert not (get_data and post_data), \
             "You cannot specify both GET and POST parameters"
 
@@ -198,10 +256,13 @@ class Twitter(object):
         oauth_request.sign_request(self._signature_method, self._consumer, 
                                    self.token)
 
-        response = self._fetch_oauth_response(oauth_request)
-        return self._parse_response(response.read())
+        # We can handle compressed responses (see _read).
+        headers = {'Accept-Encoding': ACCEPT_ENCODING}
+        return self._fetch_oauth_response(oauth_request, timeout, headers)
 
-    def _fetchurl(self, uri, domain=None, post_data=None, get_data=None):
+    def _fetchurl(self, uri, domain=None, post_data=None, get_data=None,
+                  priority=PRIORITY_INTERACTIVE, timeout=None, deadline=None,
+                  raw=False):
         # Fetch a URL.
         #
         # @uri: The uri to retrive
@@ -210,6 +271,14 @@ class Twitter(object):
         #             included as parameters. [optional]
         # @get_data: A dictionary which will be encoded and added to query 
         #            string. [optional]
+        # @priority: Rate limiter priority. None means that the request
+        #            doesn't count against the rate limit. [optional]
+        # @timeout: Socket timeout in seconds for this call, defaults to
+        #           client timeout. [optional]
+        # @deadline: Absolute time (as in time.time()) when we give up,
+        #            retries included. [optional]
+        # @raw: Return the response body as is, with no JSON decoding (the
+        #       caller should check it with check_response). [optional]
         #
         # Returns: A parsed response or raise an error if field 
         #          'error' is found.
@@ -221,33 +290,270 @@ class Twitter(object):
         # Reduce dictionary. Remove empty values.
         post_data = dict([(k, v) for k, v in post_data.iteritems() if v])
         get_data = dict([(k, v) for k, v in get_data.iteritems() if v])
- 
+
         if hasattr(self, '_consumer'):
             # OAuth method!
             url = urlparse.urljoin("https://%s" % (domain or API_DOMAIN), uri)
-            return self._fetchurl_with_oauth(url, get_data, post_data)
+            send = lambda timeout: self._fetchurl_with_oauth(
+                url, get_data, post_data, timeout)
+        else:
+            # craft url
+            query = "?%s" % urllib.urlencode(get_data) if get_data else ''
+            url = urlparse.urljoin("http://%s" % (domain or API_DOMAIN),
+                                   uri + query)
 
-        # craft url
-        uri = "%s?%s" % (uri, urllib.urlencode(get_data)) if get_data else uri
-        url = urlparse.urljoin("http://%s" % (domain or API_DOMAIN), uri)
+            if isinstance(url, unicode):
+                url = url.encode(ENCODING)
 
-        if isinstance(url, unicode):
-            url = url.encode(ENCODING)
+            headers = {'Accept-Encoding': ACCEPT_ENCODING}
+            data = urllib.urlencode(post_data) or None
+            method = 'POST' if data else 'GET'
 
-        req = urllib2.Request(url)
-        post_data = urllib.urlencode(post_data) or None
-        
-        if self._auth_header:
-            req.add_header(*self._auth_header)
-    
-        try:
-            handle = urllib2.urlopen(req, post_data)
-        except urllib2.URLError, e:
-            ce = ConnectionError("Network error (%s)" % str(e))
-            ce.code = getattr(e, 'code', None)
-            raise ce
+            if self._auth_header:
+                headers.update([self._auth_header])
+
+            send = lambda timeout: self.transport.request(method, url, headers,
+                                                          data, timeout)
+
+        hedge = bool(self.hedge) and not post_data
+        body = self._send(send, urlparse.urlparse(url)[1], priority,
+                          idempotent=not post_data, hedge=hedge,
+                          timeout=timeout or self.timeout, deadline=deadline,
+                          endpoint=uri)
+        if raw:
+            return body
+
+        return self._parse_response(body, uri)
+
+    def _breaker(self, host):
+        # Get (or create) the circuit breaker for the given host.
+        if host not in self.circuit_breakers:
+            self.circuit_breakers[host] = CircuitBreaker()
+
+        return self.circuit_breakers[host]
 
-        return self._parse_response(handle.read())
+    def _read(self, send, timeout):
+        # Make a request with the given send function and keep some stats.
+        #
+        # Returns: transport Response
+        start = time.time()
+        response = send(timeout)
+        self._stats_lock.acquire()
+        self.wire_bytes += response.wire_bytes
+        self.decoded_bytes += len(response.body)
+        self._latencies.append(time.time() - start)
+        self._stats_lock.release()
+        return response
+
+    def _hedge_delay(self):
+        # Latency percentile after which a duplicate request is sent, or
+        # None if we don't have enough samples yet.
+        if len(self._latencies) < HEDGE_MIN_SAMPLES:
+            return None
+
+        self._stats_lock.acquire()
+        latencies = sorted(self._latencies)
+        self._stats_lock.release()
+        return latencies[int(self.hedge * (len(latencies) - 1))]
+
+    def _read_hedged(self, send, timeout, priority=None):
+        # Like _read but if the response takes longer than the hedge
+        # percentile a duplicate request is sent and the first one to
+        # succeed wins. The duplicate takes a hit from the budget too, and
+        # it's only sent if that doesn't mean waiting.
+        delay = self._hedge_delay()
+        if delay is None:
+            return self._read(send, timeout)
+
+        results = Queue.Queue()
+        def _run():
+            try:
+                results.put((True, self._read(send, timeout)))
+            except Exception, e:
+                results.put((False, e))
+
+        def _start():
+            # Daemon, so a hung request doesn't keep the interpreter alive.
+            thread = threading.Thread(target=_run)
+            thread.setDaemon(True)
+            thread.start()
+
+        _start()
+        pending = 1
+        try:
+            ok, result = results.get(timeout=delay)
+        except Queue.Empty:
+            if priority is None or \
+               self.rate_limiter.acquire(priority, time.time()) is not None:
+                self._stats_lock.acquire()
+                self.hedged += 1
+                self._stats_lock.release()
+                _start()
+                pending = 2
+            ok, result = results.get()
+
+        while not ok and pending > 1:
+            # First one failed, wait for the other.
+            pending -= 1
+            ok, result = results.get()
+
+        if not ok:
+            raise result
+
+        return result
+
+    def _send(self, send, host, priority, idempotent, hedge=False,
+              timeout=None, deadline=None, endpoint=None):
+        # Send a request retrying transient errors when it's idempotent.
+        #
+        # @send: Function that takes a timeout, makes the request and
+        #        returns the response
+        # @host: Host that is being requested, for the circuit breaker
+        # @priority: Rate limiter priority (None to skip the rate limiter)
+        # @idempotent: If it's safe to send the request more than once
+        # @hedge: If a duplicate request can be sent when the response is
+        #         slow [optional]
+        # @timeout: Socket timeout in seconds [optional]
+        # @deadline: Absolute time when we give up [optional]
+        # @endpoint: URI requested, for instrumentation events [optional]
+        #
+        # Returns: The response body or raise ConnectionError
+        breaker = self._breaker(host)
+        attempt = 0
+        while True:
+            if not breaker.allow():
+                raise CircuitOpenError("Too many errors from %s, try again "
+                                       "later" % host)
+
+            # Every way out of here must tell the breaker how it went, or
+            # a half-open breaker would reject every request from now on.
+            sent = False
+            try:
+                if priority is not None:
+                    wait = self.rate_limiter.acquire(priority, deadline)
+                    if wait is None:
+                        raise DeadlineExceeded("Rate limit wait exceeds the "
+                                               "deadline requesting %s" % host)
+                    if wait and self.hooks:
+                        self.hooks.emit('ratelimit', endpoint=endpoint,
+                                        priority=priority, wait=wait)
+
+                if deadline is not None:
+                    left = deadline - time.time()
+                    if left <= 0:
+                        raise DeadlineExceeded("Deadline exceeded requesting "
+                                               "%s" % host)
+                    timeout = min(timeout or left, left)
+
+                start = time.time()
+                response = error = None
+                sent = True
+                try:
+                    if hedge:
+                        response = self._read_hedged(send, timeout, priority)
+                    else:
+                        response = self._read(send, timeout)
+                except (urllib2.URLError, httplib.HTTPException,
+                        socket.error), e:
+                    error = ConnectionError("Network error (%s)" % str(e))
+                else:
+                    # HTTP errors have headers too (rate limit exceeded is
+                    # one).
+                    self.rate_limiter.update(response.headers)
+                    if response.code >= 400:
+                        error = ConnectionError("Network error (HTTP Error "
+                                                "%d: %s)" % (response.code,
+                                                             response.reason),
+                                                response.code)
+            except:
+                # Anything else (a corrupt gzip body, a failing transport)
+                # counts as a failure of the host, if we got to send it.
+                if sent:
+                    breaker.failure()
+                else:
+                    breaker.cancel()
+                raise
+
+            if error is None or not self.retry_policy.is_transient(error.code):
+                breaker.success()
+            else:
+                breaker.failure()
+
+            if self.hooks:
+                self._emit_request(endpoint, host, idempotent, attempt,
+                                   time.time() - start, response, error)
+
+            if error is None:
+                return response.body
+
+            if not idempotent or \
+               not self.retry_policy.should_retry(attempt, error.code):
+                raise error
+
+            wait = self.retry_policy.delay(attempt)
+            if deadline is not None and time.time() + wait >= deadline:
+                raise DeadlineExceeded("Deadline exceeded requesting %s (%s)" %
+                                       (host, error.message), error.code)
+
+            if self.hooks:
+                self.hooks.emit('retry', endpoint=endpoint, attempt=attempt,
+                                wait=wait, error=error)
+
+            time.sleep(wait)
+            attempt += 1
+            self._stats_lock.acquire()
+            self.retries += 1
+            self._stats_lock.release()
+
+    def _emit_request(self, endpoint, host, idempotent, attempt, elapsed,
+                      response, error):
+        # Emit a request event (see events module).
+        data = {
+            'endpoint': endpoint,
+            'method': 'GET' if idempotent else 'POST',
+            'host': host,
+            'attempt': attempt,
+            'elapsed': elapsed,
+            'error': error,
+            'status': error.code if error else response.code,
+            'wire_bytes': None,
+            'bytes': None,
+            'connect': None,
+            'ttfb': None,
+            'read': None,
+        }
+        if response is not None:
+            data.update(response.timings)
+            data['wire_bytes'] = response.wire_bytes
+            data['bytes'] = len(response.body)
+
+        self.hooks.emit('request', **data)
+
+    def _build(self, resultclass, data, endpoint):
+        # Build a TwitterObject from a parsed response.
+        if not self.hooks:
+            return resultclass(**data)
+
+        start = time.time()
+        result = resultclass(**data)
+        self.hooks.emit('construct', endpoint=endpoint,
+                        resultclass=resultclass.__name__, items=1,
+                        construct=time.time() - start)
+        return result
+
+    def connection_stats(self):
+        """
+        Returns retries done so far and circuit breakers state by host,
+        for monitoring.
+        """
+        return {
+            'retries': self.retries,
+            'hedged': self.hedged,
+            'wire_bytes': self.wire_bytes,
+            'decoded_bytes': self.decoded_bytes,
+            'breakers': dict([(host, breaker.stats()) for host, breaker \
+                              in self.circuit_breakers.iteritems()]),
+        }
 
     def _rate_remaining(self):
         """
@@ -258,39 +564,54 @@ class Twitter(object):
         for the authenticating user is returned.  Otherwise, the rate limit
         status for the requester's IP address is returned.
 
+        The value is cached by the rate limiter and kept up to date with
+        response headers, so twitter is only asked when we don't know the
+        budget for the current hour.
+
         >>> rate = api.rate_remaining
         150
 
         """
-        uri = '/account/rate_limit_status.json'
-        res = self._fetchurl(uri)
-        return res['remaining_hits']
+        if not self.rate_limiter.is_fresh():
+            uri = '/account/rate_limit_status.json'
+            self.rate_limiter.update_from_status(
+                self._fetchurl(uri, priority=None))
+
+        return self.rate_limiter.remaining
 
     rate_remaining = property(_rate_remaining)
 
     @authenticated
-    def follow(self, user):
+    def follow(self, user, timeout=None):
         """
         Enables device notifications for updates from the specified user.
         Returns the specified user when successful.
 
         @user: The ID or screen name of the user to follow with device updates.
+        @timeout: Socket timeout in seconds for this call, defaults to the
+                  client timeout. [optional]
         """
         uri = '/friendships/create/%s.json' % user
         data = {'follow': 'true'}
-        return TwitterUser(**self._fetchurl(uri, post_data=data))
+        return self._build(TwitterUser, self._fetchurl(uri, post_data=data,
+                                                       timeout=timeout), uri)
 
     @authenticated
-    def verify_credentials(self):
+    def verify_credentials(self, timeout=None):
         """
         Returns an HTTP 200 OK response code and a representation of the 
         requesting user if authentication was successful; returns None if not.
         Use this method to test if supplied user credentials are valid. 
+
+        @timeout: Socket timeout in seconds for this call, defaults to the
+                  client timeout. [optional]
         """
         uri = '/account/verify_credentials.json'        
-        return TwitterUser(**self._fetchurl(uri))
+        return self._build(TwitterUser, self._fetchurl(uri, timeout=timeout),
+                           uri)
 
-    def search(self, query, since_id=None, lang=None, geocode=None):
+    def search(self, query, since_id=None, lang=None, geocode=None,
+               max_id=None, timeout=None):
         """
         Returns tweets that match a specified query.
 
@@ -298,12 +619,16 @@ class Twitter(object):
                ISO 639-1 code. [optional]
         @since_id: Returns tweets with status ids greater than the given 
                    id. [optional]
+        @max_id: Returns tweets with status ids less than or equal to the
+                 given id. [optional]
         @geocode: Returns tweets by users located within a given radius 
                   of the given latitude/longitude, where the user's location 
                   is taken from their Twitter profile. The parameter value is
                   specified by "latitide,longitude,radius", where radius 
                   units must be specified as either "mi" (miles) or 
                   "km" (kilometers). [optional]
+        @timeout: Socket timeout in seconds for every request of the set,
+                  defaults to the client timeout. [optional]
 
         >>> search = api.search('from:testpy') # Data is not fetched
         >>> res = search[:10] # Data is fetched and cached.
@@ -316,17 +641,22 @@ class Twitter(object):
 
         """
         uri = '/search.json'
-        return TwitterSearchResultSet(self._fetchurl, uri, 
+        return TwitterSearchResultSet(self._fetchurl, uri, hooks=self.hooks,
                                       domain=SEARCH_API_DOMAIN,
                                       query=query, lang=lang, geocode=geocode,
-                                      since_id=since_id)
+                                      since_id=since_id, max_id=max_id or 0,
+                                      timeout=timeout)
 
-    def trends(self, exclude_hash=False, date=None, by=DATECURRENT):
+    def trends(self, exclude_hash=False, date=None, by=DATECURRENT,
+               timeout=None):
         """
         Returns the top ten topics that are currently trending on Twitter.
         The response includes the time of the request, the name of each trend,
         and the url to the Twitter Search results page for that topic.
 
+        @timeout: Socket timeout in seconds for this call, defaults to the
+                  client timeout. [optional]
+
         >>> for date, trends in api.trends().iteritems():
         ...     trends[0]
         <pytweet.objects.TwitterTrend object at 0x...>
@@ -341,9 +671,10 @@ class Twitter(object):
             'date': date,
         }
         return TwitterTrendSet(self._fetchurl(uri=uri, post_data=data,
-                                              domain=SEARCH_API_DOMAIN))
+                                              domain=SEARCH_API_DOMAIN,
+                                              timeout=timeout))
 
-    def update(self, msg, in_reply_to=0):
+    def update(self, msg, in_reply_to=0, timeout=None):
         """
         Updates the authenticating user's status. Requires the status 
         parameter specified below. A status update with text identical 
@@ -353,6 +684,8 @@ class Twitter(object):
               Statuses over 140 characters will be forceably truncated.
         @in_reply_to The ID of an existing status that the 
                      update is in reply to. [optional]
+        @timeout: Socket timeout in seconds for this call, defaults to the
+                  client timeout. [optional]
 
         >>> status = api.update('Big success!')
         >>> user.status.text
@@ -363,15 +696,18 @@ class Twitter(object):
             'in_reply_to_status_id': in_reply_to,
             'status': msg
         }
-        return TwitterStatus(**self._fetchurl(uri, post_data=data))
+        return self._build(TwitterStatus, self._fetchurl(uri, post_data=data,
+                                                         timeout=timeout), uri)
 
 
-    def user(self, user):
+    def user(self, user, timeout=None):
         """
         Returns extended information of a given user, specified by ID or
         screen name. The author's most recent status will be included.
 
         @user  The ID or screen name of a user. 
+        @timeout: Socket timeout in seconds for this call, defaults to the
+                  client timeout. [optional]
 
         >>> user = api.user('testpy')
         >>> user.name
@@ -383,16 +719,19 @@ class Twitter(object):
 
         """
         uri = '/users/show/%s.json' % user
-        return TwitterUser(**self._fetchurl(uri))
+        return self._build(TwitterUser, self._fetchurl(uri, timeout=timeout),
+                           uri)
 
     @authenticated
-    def followers(self, user=None):
+    def followers(self, user=None, timeout=None):
         """
         Returns the authenticating user's followers, each with current 
         status inline.  They are ordered by the order in which they 
         joined Twitter
 
         @user  The ID or screen name of a user [optional]
+        @timeout: Socket timeout in seconds for every request of the set,
+                  defaults to the client timeout. [optional]
 
         >>> for user in api.followers('testpy'):
         ...     user.name, user
@@ -401,10 +740,11 @@ class Twitter(object):
 
         """
         uri = '/statuses/followers.json'
-        return TwitterUserSet(self._fetchurl, uri, user=user)
+        return TwitterUserSet(self._fetchurl, uri, hooks=self.hooks, user=user,
+                              timeout=timeout)
 
     @authenticated
-    def friends(self, user=None):
+    def friends(self, user=None, timeout=None):
         """
         Returns a user's friends, each with current status. They are
         ordered by the order in which they were added as friends. Defaults to
@@ -412,6 +752,8 @@ class Twitter(object):
         another user's friends list via the user parameter.
 
         @user  The ID or screen name of a user [optional]
+        @timeout: Socket timeout in seconds for every request of the set,
+                  defaults to the client timeout. [optional]
 
         >>> for user in api.friends('testpy'):
         ...     user.name
@@ -424,15 +766,72 @@ class Twitter(object):
 
         """
         uri = '/statuses/friends.json'
-        return TwitterUserSet(self._fetchurl, uri, user=user)
+        return TwitterUserSet(self._fetchurl, uri, hooks=self.hooks, user=user,
+                              timeout=timeout)
+
+    @authenticated
+    def follower_ids(self, user, timeout=None):
+        """
+        Returns the ids of a user's followers, as a lazy set. Much cheaper
+        than followers() when users themselves are not needed: 5000 ids
+        per request, kept in int64 arrays. Call hydrate() on it to get
+        users, fetched only when accessed.
+
+        @user  The ID or screen name of a user
+        @timeout: Socket timeout in seconds for every request of the set,
+                  defaults to the client timeout. [optional]
+
+        >>> ids = api.follower_ids('testpy').ids()
+        >>> ids
+        array('l', [...])
+        >>> api.lookup_users(ids)[0]
+        <pytweet.objects.TwitterUser object at 0x...>
+
+        """
+        uri = '/followers/ids.json'
+        return TwitterIdSet(self._fetchurl, uri, hooks=self.hooks, user=user,
+                            timeout=timeout)
+
+    @authenticated
+    def friend_ids(self, user, timeout=None):
+        """
+        Returns the ids of the users a user follows, as a lazy set (see
+        follower_ids).
+
+        @user  The ID or screen name of a user
+        @timeout: Socket timeout in seconds for every request of the set,
+                  defaults to the client timeout. [optional]
+
+        >>> 'testpy' in [user.screen_name for user in
+        ...              api.friend_ids('reflejo').hydrate()]
+        True
+
+        """
+        uri = '/friends/ids.json'
+        return TwitterIdSet(self._fetchurl, uri, hooks=self.hooks, user=user,
+                            timeout=timeout)
+
+    def lookup_users(self, ids, timeout=None):
+        """
+        Returns users by id, lazily: they are fetched in bulk, 100 per
+        request, only when accessed (see setobjects.LazyUsers).
+
+        @ids  User ids
+        @timeout: Socket timeout in seconds for every request of the set,
+                  defaults to the client timeout. [optional]
+        """
+        return LazyUsers(self._fetchurl, ids, hooks=self.hooks,
+                         timeout=timeout)
 
     @authenticated
-    def destroy(self, id):
+    def destroy(self, id, timeout=None):
         """
         Destroys the status specified by the required ID parameter.
         The authenticating user must be the author of the specified status.
 
         @user  The ID of the status to delete 
+        @timeout: Socket timeout in seconds for this call, defaults to the
+                  client timeout. [optional]
 
         >>> api.destroy(12345)
         <pytweet.objects.TwitterStatus object at 0x...>
@@ -440,15 +839,23 @@ class Twitter(object):
         """
         uri = '/statuses/destroy/%d.json' % id
         data = {'delete': '1'}
-        return TwitterStatus(**self._fetchurl(uri, post_data=data))
+        return self._build(TwitterStatus, self._fetchurl(uri, post_data=data,
+                                                         timeout=timeout), uri)
 
-    def user_timeline(self, user=None):
+    def user_timeline(self, user=None, since_id=None, max_id=None,
+                      timeout=None):
         """
         Returns the most recent user's timeline via the id parameter. 
         This is the equivalent of the Web /<user> page for your own user, 
         or the profile page for a third party.
 
         @user  The ID or screen name of a user [optional]
+        @since_id  Returns statuses with ids greater than the given one
+                   [optional]
+        @max_id  Returns statuses with ids less than or equal to the given
+                 one [optional]
+        @timeout: Socket timeout in seconds for every request of the set,
+                  defaults to the client timeout. [optional]
 
         >>> for status in api.user_timeline('testpy'):
         ...     status.text
@@ -463,4 +870,6 @@ class Twitter(object):
                                "is not supplied")
 
         uri = '/statuses/user_timeline.json'
-        return TwitterStatusSet(self._fetchurl, uri, user=user)
+        return TwitterStatusSet(self._fetchurl, uri, hooks=self.hooks,
+                                user=user, since_id=since_id or 0,
+                                max_id=max_id or 0, timeout=timeout)
@@ -0,0 +1,94 @@
+"""
+A small pool of worker threads, used to run requests concurrently with
+a bounded number of connections.
+
+    >>> pool = WorkerPool(2)
+    >>> results = Queue.Queue()
+    >>> for i in range(4): pool.submit(results.put, i * i)
+    >>> pool.close()
+    >>> sorted([results.get() for i in range(4)])
+    [0, 1, 4, 9]
+
+"""
+
+import Queue
+import sys
+import threading
+
+
+class WorkerPool(object):
+    """
+    Runs submitted calls in up to `size` threads. Threads are started on
+    demand and are daemons, so a forgotten pool doesn't keep the process
+    alive. Exceptions raised by calls are handed to `errback(exc_info)`,
+    or ignored if there is none.
+
+    params are:
+        size: Max threads
+        errback: Function called with sys.exc_info() when a call fails.
+                 [optional]
+    """
+
+    def __init__(self, size, errback=None):
+        self.size = size
+        self.errback = errback
+        self._tasks = Queue.Queue()
+        self._threads = []
+        self._idle = 0
+        self._lock = threading.Lock()
+
+    def _run(self):
+        while True:
+            task = self._tasks.get()
+            if task is None:
+                return
+
+            func, args, kwargs = task
+            try:
+                func(*args, **kwargs)
+            except:
+                if self.errback is not None:
+                    self.errback(sys.exc_info())
+            finally:
+                self._lock.acquire()
+                self._idle += 1
+                self._lock.release()
+
+    def submit(self, func, *args, **kwargs):
+        """
+        Run func(*args, **kwargs) in a worker thread.
+        """
+        self._lock.acquire()
+        try:
+            if self._idle:
+                self._idle -= 1
+            elif len(self._threads) < self.size:
+                thread = threading.Thread(target=self._run)
+                thread.setDaemon(True)
+                thread.start()
+                self._threads.append(thread)
+        finally:
+            self._lock.release()
+
+        self._tasks.put((func, args, kwargs))
+
+    def close(self, wait=True, cancel=False):
+        """
+        Stop threads once submitted calls are done. With wait, block
+        until they are. With cancel, calls not started yet are dropped.
+        """
+        while cancel:
+            try:
+                self._tasks.get_nowait()
+            except Queue.Empty:
+                break
+
+        for thread in self._threads:
+            self._tasks.put(None)
+
+        if wait:
+            for thread in self._threads:
+                thread.join()
+
+        self._threads = []
+        self._idle = 0
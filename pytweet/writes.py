@@ -0,0 +1,259 @@
+"""
+Write queue for bulk updates and deletes. Operations are queued and
+sent from a few threads, paced by a token bucket, and every one of them
+reports its own result:
+
+    writes = WriteQueue(api, workers=4, rate=2)
+    ops = [writes.destroy(id) for id in ids]
+    writes.join()
+    failed = [op for op in ops if op.status == FAILED]
+
+Duplicates are collapsed: queuing an operation identical to one that is
+pending or running returns that one. Operations queued with a key
+supersede the pending operation with the same key, if it didn't start
+yet (like a scheduled update rewritten before it's posted).
+"""
+
+import sys
+import threading
+import time
+from ratelimit import TokenBucket
+from workers import WorkerPool
+
+# Concurrent writes by default.
+WORKERS = 4
+# Writes per second, and burst, by default.
+RATE = 1
+BURST = 5
+
+# Operation status
+PENDING, RUNNING, DONE, FAILED, SUPERSEDED = \
+    'pending', 'running', 'done', 'failed', 'superseded'
+
+
+class WriteOp(object):
+    """
+    A queued write.
+
+    params are:
+        method: Twitter method name ('update' or 'destroy')
+        args: Method arguments
+        key: Operations with the same key supersede each other [optional]
+        status: PENDING, RUNNING, DONE, FAILED or SUPERSEDED
+        result: What the method returned, when DONE
+        error: Exception raised, when FAILED
+    """
+
+    def __init__(self, method, args, key=None):
+        self.method = method
+        self.args = args
+        self.key = key
+        self.status = PENDING
+        self.result = None
+        self.error = None
+        self._done = threading.Event()
+
+    def __repr__(self):
+        return '<WriteOp %s%r %s>' % (self.method, self.args, self.status)
+
+    def done(self):
+        return self._done.isSet()
+
+    def wait(self, timeout=None):
+        """
+        Wait until the operation is finished. Returns its result, or
+        raises its error if it failed.
+        """
+        self._done.wait(timeout)
+        if self.status == FAILED:
+            raise self.error
+
+        return self.result
+
+
+class WriteQueue(object):
+    """
+    Runs updates and deletes with bounded concurrency and pacing.
+
+    params are:
+        api: Twitter instance (or TwitterPool)
+        workers: Max concurrent writes [optional]
+        rate: Max writes per second, None for no pacing [optional]
+        burst: Writes allowed in a burst [optional]
+        callback: Function called with every operation when it's
+                  finished, from a worker thread [optional]
+
+    >>> class API(object):
+    ...     def __init__(self):
+    ...         self.sent = []
+    ...         self.blocked = threading.Event()
+    ...     def update(self, msg, in_reply_to=0):
+    ...         self.blocked.wait()
+    ...         self.sent.append(msg)
+    ...         return msg.upper()
+    ...     def destroy(self, id):
+    ...         raise ValueError("No status %d" % id)
+    >>> api = API()
+    >>> writes = WriteQueue(api, workers=1, rate=None)
+    >>> first = writes.update('one')
+    >>> writes.update('one') is first
+    True
+    >>> draft = writes.update('two', key='draft')
+    >>> final = writes.update('three', key='draft')
+    >>> failed = writes.destroy(5)
+    >>> api.blocked.set()
+    >>> writes.join()
+    True
+    >>> first.wait(), draft, final.wait(), api.sent
+    ('ONE', <WriteOp update('two', 0) superseded>, 'THREE', ['one', 'three'])
+    >>> failed.status, failed.error
+    ('failed', ValueError('No status 5',))
+    >>> sorted(writes.stats.items())
+    [('collapsed', 1), ('done', 2), ('failed', 1), ('superseded', 1)]
+    >>> writes.close()
+
+    """
+
+    def __init__(self, api, workers=WORKERS, rate=RATE, burst=BURST,
+                 callback=None):
+        self.api = api
+        self.callback = callback
+        self.stats = {DONE: 0, FAILED: 0, SUPERSEDED: 0, 'collapsed': 0}
+        self._bucket = TokenBucket(rate, burst) if rate else None
+        self._bucket_lock = threading.Lock()
+        self._pool = WorkerPool(workers)
+        # Operations not finished, by (method, args) and by key.
+        self._active = {}
+        self._keyed = {}
+        self._cond = threading.Condition()
+
+    def update(self, msg, in_reply_to=0, key=None):
+        """
+        Queue a status update (see Twitter.update). Returns a WriteOp.
+        """
+        return self.submit(WriteOp('update', (msg, in_reply_to), key))
+
+    def destroy(self, id):
+        """
+        Queue a status delete (see Twitter.destroy). Returns a WriteOp.
+        """
+        return self.submit(WriteOp('destroy', (id,)))
+
+    def submit(self, op):
+        """
+        Queue an operation. Returns it, or the identical operation already
+        queued.
+        """
+        ident = (op.method, op.args)
+        superseded = None
+        self._cond.acquire()
+        try:
+            existing = self._active.get(ident)
+            if existing is not None:
+                self.stats['collapsed'] += 1
+                return existing
+
+            if op.key is not None:
+                old = self._keyed.get(op.key)
+                if old is not None and old.status == PENDING:
+                    del self._active[(old.method, old.args)]
+                    self._finish(old, SUPERSEDED)
+                    superseded = old
+                self._keyed[op.key] = op
+
+            self._active[ident] = op
+        finally:
+            self._cond.release()
+
+        if superseded is not None and self.callback is not None:
+            self.callback(superseded)
+
+        self._pool.submit(self._run, op)
+        return op
+
+    def _pace(self):
+        # Wait for a token.
+        if self._bucket is None:
+            return
+
+        while True:
+            self._bucket_lock.acquire()
+            try:
+                wait = self._bucket.take()
+            finally:
+                self._bucket_lock.release()
+
+            if not wait:
+                return
+            time.sleep(wait)
+
+    def _run(self, op):
+        # Worker: send an operation, unless it was superseded while it
+        # waited.
+        if op.status != PENDING:
+            return
+
+        self._pace()
+        self._cond.acquire()
+        try:
+            if op.status != PENDING:
+                return
+            op.status = RUNNING
+        finally:
+            self._cond.release()
+
+        try:
+            op.result = getattr(self.api, op.method)(*op.args)
+            status = DONE
+        except Exception:
+            op.error = sys.exc_info()[1]
+            status = FAILED
+
+        self._cond.acquire()
+        try:
+            del self._active[(op.method, op.args)]
+            if op.key is not None and self._keyed.get(op.key) is op:
+                del self._keyed[op.key]
+            self._finish(op, status)
+        finally:
+            self._cond.release()
+
+        if self.callback is not None:
+            self.callback(op)
+
+    def _finish(self, op, status):
+        # Mark an operation finished (lock held).
+        op.status = status
+        self.stats[status] += 1
+        op._done.set()
+        self._cond.notifyAll()
+
+    def __len__(self):
+        # Operations not finished
+        return len(self._active)
+
+    def join(self, timeout=None):
+        """
+        Wait until every queued operation is finished. Returns False if
+        the timeout expired first.
+        """
+        deadline = time.time() + timeout if timeout is not None else None
+        self._cond.acquire()
+        try:
+            while self._active:
+                if deadline is None:
+                    self._cond.wait(1)
+                else:
+                    left = deadline - time.time()
+                    if left <= 0:
+                        return False
+                    self._cond.wait(left)
+            return True
+        finally:
+            self._cond.release()
+
+    def close(self, wait=True):
+        """
+        Stop worker threads once queued operations are done.
+        """
+        self._pool.close(wait)
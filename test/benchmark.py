@@ -0,0 +1,174 @@
+"""
+End to end benchmarks. Runs the most used pytweet calls against the local
+mock server (see mockserver.py) and reports requests per second, latency
+percentiles and memory.
+
+Every benchmark runs in its own process, so its memory is not hidden by
+the peak of the ones before it.
+
+Usage: python benchmark.py [--items 1000] [--latency 0.01] [--repeat 3]
+"""
+
+import itertools
+import multiprocessing
+import optparse
+import os
+import resource
+import sys
+import time
+import urlparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from mockserver import MockTwitterServer
+from pytweet import Twitter
+from pytweet.transport import Transport, PooledTransport
+
+OAUTH_TOKEN = 'oauth_token=token&oauth_token_secret=secret'
+
+
+class LocalTransport(Transport):
+    """
+    Sends every request to the mock server, whatever its original host
+    is, and keeps the latency of each one.
+    """
+
+    def __init__(self, base_url, transport=None):
+        self.base = urlparse.urlsplit(base_url)
+        self.transport = transport or PooledTransport()
+        self.latencies = []
+
+    def request(self, method, url, headers=None, body=None, timeout=None):
+        parts = urlparse.urlsplit(url)
+        url = urlparse.urlunsplit((self.base[0], self.base[1]) + parts[2:])
+
+        start = time.time()
+        response = self.transport.request(method, url, headers, body, timeout)
+        self.latencies.append(time.time() - start)
+        return response
+
+    def close(self):
+        self.transport.close()
+
+
+def percentile(values, p):
+    if not values:
+        return 0
+
+    values = sorted(values)
+    return values[int(round(p * (len(values) - 1)))]
+
+
+def peak_memory():
+    # Peak resident memory in MB (ru_maxrss is KB on Linux, bytes on OSX).
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / (1024.0 * 1024 if sys.platform == 'darwin' else 1024.0)
+
+
+def bench_search(api, items):
+    return len(api.search('python')[:items])
+
+
+def bench_user_timeline(api, items):
+    return len(api.user_timeline('testpy')[:items])
+
+
+def bench_followers(api, items):
+    return len(list(itertools.islice(api.followers('testpy'), items)))
+
+
+BENCHMARKS = [
+    ('search', bench_search, {}),
+    ('user_timeline', bench_user_timeline, {}),
+    ('followers', bench_followers, {'username': 'testpy',
+                                    'password': 'testpy'}),
+    ('oauth user_timeline', bench_user_timeline, {'key': 'key',
+                                                  'secret': 'secret',
+                                                  'access_token': OAUTH_TOKEN}),
+]
+
+
+def run(name, func, credentials, url, items, repeat):
+    # Peak memory is reported above what the process had when it started.
+    baseline = peak_memory()
+    transport = LocalTransport(url)
+    api = Twitter(transport=transport, **credentials)
+
+    total_items = 0
+    start = time.time()
+    for i in xrange(repeat):
+        total_items += func(api, items)
+    elapsed = time.time() - start
+    transport.close()
+
+    latencies = transport.latencies
+    return {
+        'name': name,
+        'requests': len(latencies),
+        'items': total_items,
+        'seconds': elapsed,
+        'req/s': len(latencies) / elapsed,
+        'items/s': total_items / elapsed,
+        'p50': percentile(latencies, 0.5) * 1000,
+        'p90': percentile(latencies, 0.9) * 1000,
+        'p99': percentile(latencies, 0.99) * 1000,
+        'peak MB': peak_memory() - baseline,
+    }
+
+
+def run_isolated(*args):
+    # Run a benchmark in a child process and return its results.
+    pool = multiprocessing.Pool(1)
+    try:
+        return pool.apply(run, args)
+    finally:
+        pool.close()
+        pool.join()
+
+
+COLUMNS = ['name', 'requests', 'items', 'req/s', 'items/s', 'p50', 'p90',
+           'p99', 'peak MB']
+
+
+def report(results, out=sys.stdout):
+    out.write('%-22s' % COLUMNS[0])
+    out.write(''.join(['%12s' % col for col in COLUMNS[1:]]) + '\n')
+    for result in results:
+        out.write('%-22s' % result['name'])
+        for col in COLUMNS[1:]:
+            value = result[col]
+            out.write(('%12d' if isinstance(value, int) else '%12.2f') % value)
+        out.write('\n')
+
+    out.write('(latencies in milliseconds, peak MB above the process '
+              'baseline)\n')
+
+
+def main():
+    parser = optparse.OptionParser()
+    parser.add_option('--items', type='int', default=1000,
+                      help='items fetched by each walk')
+    parser.add_option('--latency', type='float', default=0,
+                      help='mock server latency in seconds')
+    parser.add_option('--error-rate', type='float', default=0,
+                      help='fraction of requests that fail with a 502')
+    parser.add_option('--repeat', type='int', default=3,
+                      help='walks per benchmark')
+    options, _ = parser.parse_args()
+
+    pages = options.items / 100 + 1
+    server = MockTwitterServer(latency=options.latency, pages=pages,
+                               error_rate=options.error_rate)
+    server.start()
+    try:
+        results = [run_isolated(name, func, credentials, server.url,
+                                options.items, options.repeat)
+                   for name, func, credentials in BENCHMARKS]
+    finally:
+        server.stop()
+
+    report(results)
+
+
+if __name__ == '__main__':
+    main()
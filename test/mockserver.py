@@ -0,0 +1,370 @@
+"""
+Local stub of the Twitter API, good enough to run the endpoints pytweet
+calls without the network: timelines, search, followers/friends (and
+their ids), trends, users, updates and deletes.
+
+Latency, the number of pages every listing has and the rate of injected
+errors can be configured, so it can be used for repeatable benchmarks.
+
+Usage:
+
+    >>> server = MockTwitterServer(latency=0.01, pages=5, error_rate=0.01)
+    >>> server.start()
+    >>> server.url
+    'http://127.0.0.1:...'
+    >>> server.stop()
+
+Or from the command line: python mockserver.py --port 8080 --pages 10
+"""
+
+import BaseHTTPServer
+import SocketServer
+import cgi
+import gzip
+import optparse
+import random
+import re
+import simplejson
+import StringIO
+import threading
+import time
+import urlparse
+
+BASE_ID = 4000000000
+ITEMS_PER_PAGE = 100
+IDS_PER_PAGE = 5000
+DATE = 'Wed Sep 23 17:18:47 +0000 2009'
+
+
+def make_user(id):
+    return {
+        'id': id,
+        'screen_name': 'user%d' % id,
+        'name': 'User &amp; %d' % id,
+        'created_at': DATE,
+        'description': 'Just a mock user &lt;3',
+        'followers_count': id % 1000,
+        'friends_count': id % 500,
+        'favourites_count': 0,
+        'statuses_count': 42,
+        'location': 'Buenos Aires',
+        'protected': False,
+        'profile_image_url': 'http://example.com/%d.png' % id,
+        'url': 'http://example.com/%d' % id,
+        'utc_offset': -10800,
+        'time_zone': 'Buenos Aires',
+        'status': make_status(BASE_ID + id, with_user=False),
+    }
+
+
+def make_status(id, user_id=1, with_user=True):
+    status = {
+        'id': id,
+        'created_at': DATE,
+        'text': 'Mock status #%d &amp; some more text to look real' % id,
+        'source': 'web',
+        'truncated': False,
+        'favorited': False,
+        'in_reply_to_status_id': None,
+        'in_reply_to_user_id': None,
+        'in_reply_to_screen_name': None,
+    }
+    if with_user:
+        status['user'] = make_user(user_id)
+
+    return status
+
+
+def make_search_result(id, query):
+    return {
+        'id': id,
+        'created_at': DATE,
+        'text': 'Result #%d for %s &quot;mock&quot;' % (id, query),
+        'from_user': 'user%d' % (id % 1000),
+        'from_user_id': id % 1000,
+        'to_user': None,
+        'to_user_id': None,
+        'iso_language_code': 'en',
+        'source': '&lt;a href=&quot;http://twitter.com/&quot;&gt;web&lt;/a&gt;',
+        'profile_image_url': 'http://example.com/%d.png' % (id % 1000),
+    }
+
+
+class MockHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """
+    Request handler. Configuration lives in the server (see
+    MockTwitterServer).
+    """
+
+    protocol_version = 'HTTP/1.1'
+    # Headers and body are written separately, don't wait for ACKs.
+    disable_nagle_algorithm = True
+
+    routes = [
+        (r'^/statuses/user_timeline\.json$', 'user_timeline'),
+        (r'^/statuses/(followers|friends)\.json$', 'users'),
+        (r'^/(followers|friends)/ids\.json$', 'ids'),
+        (r'^/users/lookup\.json$', 'lookup'),
+        (r'^/search\.json$', 'search'),
+        (r'^/trends/(current|daily|weekly)\.json$', 'trends'),
+        (r'^/users/show/([^/]+)\.json$', 'user'),
+        (r'^/account/verify_credentials\.json$', 'user'),
+        (r'^/account/rate_limit_status\.json$', 'rate_limit_status'),
+        (r'^/statuses/update\.json$', 'update'),
+        (r'^/statuses/destroy/(\d+)\.json$', 'destroy'),
+        (r'^/friendships/create/([^/]+)\.json$', 'user'),
+    ]
+
+    def log_message(self, *args):
+        pass
+
+    def _params(self):
+        parts = urlparse.urlsplit(self.path)
+        params = dict(cgi.parse_qsl(parts[3]))
+        if self.command == 'POST':
+            length = int(self.headers.get('content-length') or 0)
+            params.update(cgi.parse_qsl(self.rfile.read(length)))
+
+        return parts[2], params
+
+    def _reply(self, code, data):
+        body = simplejson.dumps(data)
+        headers = {'Content-Type': 'application/json'}
+        if self.server.rate_limit:
+            remaining, reset = self.server.rate_status()
+            headers.update({
+                'X-RateLimit-Limit': str(self.server.rate_limit),
+                'X-RateLimit-Remaining': str(remaining),
+                'X-RateLimit-Reset': str(reset),
+            })
+
+        if 'gzip' in (self.headers.get('accept-encoding') or ''):
+            buf = StringIO.StringIO()
+            gz = gzip.GzipFile(fileobj=buf, mode='wb')
+            gz.write(body)
+            gz.close()
+            body = buf.getvalue()
+            headers['Content-Encoding'] = 'gzip'
+
+        self.send_response(code)
+        headers['Content-Length'] = str(len(body))
+        for name, value in headers.iteritems():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _handle(self):
+        server = self.server
+        path, params = self._params()
+        server.count_request(path)
+
+        if server.latency:
+            time.sleep(random.uniform(server.latency * 0.5,
+                                      server.latency * 1.5))
+
+        if server.error_rate and random.random() < server.error_rate:
+            return self._reply(502, {'error': 'Injected error'})
+
+        for regex, name in self.routes:
+            match = re.match(regex, path)
+            if match:
+                args = match.groups()
+                return self._reply(200, getattr(self, name)(params, *args))
+
+        self._reply(404, {'error': 'Not found'})
+
+    do_GET = do_POST = _handle
+
+    def _page_ids(self, params, per_page):
+        # Ids for the requested page, newest first, honouring max_id and
+        # since_id. Listings have server.pages full pages.
+        page = int(params.get('page', 1))
+        if page > self.server.pages:
+            return []
+
+        top = int(params.get('max_id') or BASE_ID)
+        since_id = int(params.get('since_id') or 0)
+        first = top - (page - 1) * per_page
+        return [id for id in xrange(first, first - per_page, -1)
+                if id > since_id]
+
+    def user_timeline(self, params):
+        count = int(params.get('count', 20))
+        return [make_status(id) for id in self._page_ids(params, count)]
+
+    def users(self, params, kind):
+        return [make_user(BASE_ID - id + 1)
+                for id in self._page_ids(params, ITEMS_PER_PAGE)]
+
+    def ids(self, params, kind):
+        # Same users as the listings, IDS_PER_PAGE per cursor.
+        cursor = int(params.get('cursor', -1))
+        page = 1 if cursor == -1 else cursor
+        first = (page - 1) * IDS_PER_PAGE
+        total = self.server.pages * ITEMS_PER_PAGE
+        return {
+            'ids': range(first + 1, min(first + IDS_PER_PAGE, total) + 1),
+            'next_cursor': page + 1 if first + IDS_PER_PAGE < total else 0,
+            'previous_cursor': page - 1 if page > 1 else 0,
+        }
+
+    def lookup(self, params):
+        return [make_user(int(id))
+                for id in params.get('user_id', '').split(',') if id]
+
+    def search(self, params):
+        rpp = int(params.get('rpp', 15))
+        ids = self._page_ids(params, rpp)
+        return {
+            'results': [make_search_result(id, params.get('q', ''))
+                        for id in ids],
+            'max_id': ids[0] if ids else int(params.get('since_id') or 0),
+            'since_id': int(params.get('since_id') or 0),
+            'completed_in': 0.01,
+            'page': int(params.get('page', 1)),
+            'query': params.get('q', ''),
+        }
+
+    def trends(self, params, by):
+        now = time.time()
+        trends = {}
+        for hour in xrange(3 if by != 'current' else 1):
+            date = time.strftime('%Y-%m-%d %H:%M:%S',
+                                 time.gmtime(now - hour * 3600))
+            trends[date] = [{'name': '#trend%d' % i,
+                             'query': '#trend%d' % i,
+                             'url': 'http://search.twitter.com/?q=%d' % i}
+                            for i in xrange(10)]
+        return {'as_of': int(now), 'trends': trends}
+
+    def user(self, params, name='testpy'):
+        return make_user(abs(hash(name)) % 100000)
+
+    def rate_limit_status(self, params):
+        remaining, reset = self.server.rate_status()
+        return {
+            'remaining_hits': remaining,
+            'hourly_limit': self.server.rate_limit,
+            'reset_time_in_seconds': reset,
+        }
+
+    def update(self, params):
+        status = make_status(self.server.next_status_id())
+        status['text'] = params.get('status', '')
+        return status
+
+    def destroy(self, params, id):
+        return make_status(int(id))
+
+
+class MockTwitterServer(SocketServer.ThreadingMixIn,
+                        BaseHTTPServer.HTTPServer):
+    """
+    Threaded mock server.
+
+    params are:
+        host, port: Where to listen. Port 0 takes any free port. [optional]
+        latency: Mean latency added to every response in seconds. [optional]
+        pages: Full pages every listing has. [optional]
+        error_rate: Fraction of requests answered with a 502. [optional]
+        rate_limit: Hourly requests limit, sent in X-RateLimit-* headers.
+                    None (no headers) by default, so clients don't pace
+                    requests. [optional]
+    """
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, host='127.0.0.1', port=0, latency=0, pages=10,
+                 error_rate=0, rate_limit=None):
+        BaseHTTPServer.HTTPServer.__init__(self, (host, port), MockHandler)
+        self.latency = latency
+        self.pages = pages
+        self.error_rate = error_rate
+        self.rate_limit = rate_limit
+        self.started = time.time()
+        self.requests = {}
+        # Requests in the current rate limit hour, and which hour it is.
+        self.window_requests = 0
+        self._window = 0
+        self._last_status_id = BASE_ID
+        self._lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def url(self):
+        return 'http://%s:%d' % self.server_address
+
+    def _current_window(self):
+        # Start a new rate limit window every hour (lock held).
+        window = int((time.time() - self.started) / 3600)
+        if window != self._window:
+            self._window = window
+            self.window_requests = 0
+
+        return window
+
+    def count_request(self, path):
+        self._lock.acquire()
+        try:
+            self.requests[path] = self.requests.get(path, 0) + 1
+            self._current_window()
+            self.window_requests += 1
+        finally:
+            self._lock.release()
+
+    def next_status_id(self):
+        # Ids for posted statuses, above every listed one.
+        self._lock.acquire()
+        try:
+            self._last_status_id += 1
+            return self._last_status_id
+        finally:
+            self._lock.release()
+
+    def rate_status(self):
+        """
+        Returns (remaining hits, reset time) for the current hour.
+        """
+        self._lock.acquire()
+        try:
+            window = self._current_window()
+            used = self.window_requests
+        finally:
+            self._lock.release()
+
+        reset = int(self.started + (window + 1) * 3600)
+        return max((self.rate_limit or 0) - used, 0), reset
+
+    def start(self):
+        """
+        Serve requests in a background thread.
+        """
+        self._thread = threading.Thread(target=self.serve_forever)
+        self._thread.setDaemon(True)
+        self._thread.start()
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+def main():
+    parser = optparse.OptionParser()
+    parser.add_option('--host', default='127.0.0.1')
+    parser.add_option('--port', type='int', default=8080)
+    parser.add_option('--latency', type='float', default=0)
+    parser.add_option('--pages', type='int', default=10)
+    parser.add_option('--error-rate', type='float', default=0)
+    parser.add_option('--rate-limit', type='int', default=None)
+    options, _ = parser.parse_args()
+
+    server = MockTwitterServer(options.host, options.port, options.latency,
+                               options.pages, options.error_rate,
+                               options.rate_limit)
+    print 'Serving on %s' % server.url
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,121 @@
+"""
+Performance regression harness. Replays a cassette of recorded API
+responses at full speed, so only the library itself (parsing, object
+construction and pagination) is measured, and compares throughput with a
+saved baseline. Exits with an error when any benchmark is slower than the
+baseline by more than the threshold.
+
+The cassette is recorded from the local mock server the first time.
+
+Usage:
+
+    $ python regression.py --save-baseline   # Before your change
+    $ python regression.py --threshold 0.1   # After your change
+"""
+
+import optparse
+import os
+import simplejson
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import benchmark
+from mockserver import MockTwitterServer
+from pytweet import Twitter
+from pytweet.cassette import RecordingTransport, ReplayTransport
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+CASSETTE = os.path.join(HERE, 'regression.cassette')
+BASELINE = os.path.join(HERE, 'regression-baseline.json')
+
+
+def record(path, items):
+    # Record every benchmark walk from the mock server.
+    server = MockTwitterServer(pages=items / 100 + 1)
+    server.start()
+    try:
+        for name, func, credentials in benchmark.BENCHMARKS:
+            transport = RecordingTransport(
+                path, benchmark.LocalTransport(server.url))
+            func(Twitter(transport=transport, **credentials), items)
+            transport.close()
+    finally:
+        server.stop()
+
+
+def measure(path, items, repeat):
+    # Returns {benchmark name: items per second}, best of `repeat` runs.
+    results = {}
+    for name, func, credentials in benchmark.BENCHMARKS:
+        best = None
+        for i in xrange(repeat):
+            api = Twitter(transport=ReplayTransport(path), **credentials)
+            start = time.time()
+            count = func(api, items)
+            elapsed = time.time() - start
+            best = elapsed if best is None else min(best, elapsed)
+        results[name] = count / best
+
+    return results
+
+
+def compare(baseline, results, threshold, out=sys.stdout):
+    # Prints a report and returns the names of regressed benchmarks.
+    regressed = []
+    out.write('%-22s%14s%14s%10s\n' % ('name', 'baseline', 'items/s',
+                                       'change'))
+    for name in sorted(results):
+        before = baseline.get(name)
+        after = results[name]
+        if not before:
+            out.write('%-22s%14s%14.1f%10s\n' % (name, '-', after, '-'))
+            continue
+
+        change = (after - before) / before
+        out.write('%-22s%14.1f%14.1f%+9.1f%%\n' % (name, before, after,
+                                                   change * 100))
+        if change < -threshold:
+            regressed.append(name)
+
+    return regressed
+
+
+def main():
+    parser = optparse.OptionParser()
+    parser.add_option('--items', type='int', default=2000,
+                      help='items fetched by each walk')
+    parser.add_option('--repeat', type='int', default=5,
+                      help='runs per benchmark, the best one is used')
+    parser.add_option('--threshold', type='float', default=0.1,
+                      help='max allowed throughput drop (0.1 is 10%)')
+    parser.add_option('--cassette', default=CASSETTE)
+    parser.add_option('--baseline', default=BASELINE)
+    parser.add_option('--save-baseline', action='store_true', default=False,
+                      help='save results as the new baseline')
+    options, _ = parser.parse_args()
+
+    if not os.path.exists(options.cassette):
+        record(options.cassette, options.items)
+
+    results = measure(options.cassette, options.items, options.repeat)
+
+    if options.save_baseline or not os.path.exists(options.baseline):
+        baseline_file = open(options.baseline, 'w')
+        simplejson.dump(results, baseline_file, indent=2)
+        baseline_file.close()
+        print 'Baseline saved to %s' % options.baseline
+        return 0
+
+    baseline = simplejson.load(open(options.baseline))
+    regressed = compare(baseline, results, options.threshold)
+    if regressed:
+        print 'Throughput regression in: %s' % ', '.join(regressed)
+        return 1
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,5 +1,9 @@
 import doctest
 from pytweet import Twitter
+from pytweet import archive, cassette, columns, compression, events, \
+                    export, graph, metrics, multisearch, parallel, pool, \
+                    ratelimit, retry, scheduler, seen, setobjects, store, \
+                    textindex, transport, trends, workers, writes
 
 api = Twitter(username='testpy', password='testpy')
 globs = {
@@ -8,3 +12,27 @@ globs = {
 }
 doctest.testfile('../pytweet/tweet.py', globs=globs, 
                  optionflags=doctest.ELLIPSIS)
+
+# Offline tests
+doctest.testmod(ratelimit, optionflags=doctest.ELLIPSIS)
+doctest.testmod(retry, optionflags=doctest.ELLIPSIS)
+doctest.testmod(compression, optionflags=doctest.ELLIPSIS)
+doctest.testmod(events, optionflags=doctest.ELLIPSIS)
+doctest.testmod(metrics, optionflags=doctest.ELLIPSIS)
+doctest.testmod(transport, optionflags=doctest.ELLIPSIS)
+doctest.testmod(cassette, optionflags=doctest.ELLIPSIS)
+doctest.testmod(store, optionflags=doctest.ELLIPSIS)
+doctest.testmod(export, optionflags=doctest.ELLIPSIS)
+doctest.testmod(archive, optionflags=doctest.ELLIPSIS)
+doctest.testmod(columns, optionflags=doctest.ELLIPSIS)
+doctest.testmod(parallel, optionflags=doctest.ELLIPSIS)
+doctest.testmod(workers, optionflags=doctest.ELLIPSIS)
+doctest.testmod(multisearch, optionflags=doctest.ELLIPSIS)
+doctest.testmod(scheduler, optionflags=doctest.ELLIPSIS)
+doctest.testmod(setobjects, optionflags=doctest.ELLIPSIS)
+doctest.testmod(seen, optionflags=doctest.ELLIPSIS)
+doctest.testmod(graph, optionflags=doctest.ELLIPSIS)
+doctest.testmod(textindex, optionflags=doctest.ELLIPSIS)
+doctest.testmod(trends, optionflags=doctest.ELLIPSIS)
+doctest.testmod(writes, optionflags=doctest.ELLIPSIS)
+doctest.testmod(pool, optionflags=doctest.ELLIPSIS)